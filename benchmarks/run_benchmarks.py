@@ -0,0 +1,624 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from os.path import abspath, dirname, exists, join
+
+import numpy as np
+
+lib_path = dirname(dirname(abspath(__file__)))
+if lib_path not in sys.path:
+  sys.path.append(lib_path)
+
+from lib.price_data import Oracle, MultiAssetOracle
+from lib.deltafi_amm import DeltafiAMM
+from lib.uniswap_amm import UniswapAMM
+from lib.internal_arb_amm import DeltafiInternalArbAMM, UniswapInternalArbAMM
+from lib.trading_bots import ArbAgent, RetailAgentPool
+from lib.simulation import run_swap_simulation, run_event_simulation, run_lp_simulation, SimulationState
+from lib.rng import RandomStreams
+from lib.synthetic_data import MODELS, generate_synthetic_paths
+from lib.batch_simulation import (
+  PoolRegistry, run_batch_swap_simulation, run_registry_swap_simulation, _draw_step_trades, RETAIL_MAX_PRICE_RANGE,
+  DRAW_SIDE, DRAW_PRICE_JITTER_A, DRAW_PRICE_JITTER_B, DRAW_SIZE, DRAW_PRICE_TOLERANCE)
+from lib.router import Router
+from lib.trade_tape import generate_trade_tape
+from lib.fast_simulation import run_fast_swap_simulation
+from lib.kernels import HAS_NUMBA
+
+'''
+benchmark suite for amm quoting, swapping, arbitrage, lp bookkeeping and full simulation throughput
+everything runs on a seeded synthetic oracle, so no data dump is needed
+
+  python benchmarks/run_benchmarks.py                     compare against baseline.json
+  python benchmarks/run_benchmarks.py --update-baseline   store the current numbers as the baseline
+
+ops/s depend on the machine, so the baseline stores every result relative to a fixed pure python reference kernel
+timed alongside it (see reference_kernel and measure_relative), along with the commit and the machine it was
+measured on, and the comparison is between the relative numbers
+'''
+
+BASELINE_FILENAME = join(dirname(abspath(__file__)), "baseline.json")
+SEED = 0
+NUM_ORACLE_STEPS = 100000
+INITIAL_RESERVE_B = 1000
+
+''' geometric brownian motion price path around 2000 USDC/ETH with conf interval of ~0.05% of the price '''
+def get_synthetic_oracle(num_steps=NUM_ORACLE_STEPS) -> Oracle:
+  rng = np.random.default_rng(SEED)
+  price_history = 2000 * np.exp(np.cumsum(rng.normal(0, 0.001, num_steps)))
+  conf_intervals = price_history * 0.0005 * rng.random(num_steps)
+  return Oracle(price_history, conf_intervals)
+
+MULTI_ASSET_NAMES = ["USDC", "ETH", "BTC", "SOL"]
+MULTI_ASSET_PAIRS = [("USDC", "ETH"), ("USDC", "BTC"), ("ETH", "BTC"), ("USDC", "SOL")]
+
+''' the same kind of paths for USDC (fixed at 1), ETH, BTC and SOL, in USD '''
+def get_multi_asset_oracle(num_steps) -> MultiAssetOracle:
+  rng = np.random.default_rng(SEED)
+  initial_prices = np.array([1, 2000, 30000, 20])
+  price_history = initial_prices * np.exp(np.cumsum(rng.normal(0, 0.001, (num_steps, 4)), axis=0))
+  price_history[:, 0] = 1
+  return MultiAssetOracle(MULTI_ASSET_NAMES, price_history, price_history * 0.0005)
+
+def get_amm(variant, oracle: Oracle, backend="python"):
+  initial_reserve_A = INITIAL_RESERVE_B * oracle.get_price()
+  if variant == "deltafi":
+    return DeltafiAMM(initial_reserve_A, INITIAL_RESERVE_B, oracle, fee_rate=0.001, backend=backend)
+  if variant == "deltafi_price_adjustment":
+    return DeltafiAMM(initial_reserve_A, INITIAL_RESERVE_B, oracle, fee_rate=0.001, enable_price_adjustment=True, backend=backend)
+  if variant == "deltafi_conf_interval":
+    return DeltafiAMM(initial_reserve_A, INITIAL_RESERVE_B, oracle, fee_rate=0.001, enable_conf_interval=True, backend=backend)
+  if variant == "deltafi_ema_quote":
+    return DeltafiAMM(initial_reserve_A, INITIAL_RESERVE_B, oracle, fee_rate=0.001, price_mode="ema", price_window=60, backend=backend)
+  if variant == "uniswap":
+    return UniswapAMM(initial_reserve_A, INITIAL_RESERVE_B, oracle, fee_rate=0.003, backend=backend)
+  if variant == "deltafi_internal_arb":
+    return DeltafiInternalArbAMM(initial_reserve_A, INITIAL_RESERVE_B, oracle, fee_rate=0.001, backend=backend)
+  if variant == "uniswap_internal_arb":
+    return UniswapInternalArbAMM(initial_reserve_A, INITIAL_RESERVE_B, oracle, fee_rate=0.003, backend=backend)
+  raise ValueError("unknown amm variant: " + variant)
+
+AMM_VARIANTS = [
+  "deltafi", "deltafi_price_adjustment", "deltafi_conf_interval", "uniswap", "deltafi_internal_arb", "uniswap_internal_arb",
+]
+
+'''
+every benchmark is a setup function returning (run, num_ops)
+run() performs num_ops operations, the result is reported in operations per second
+'''
+
+''' get_swap_out_A/B with varying sizes, the oracle steps every 10 quotes '''
+def bench_quote(variant, backend="python"):
+  def setup():
+    oracle = get_synthetic_oracle()
+    amm = get_amm(variant, oracle, backend)
+    sizes = (np.random.default_rng(SEED).random(1000) * 2000).tolist()
+    ''' builds the oracle window series a twap / ema quote reads '''
+    if hasattr(amm, "get_quote_price"):
+      amm.get_quote_price()
+
+    def run():
+      for i in range(0, len(sizes), 2):
+        amm.get_swap_out_B(sizes[i])
+        amm.get_swap_out_A(sizes[i + 1] / 2000)
+        if i % 10 == 0:
+          oracle.step_foward()
+    return run, len(sizes)
+  return setup
+
+''' the sizes of bench_quote as two quote ladders (get_swap_out_A/B_ladder) per oracle step, 10 steps '''
+def bench_quote_ladder(variant):
+  def setup():
+    oracle = get_synthetic_oracle()
+    amm = get_amm(variant, oracle)
+    sizes = np.random.default_rng(SEED).random(1000) * 2000
+    sizes_A, sizes_B = sizes[0::2], sizes[1::2] / 2000
+
+    def run():
+      for _ in range(10):
+        amm.get_swap_out_B_ladder(sizes_A)
+        amm.get_swap_out_A_ladder(sizes_B)
+        oracle.step_foward()
+    return run, 10 * len(sizes)
+  return setup
+
+''' alternating swap_A_for_B/swap_B_for_A with varying sizes, the oracle steps every 10 swaps '''
+def bench_swap(variant, backend="python"):
+  def setup():
+    oracle = get_synthetic_oracle()
+    amm = get_amm(variant, oracle, backend)
+    sizes = (np.random.default_rng(SEED).random(1000) * 2000).tolist()
+
+    def run():
+      for i in range(0, len(sizes), 2):
+        amm.swap_A_for_B(sizes[i])
+        amm.swap_B_for_A(sizes[i + 1] / 2000)
+        if i % 10 == 0:
+          oracle.step_foward()
+    return run, len(sizes)
+  return setup
+
+'''
+ArbAgent.maybe_execute_trade, one call per oracle step
+every call follows a retail swap pushing the pool off price (the swap is part of the timed op),
+otherwise the pool mostly stays within the fee band and the arbitrage search is never entered
+'''
+def bench_arb_agent(variant, arb_mode):
+  def setup():
+    random.seed(SEED)
+    oracle = get_synthetic_oracle()
+    amm = get_amm(variant, oracle)
+    agent = ArbAgent(oracle, arb_mode)
+    sizes = (np.random.default_rng(SEED).random(200) * 2 - 1).tolist()
+
+    def run():
+      for size in sizes:
+        if size > 0:
+          amm.swap_A_for_B(size * 20000)
+        else:
+          amm.swap_B_for_A(-size * 10)
+        agent.maybe_execute_trade(amm)
+        oracle.step_foward()
+    return run, len(sizes)
+  return setup
+
+''' lp bot update_record with a full book of max_deposit_record deposits, one call per cycle '''
+def bench_lp_bot(variant, max_deposit_record):
+  def setup():
+    random.seed(SEED)
+    oracle = get_synthetic_oracle()
+    amm = get_amm(variant, oracle)
+    lp_bot = amm.get_lp_bot(max_deposit_record=max_deposit_record, min_holding_cycles=max_deposit_record)
+    for cycle in range(max_deposit_record):
+      lp_bot.update_record(cycle)
+    state = {"cycle": max_deposit_record}
+    num_ops = 1000
+
+    def run():
+      for _ in range(num_ops):
+        lp_bot.update_record(state["cycle"])
+        state["cycle"] += 1
+    return run, num_ops
+  return setup
+
+'''
+run_swap_simulation steps over deltafi, deltafi internal arb and uniswap pools
+with streams=True the agents draw from seeded RandomStreams instead of the random module,
+with tape=True a trade tape is generated (inside the timed run) and replayed against the pools,
+sampling is the sampling mode of the active traders
+'''
+def bench_swap_simulation(num_retail_traders, num_arb_traders, streams=False, tape=False, sampling="shuffle", fast=False):
+  def setup():
+    num_steps = 200
+
+    def run():
+      random.seed(SEED)
+      oracle = get_synthetic_oracle(num_steps + 1)
+      amm_list = [get_amm(variant, oracle) for variant in ["deltafi", "deltafi_internal_arb", "uniswap"]]
+      rng = RandomStreams(SEED) if streams else random
+      trade_tape = generate_trade_tape(num_steps, num_retail_traders, num_arb_traders, seed=SEED) if tape else None
+      run_swap_simulation(num_retail_traders, num_arb_traders, 0.5, oracle, amm_list, max_steps=num_steps, rng=rng, tape=trade_tape, sampling=sampling, fast=fast)
+    return run, num_steps
+  return setup
+
+'''
+SimulationState of an lp run on every amm variant (1000 deposit records per deltafi pool) warmed up for 200 steps,
+op is "fork" (SimulationState.fork) or "snapshot" (get_snapshot then restore), in operations per second
+'''
+def bench_simulation_state(op):
+  def setup():
+    oracle = get_synthetic_oracle(1000)
+    amm_list = [get_amm(variant, oracle) for variant in ["deltafi", "deltafi_price_adjustment", "uniswap"]]
+    state = SimulationState(100, 10, oracle, amm_list, rng=RandomStreams(SEED))
+    with contextlib.redirect_stdout(io.StringIO()):
+      run_lp_simulation(100, 10, 0.5, oracle, amm_list, max_steps=200, state=state)
+    num_ops = 100
+
+    def run():
+      for _ in range(num_ops):
+        if op == "fork":
+          state.fork()
+        else:
+          state.restore(state.get_snapshot())
+    return run, num_ops
+  return setup
+
+'''
+run_event_simulation over a sparse horizon: about one arrival every 100 oracle steps, in oracle steps per second
+'''
+def bench_event_simulation():
+  def setup():
+    oracle = get_synthetic_oracle()
+    amm_list = [get_amm(variant, oracle) for variant in ["deltafi", "deltafi_internal_arb", "uniswap"]]
+
+    def run():
+      run_event_simulation(100, 10, oracle, amm_list, arrival_rate=0.01, rng=RandomStreams(SEED))
+    return run, oracle.max_index
+  return setup
+
+'''
+monte carlo paths of 20 steps with 100 retail and 10 arb traders on a deltafi and a uniswap pool, in paths per second
+num_paths=None runs the paths one by one through run_swap_simulation, otherwise run_batch_swap_simulation runs num_paths at once
+'''
+def bench_swap_paths(num_paths=None):
+  def setup():
+    num_steps = 20
+    num_runs = 20 if num_paths is None else 1
+
+    def run():
+      random.seed(SEED)
+      for _ in range(num_runs):
+        oracle = get_synthetic_oracle(num_steps + 1)
+        amm_list = [get_amm(variant, oracle) for variant in ["deltafi", "uniswap"]]
+        if num_paths is None:
+          run_swap_simulation(100, 10, 0.5, oracle, amm_list, max_steps=num_steps)
+        else:
+          run_batch_swap_simulation(100, 10, 0.5, oracle, amm_list, num_paths, seed=SEED, max_steps=num_steps)
+    return run, num_runs * (num_paths or 1)
+  return setup
+
+'''
+run_registry_swap_simulation over num_pools pools on the pairs of 4 assets, in pool steps per second
+half of the pools are deltafi pools, half uniswap pools
+'''
+def bench_registry_simulation(num_pools):
+  def setup():
+    num_steps = 50
+    oracle = get_multi_asset_oracle(num_steps + 1)
+    registry = PoolRegistry(oracle)
+    for i in range(num_pools):
+      asset_A, asset_B = MULTI_ASSET_PAIRS[i % len(MULTI_ASSET_PAIRS)]
+      pair_oracle = oracle.get_pair_oracle(asset_A, asset_B)
+      variant = "deltafi" if i % 2 == 0 else "uniswap"
+      registry.add_pool(get_amm(variant, pair_oracle), asset_A, asset_B)
+
+    def run():
+      run_registry_swap_simulation(100, 10, 0.5, registry, seed=SEED, max_steps=num_steps)
+    return run, num_pools * num_steps
+  return setup
+
+'''
+retail and arb trades on USDC-BTC through a router over deltafi pools on every pair of MULTI_ASSET_PAIRS
+and a uniswap USDC-BTC pool, 30 trade attempts per step
+'''
+def bench_router_trades():
+  def setup():
+    num_steps = 200
+    oracle = get_multi_asset_oracle(num_steps + 1)
+    router = Router(oracle)
+    for asset_A, asset_B in MULTI_ASSET_PAIRS:
+      router.add_pool(get_amm("deltafi", oracle.get_pair_oracle(asset_A, asset_B)), asset_A, asset_B)
+    router.add_pool(get_amm("uniswap", oracle.get_pair_oracle("USDC", "BTC")), "USDC", "BTC")
+    pair = router.get_pair("USDC", "BTC")
+    pair_oracle = oracle.get_pair_oracle("USDC", "BTC")
+    rng = random.Random(SEED)
+    retail_traders = RetailAgentPool(pair_oracle, 100, rng)
+    arb_trader = ArbAgent(pair_oracle, "search", rng)
+
+    def run():
+      for _ in range(num_steps):
+        for trader in range(30):
+          if rng.random() < 0.8:
+            retail_traders.maybe_execute_trade(trader, pair)
+          else:
+            arb_trader.maybe_execute_trade(pair)
+        oracle.step_foward()
+    return run, num_steps * 30
+  return setup
+
+''' oracle twap, ema and volatility queries, the oracle steps every query round '''
+def bench_oracle_windows():
+  def setup():
+    oracle = get_synthetic_oracle()
+    oracle.get_twap(60)
+    oracle.get_ema(60)
+    oracle.get_volatility(60)
+    num_steps = 10000
+
+    def run():
+      for _ in range(num_steps):
+        oracle.get_twap(60)
+        oracle.get_ema(60)
+        oracle.get_volatility(60)
+        oracle.step_foward()
+    return run, num_steps * 3
+  return setup
+
+'''
+generate_synthetic_paths of model, in steps per second over all the paths
+the historical samples are a synthetic series so the benchmark does not need the pyth cache
+'''
+def bench_synthetic_paths(model):
+  def setup():
+    sample_rng = np.random.default_rng(SEED)
+    samples = {"log_returns": sample_rng.standard_normal(100000) * 0.001, "conf_interval_ratio": sample_rng.random(100001) * 0.002}
+    num_paths = 4
+    num_steps = 250000
+
+    def run():
+      generate_synthetic_paths(num_paths, num_steps, 2000.0, model, seed=SEED, samples=samples)
+    return run, num_paths * num_steps
+  return setup
+
+def get_benchmarks() -> dict:
+  benchmarks = {}
+  for variant in AMM_VARIANTS:
+    benchmarks["quote/" + variant] = bench_quote(variant)
+  for variant in AMM_VARIANTS:
+    benchmarks["swap/" + variant] = bench_swap(variant)
+  benchmarks["quote/deltafi_ema_quote"] = bench_quote("deltafi_ema_quote")
+  for variant in AMM_VARIANTS:
+    benchmarks["quote/ladder/" + variant] = bench_quote_ladder(variant)
+  benchmarks["oracle/window_queries"] = bench_oracle_windows()
+  ''' the kernel backend, without numba it runs the same python math and is not benchmarked '''
+  if HAS_NUMBA:
+    for variant in AMM_VARIANTS:
+      benchmarks["quote/numba/" + variant] = bench_quote(variant, "numba")
+    for variant in AMM_VARIANTS:
+      benchmarks["swap/numba/" + variant] = bench_swap(variant, "numba")
+  for variant in ["deltafi", "deltafi_price_adjustment", "uniswap", "deltafi_internal_arb"]:
+    for arb_mode in ["search", "optimal"]:
+      benchmarks["arb_agent/" + arb_mode + "/" + variant] = bench_arb_agent(variant, arb_mode)
+  for variant in ["uniswap", "deltafi"]:
+    for max_deposit_record in [1000, 10000]:
+      benchmarks["lp_bot/update_record/" + variant + "/" + str(max_deposit_record)] = bench_lp_bot(variant, max_deposit_record)
+  benchmarks["simulation/steps/100_retail_10_arb"] = bench_swap_simulation(100, 10)
+  benchmarks["simulation/steps/1000_retail_50_arb"] = bench_swap_simulation(1000, 50)
+  benchmarks["simulation/steps/streams/100_retail_10_arb"] = bench_swap_simulation(100, 10, streams=True)
+  benchmarks["simulation/steps/tape/100_retail_10_arb"] = bench_swap_simulation(100, 10, tape=True)
+  benchmarks["simulation/steps/binomial/1000_retail_50_arb"] = bench_swap_simulation(1000, 50, sampling="binomial")
+  ''' fast=True runs the object based loop without numba '''
+  if HAS_NUMBA:
+    benchmarks["simulation/steps/fast/100_retail_10_arb"] = bench_swap_simulation(100, 10, fast=True)
+    benchmarks["simulation/steps/fast/1000_retail_50_arb"] = bench_swap_simulation(1000, 50, fast=True)
+  benchmarks["simulation/paths/scalar"] = bench_swap_paths()
+  for num_paths in [1000, 5000]:
+    benchmarks["simulation/paths/batch/" + str(num_paths) + "_paths"] = bench_swap_paths(num_paths)
+  benchmarks["simulation/event/sparse"] = bench_event_simulation()
+  for op in ["fork", "snapshot"]:
+    benchmarks["simulation/state/" + op] = bench_simulation_state(op)
+  benchmarks["router/trades"] = bench_router_trades()
+  for num_pools in [10, 100]:
+    benchmarks["simulation/registry/" + str(num_pools) + "_pools"] = bench_registry_simulation(num_pools)
+  for model in MODELS:
+    benchmarks["synthetic_paths/" + model] = bench_synthetic_paths(model)
+  return benchmarks
+
+'''
+equivalence of the "numba" backend with the reference "python" backend: the same swaps on twin amms of every variant,
+comparing the quotes, implied prices, optimal arb sizes and balances at every step, raises on a mismatch
+run before the numba benchmarks, or with --check-backends (without numba it checks the uncompiled kernels)
+'''
+def check_backends(num_steps=200, tolerance=1e-9):
+  sizes = np.random.default_rng(SEED).random((num_steps, 2)) * 2000
+  for variant in AMM_VARIANTS + ["deltafi_ema_quote"]:
+    oracle = get_synthetic_oracle(num_steps + 1)
+    amms = [get_amm(variant, oracle, backend) for backend in ["python", "numba"]]
+    for step in range(num_steps):
+      sell_A_amount, sell_B_amount = sizes[step][0], sizes[step][1] / 2000
+      target_price = oracle.get_price()
+      values = [[
+        amm.get_swap_out_B(sell_A_amount), amm.get_swap_out_A(sell_B_amount),
+        amm.get_implied_price_A_for_B(), amm.get_implied_price_B_for_A(),
+        amm.get_optimal_arb_sell_A(target_price), amm.get_optimal_arb_sell_B(1 / target_price),
+        amm.get_balance_A(), amm.get_balance_B(),
+      ] for amm in amms]
+      if not np.allclose(values[0], values[1], rtol=tolerance, atol=0):
+        raise ValueError("numba backend differs from the python backend: " + variant + " at step " + str(step))
+      for amm in amms:
+        amm.swap_A_for_B(sell_A_amount) if step % 2 == 0 else amm.swap_B_for_A(sell_B_amount)
+      oracle.step_foward()
+
+'''
+statistical equivalence of the fast mode with the object based loop: num_runs seeded runs of both on fresh
+amms of every variant it supports, then a two sample kolmogorov smirnov test on the final tvl ratios of each
+variant and arb mode, raises when the distributions differ at the significance level
+run before the fast benchmarks, or with --check-fast-mode (without numba the fast loop runs uncompiled, slowly)
+'''
+KS_CRITICAL_VALUES = {0.05: 1.358, 0.01: 1.628, 0.001: 1.949}
+
+def check_fast_mode(num_runs=40, num_steps=100, num_retail_traders=50, num_arb_traders=5, significance=0.01):
+  variants = ["deltafi", "deltafi_price_adjustment", "uniswap", "deltafi_internal_arb", "uniswap_internal_arb"]
+  critical_value = KS_CRITICAL_VALUES[significance] * np.sqrt(2 / num_runs)
+  for arb_mode in ["search", "optimal"]:
+    final_tvl_ratios = {"object": [], "fast": []}
+    for run in range(num_runs):
+      for mode in final_tvl_ratios:
+        oracle = get_synthetic_oracle(num_steps + 1)
+        amm_list = [get_amm(variant, oracle) for variant in variants]
+        simulation = run_fast_swap_simulation if mode == "fast" else run_swap_simulation
+        tvl_ratio_change_list = simulation(
+          num_retail_traders, num_arb_traders, 0.5, oracle, amm_list, max_steps=num_steps, arb_mode=arb_mode, rng=random.Random(run))
+        final_tvl_ratios[mode].append([tvl_ratios[-1] for tvl_ratios in tvl_ratio_change_list])
+
+    for k in range(len(variants)):
+      sample_object = np.sort(np.array(final_tvl_ratios["object"])[:, k])
+      sample_fast = np.sort(np.array(final_tvl_ratios["fast"])[:, k])
+      points = np.concatenate([sample_object, sample_fast])
+      statistic = np.max(np.abs(
+        np.searchsorted(sample_object, points, side="right") - np.searchsorted(sample_fast, points, side="right"))) / num_runs
+      if statistic > critical_value:
+        raise ValueError(
+          "fast mode differs from the object based loop: " + variants[k] + " with arb mode " + arb_mode +
+          " (ks statistic %.3f > %.3f)" % (statistic, critical_value))
+
+''' random() gives the queued draws in order, for replaying the draws of the batch engine through the agents '''
+class ReplayRandom():
+  def __init__(self) -> None:
+    self.draws = []
+
+  def random(self):
+    return self.draws.pop(0)
+
+'''
+replay of the batch engine through the scalar classes: run_batch_swap_simulation of num_paths paths, then every
+path of replayed_paths again with the same draws (see the seed scheme of batch_simulation.py) through fresh scalar
+amms, a RetailAgentPool with the accepted price ranges of the path and an ArbAgent with arb_mode="optimal",
+comparing the tvl ratios of every amm at every step, raises on a mismatch
+run before the batch benchmarks, or with --check-batch-engine
+'''
+def check_batch_engine(num_paths=50, replayed_paths=(0, 17, 49), num_steps=50, num_retail_traders=100, num_arb_traders=10, trade_prob=0.5, tolerance=1e-9):
+  variants = ["deltafi", "deltafi_price_adjustment", "deltafi_conf_interval", "uniswap"]
+  oracle = get_synthetic_oracle(num_steps + 1)
+  tvl_ratio_change_list = run_batch_swap_simulation(
+    num_retail_traders, num_arb_traders, trade_prob, oracle, [get_amm(variant, oracle) for variant in variants], num_paths,
+    seed=SEED, max_steps=num_steps)
+
+  num_traders = num_retail_traders + num_arb_traders
+  for path in replayed_paths:
+    oracle = get_synthetic_oracle(num_steps + 1)
+    amm_list = [get_amm(variant, oracle) for variant in variants]
+    rng = np.random.default_rng(SEED)
+    replay_rng = ReplayRandom()
+    retail_traders = RetailAgentPool(oracle, num_retail_traders, random.Random(SEED)).with_rng(replay_rng)
+    retail_traders.accepted_price_range = (RETAIL_MAX_PRICE_RANGE * rng.random((num_paths, num_retail_traders)))[path].tolist()
+    arb_trader = ArbAgent(oracle, "optimal", replay_rng)
+    trader_order = np.tile(np.arange(num_traders), (num_paths, 1))
+
+    for step in range(num_steps):
+      trader_order = rng.permuted(trader_order, axis=1)
+      selected_len = (rng.random(num_paths) * num_traders).astype(np.int64)
+      for k in range(len(amm_list)):
+        trade_path, slot, trade_draws = _draw_step_trades(rng, selected_len, trade_prob)
+        for j, draws in zip(slot[trade_path == path].tolist(), trade_draws[:, trade_path == path].T.tolist()):
+          trader = trader_order[path, j]
+          if trader < num_retail_traders:
+            replay_rng.draws = [draws[DRAW_SIDE], draws[DRAW_PRICE_JITTER_A], draws[DRAW_PRICE_JITTER_B]]
+            if draws[DRAW_SIDE] < 0.5:
+              replay_rng.draws.append(draws[DRAW_SIZE])
+            replay_rng.draws.append(draws[DRAW_PRICE_TOLERANCE])
+            retail_traders.maybe_execute_trade(trader, amm_list[k])
+          else:
+            replay_rng.draws = [draws[DRAW_PRICE_JITTER_A], draws[DRAW_PRICE_JITTER_B]]
+            arb_trader.maybe_execute_trade(amm_list[k])
+
+        tvl_ratio = amm_list[k].get_tvl_ratio_to_initial_state()
+        if not np.isclose(tvl_ratio, tvl_ratio_change_list[k][step, path], rtol=tolerance, atol=0):
+          raise ValueError(
+            "batch engine differs from the scalar replay: " + variants[k] + " on path " + str(path) + " at step " + str(step) +
+            " (%.12f != %.12f)" % (tvl_ratio_change_list[k][step, path], tvl_ratio))
+      oracle.step_foward()
+
+''' fixed workload of float math and python calls like the amm quotes, one op per iteration '''
+REFERENCE_OPS = 200000
+
+def reference_kernel():
+  def swap_out(balance_in, balance_out, exp, token_input):
+    return balance_out * (1 - (balance_in / (token_input + balance_in))**exp)
+
+  def run():
+    total = 0.0
+    for i in range(REFERENCE_OPS):
+      total += swap_out(2000000.0, 1000.0, 0.5, float(i))
+    return total
+  return run, REFERENCE_OPS
+
+''' commit of the tree, marked dirty with uncommitted changes, and the machine, stored with the baseline '''
+def get_environment() -> dict:
+  def git(*args):
+    return subprocess.run(["git"] + list(args), cwd=lib_path, capture_output=True, text=True).stdout.strip()
+  try:
+    commit = git("rev-parse", "--short", "HEAD") or "unknown"
+    if git("status", "--porcelain", "--untracked-files=no") != "":
+      commit += "+dirty"
+  except OSError:
+    commit = "unknown"
+  return {
+    "commit": commit,
+    "machine": platform.machine() + " " + (platform.processor() or "unknown cpu") + ", " + platform.system() + " " + platform.release(),
+    "python": platform.python_implementation() + " " + platform.python_version(),
+    "numba": HAS_NUMBA,
+  }
+
+''' best of repeat runs, each on a fresh setup '''
+def measure(setup, repeat) -> float:
+  best = 0
+  for _ in range(repeat):
+    run, num_ops = setup()
+    start = time.perf_counter()
+    run()
+    best = max(best, num_ops / (time.perf_counter() - start))
+  return best
+
+'''
+(best ops/s, ops/s relative to the reference kernel, best reference ops/s) of setup
+every repeat times the reference kernel right before the benchmark, so both see the same machine load and clock,
+the relative number is the median over the repeats of the benchmark to reference ratio
+'''
+def measure_relative(setup, repeat) -> tuple:
+  ops_per_s = []
+  reference_ops_per_s = []
+  for _ in range(repeat):
+    reference_ops_per_s.append(measure(reference_kernel, 1))
+    ops_per_s.append(measure(setup, 1))
+  ratios = np.array(ops_per_s) / np.array(reference_ops_per_s)
+  return max(ops_per_s), float(np.median(ratios)), max(reference_ops_per_s)
+
+def main():
+  parser = argparse.ArgumentParser(description="amm simulation benchmarks")
+  parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+  parser.add_argument("--filter", default="", help="only run the benchmarks whose name contains this string")
+  parser.add_argument("--repeat", type=int, default=5)
+  parser.add_argument("--threshold", type=float, default=0.2, help="slowdown ratio flagged as a regression")
+  parser.add_argument("--check-backends", action="store_true", help="check the numba backend against the python backend")
+  parser.add_argument("--check-fast-mode", action="store_true", help="check the fast mode against the object based loop")
+  parser.add_argument("--check-batch-engine", action="store_true", help="check the batch engine against a scalar replay of its draws")
+  args = parser.parse_args()
+
+  if args.check_backends or (HAS_NUMBA and any("/numba/" in name and args.filter in name for name in get_benchmarks())):
+    check_backends()
+    print("numba backend matches the python backend" + ("" if HAS_NUMBA else " (numba not installed, kernels not compiled)"))
+  if args.check_fast_mode or (HAS_NUMBA and any("/fast/" in name and args.filter in name for name in get_benchmarks())):
+    check_fast_mode()
+    print("fast mode matches the object based loop in distribution" + ("" if HAS_NUMBA else " (numba not installed, fast loop not compiled)"))
+  if args.check_batch_engine or any("/batch/" in name and args.filter in name for name in get_benchmarks()):
+    check_batch_engine()
+    print("batch engine matches the scalar replay")
+
+  baseline = {"relative": {}}
+  if exists(BASELINE_FILENAME):
+    with open(BASELINE_FILENAME, "r") as inputFile:
+      baseline = json.load(inputFile)
+    print("baseline: commit " + baseline["commit"] + " on " + baseline["machine"] + ", " + baseline["python"])
+
+  results = {}
+  relative = {}
+  reference_ops_per_s = 0
+  for name, setup in get_benchmarks().items():
+    if args.filter in name:
+      results[name], relative[name], benchmark_reference_ops_per_s = measure_relative(setup, args.repeat)
+      reference_ops_per_s = max(reference_ops_per_s, benchmark_reference_ops_per_s)
+
+  regressions = []
+  print("reference kernel: %.1f ops/s" % reference_ops_per_s)
+  print("%-48s %14s %10s %10s %8s" % ("benchmark", "ops/s", "relative", "baseline", "ratio"))
+  for name in results:
+    if name not in baseline["relative"]:
+      print("%-48s %14.1f %10.4f %10s %8s" % (name, results[name], relative[name], "-", "-"))
+      continue
+    ratio = relative[name] / baseline["relative"][name]
+    flag = ""
+    if ratio < 1 - args.threshold:
+      flag = "  REGRESSION"
+      regressions.append(name)
+    print("%-48s %14.1f %10.4f %10.4f %8.2f%s" % (name, results[name], relative[name], baseline["relative"][name], ratio, flag))
+
+  if args.update_baseline:
+    baseline.update(get_environment())
+    baseline["reference_ops_per_s"] = reference_ops_per_s
+    baseline["relative"].update(relative)
+    with open(BASELINE_FILENAME, "w") as outputFile:
+      json.dump(baseline, outputFile, indent=2, sort_keys=True)
+    print("baseline updated: " + BASELINE_FILENAME)
+  elif len(regressions) > 0:
+    print(str(len(regressions)) + " regression(s) beyond " + str(args.threshold * 100) + "%")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,754 @@
+import copy
+import math
+import numpy as np
+from .price_data import Oracle, BatchOracle, MultiAssetOracle
+from .prototypes import AMM
+from .kernels import deltafi_swap_out_regular, deltafi_swap_out_adjusted, uniswap_swap_out
+
+'''
+batched monte carlo engine
+each batch amm holds num_paths independent copies of one pool state as numpy arrays,
+all the paths share the same oracle price path and are stepped together
+
+seed scheme: with a fixed seed, the draws of the whole run are consumed in this order
+  - accepted price range of every retail trader of every path
+  - per step: one permutation of the traders and one selection draw per path
+  - per step and amm: one trade gate draw for every trader slot of every path (up to the longest selection),
+    then NUM_TRADE_DRAWS rows of one uniform draw per active trade, the trades path by path in slot order
+an active trade always consumes its whole column of draws no matter which branch it takes,
+so replaying one path with the same draws through the scalar amm classes gives the same
+tvl_ratio_change_list as the batch (within float tolerance), see check_batch_engine in benchmarks/run_benchmarks.py
+
+the arbitraguers trade the profit maximising size, like ArbAgent with arb_mode="optimal"
+'''
+
+# rows of the per trade draws
+DRAW_SIDE = 0
+DRAW_PRICE_JITTER_A = 1
+DRAW_PRICE_JITTER_B = 2
+DRAW_SIZE = 3
+DRAW_PRICE_TOLERANCE = 4
+NUM_TRADE_DRAWS = 5
+
+# same as RetailAgent.max_sell_A_amount
+RETAIL_MAX_SELL_A_AMOUNT = 2000
+RETAIL_MAX_PRICE_RANGE = 0.05
+
+'''
+parent class for amm state batched over independent paths
+a path is a copy of one pool (run_batch_swap_simulation) or one pool of a PoolRegistry
+'''
+class BatchAMM():
+  # names of the attributes that hold one value per path
+  path_arrays = ('balance_A', 'balance_B', 'fee_rate')
+
+  def __init__(self, num_paths, balance_A, balance_B, oracle: Oracle, fee_rate) -> None:
+    self.num_paths = num_paths
+    self.balance_A = np.full(num_paths, balance_A, dtype=np.float64)
+    self.balance_B = np.full(num_paths, balance_B, dtype=np.float64)
+    self.oracle = oracle
+    self.fee_rate = np.full(num_paths, fee_rate, dtype=np.float64)
+    ''' largest retail sell of A, a scalar or one value per path (pools whose A is not USDC) '''
+    self.retail_max_sell_A_amount = RETAIL_MAX_SELL_A_AMOUNT
+
+  '''
+  one path per amm of amms, read from the attributes of the scalar amms named like the path arrays
+  the settings that are not path arrays (e.g. enable_price_adjustment) are the ones of amms[0]
+  '''
+  @classmethod
+  def from_amms(cls, amms: list[AMM]):
+    batch_amm = cls(amms[0], len(amms))
+    for name in cls.path_arrays:
+      setattr(batch_amm, name, np.array([getattr(amm, name) for amm in amms], dtype=np.float64))
+    return batch_amm
+
+  def get_balance_A(self):
+    return self.balance_A
+
+  def get_balance_B(self):
+    return self.balance_B
+
+  '''
+  side generic quotes, selling the "in" token for the "out" token
+  get_curve gives the parts of the curve of every path that do not depend on the balances, A for B where sell_A
+  is true and B for A elsewhere, as arrays broadcasting against sell_A, the get_curve_* methods then quote along
+  them at the given balances, so the trades of a step read the curves once (see _execute_step_trades)
+  '''
+  def get_curve(self, sell_A) -> tuple:
+    raise NotImplementedError
+
+  def get_curve_swap_out(self, balance_in, balance_out, curve, token_input):
+    raise NotImplementedError
+
+  def get_curve_implied_price(self, balance_in, balance_out, curve):
+    raise NotImplementedError
+
+  ''' the closed form trade size of ArbAgent arb_mode="optimal", target_price is the amount of in token for 1 out token '''
+  def get_curve_optimal_arb_sell(self, balance_in, balance_out, curve, target_price):
+    raise NotImplementedError
+
+  def get_swap_out_A(self, token_B_input):
+    return self.get_curve_swap_out(self.balance_B, self.balance_A, self.get_curve(False), token_B_input)
+
+  def get_swap_out_B(self, token_A_input):
+    return self.get_curve_swap_out(self.balance_A, self.balance_B, self.get_curve(True), token_A_input)
+
+  def get_implied_price_B_for_A(self):
+    return self.get_curve_implied_price(self.balance_B, self.balance_A, self.get_curve(False))
+
+  def get_implied_price_A_for_B(self):
+    return self.get_curve_implied_price(self.balance_A, self.balance_B, self.get_curve(True))
+
+  def get_optimal_arb_sell_A(self, target_price_B_sell_B):
+    return self.get_curve_optimal_arb_sell(self.balance_A, self.balance_B, self.get_curve(True), target_price_B_sell_B)
+
+  def get_optimal_arb_sell_B(self, target_price_A_sell_A):
+    return self.get_curve_optimal_arb_sell(self.balance_B, self.balance_A, self.get_curve(False), target_price_A_sell_A)
+
+  '''
+  quotes of one path on python floats, for the trades of one pool run in order (see _execute_pool_step_trades)
+  update_path_constants reads the oracle step and the parameters of every path, the get_path_* methods then
+  take the path index and its balances and follow the batch formulas above operation by operation
+  '''
+  def update_path_constants(self):
+    raise NotImplementedError
+
+  def get_path_swap_out_A(self, k, balance_A, balance_B, token_B_input):
+    raise NotImplementedError
+
+  def get_path_swap_out_B(self, k, balance_A, balance_B, token_A_input):
+    raise NotImplementedError
+
+  def get_path_implied_price_A_for_B(self, k, balance_A, balance_B):
+    raise NotImplementedError
+
+  def get_path_implied_price_B_for_A(self, k, balance_A, balance_B):
+    raise NotImplementedError
+
+  def get_path_optimal_arb_sell_A(self, k, balance_A, balance_B, target_price_B_sell_B):
+    raise NotImplementedError
+
+  def get_path_optimal_arb_sell_B(self, k, balance_A, balance_B, target_price_A_sell_A):
+    raise NotImplementedError
+
+  ''' copy of the state of the selected paths, used for quoting on a subset of paths '''
+  def take(self, path_index):
+    subset = copy.copy(self)
+    subset.num_paths = len(path_index)
+    for name in self.path_arrays:
+      setattr(subset, name, getattr(self, name)[path_index])
+    if isinstance(self.oracle, BatchOracle):
+      subset.oracle = self.oracle.take(path_index)
+    return subset
+
+  ''' sell A for B on the paths selected by mask, the other paths are left untouched '''
+  def swap_A_for_B(self, token_A_input, mask):
+    token_B_output = self.get_swap_out_B(token_A_input)
+    self.balance_A = np.where(mask, self.balance_A + token_A_input, self.balance_A)
+    self.balance_B = np.where(mask, self.balance_B - token_B_output, self.balance_B)
+    return np.where(mask, token_B_output, 0)
+
+  ''' sell B for A on the paths selected by mask, the other paths are left untouched '''
+  def swap_B_for_A(self, token_B_input, mask):
+    token_A_output = self.get_swap_out_A(token_B_input)
+    self.balance_A = np.where(mask, self.balance_A - token_A_output, self.balance_A)
+    self.balance_B = np.where(mask, self.balance_B + token_B_input, self.balance_B)
+    return np.where(mask, token_A_output, 0)
+
+
+''' DeltafiAMM swap formulas evaluated on all paths at once '''
+class BatchDeltafiAMM(BatchAMM):
+  path_arrays = ('balance_A', 'balance_B', 'fee_rate', 'target_reserve_A', 'target_reserve_B')
+
+  def __init__(self, amm, num_paths) -> None:
+    ''' the batch formulas quote off the spot price only '''
+    assert(amm.price_mode == "spot")
+    super().__init__(num_paths, amm.balance_A, amm.balance_B, amm.oracle, amm.fee_rate)
+    self.target_reserve_A = np.full(num_paths, amm.target_reserve_A, dtype=np.float64)
+    self.target_reserve_B = np.full(num_paths, amm.target_reserve_B, dtype=np.float64)
+    self.enable_price_adjustment = amm.enable_price_adjustment
+    self.enable_conf_interval = amm.enable_conf_interval
+    self.name = amm.get_name()
+
+  def get_name(self):
+    return self.name
+
+  def get_conf_interval(self):
+    if self.enable_conf_interval is True:
+      return self.oracle.get_conf_interval()
+    return 0
+
+  '''
+  (target_reserve_in, target_reserve_out, price, exp, fee_rate), price is the flat price of the price adjustment
+  (amount of out token for 1 in token) and exp the exponent of the curve, like the step cache of DeltafiAMM
+  '''
+  def get_curve(self, sell_A):
+    price_A_selling_A = 1 / (self.oracle.get_price() + self.get_conf_interval())
+    price_B_selling_B = self.oracle.get_price() - self.get_conf_interval()
+    target_reserve_in = np.where(sell_A, self.target_reserve_A, self.target_reserve_B)
+    target_reserve_out = np.where(sell_A, self.target_reserve_B, self.target_reserve_A)
+    price = np.where(sell_A, price_A_selling_A, price_B_selling_B)
+    exp = price * target_reserve_in / target_reserve_out
+    return target_reserve_in, target_reserve_out, price, exp, self.fee_rate
+
+  ''' amount of in token the flat part of the price adjustment takes, negative past the target '''
+  def _get_sell_in_to_target(self, balance_in, balance_out, target_reserve_in, target_reserve_out, price):
+    current_value = balance_out + balance_in * price
+    initial_value = target_reserve_out + target_reserve_in * price
+    return target_reserve_in * (current_value / initial_value) - balance_in
+
+  def get_curve_swap_out(self, balance_in, balance_out, curve, token_input):
+    target_reserve_in, target_reserve_out, price, exp, fee_rate = curve
+    if self.enable_price_adjustment is not True:
+      return deltafi_swap_out_regular(balance_in, balance_out, exp, fee_rate, token_input)
+
+    result = balance_out * (1 - (balance_in / (token_input + balance_in))**exp)
+    sell_in_to_target = self._get_sell_in_to_target(balance_in, balance_out, target_reserve_in, target_reserve_out, price)
+    buy_out_to_target = sell_in_to_target * price
+    buy_out_beyond_target = (balance_out - buy_out_to_target) * (1 - ((balance_in + sell_in_to_target) / (token_input + balance_in))**exp)
+    result = np.where(
+      token_input < sell_in_to_target, token_input * price,
+      np.where(sell_in_to_target > 0, buy_out_to_target + buy_out_beyond_target, result))
+    return result * (1 - fee_rate)
+
+  def get_curve_implied_price(self, balance_in, balance_out, curve):
+    target_reserve_in, target_reserve_out, price, _, fee_rate = curve
+    price_modifier = target_reserve_in / target_reserve_out * balance_out / balance_in
+    result = price * price_modifier * (1 - fee_rate)
+
+    if self.enable_price_adjustment:
+      return np.where(price_modifier > 1, price, result)
+    return result
+
+  def _get_optimal_balance_in(self, balance_in, balance_out, exp, fee_rate, target_price):
+    return np.exp((np.log((1 - fee_rate) * balance_out * exp * target_price) + exp * np.log(balance_in)) / (exp + 1))
+
+  def get_curve_optimal_arb_sell(self, balance_in, balance_out, curve, target_price):
+    target_reserve_in, target_reserve_out, price, exp, fee_rate = curve
+    if self.enable_price_adjustment is not True:
+      return np.maximum(0, self._get_optimal_balance_in(balance_in, balance_out, exp, fee_rate, target_price) - balance_in)
+
+    ''' the curve beyond the target is never cheaper than the flat oracle price before it '''
+    sell_in_to_target = np.maximum(0, self._get_sell_in_to_target(balance_in, balance_out, target_reserve_in, target_reserve_out, price))
+    optimal_balance_in = self._get_optimal_balance_in(
+      balance_in + sell_in_to_target, balance_out - sell_in_to_target * price, exp, fee_rate, target_price)
+    sell_in_amount = np.maximum(sell_in_to_target, optimal_balance_in - balance_in)
+    return np.where((sell_in_to_target > 0) & (price * (1 - fee_rate) * target_price <= 1), 0, sell_in_amount)
+
+  def get_tvl_ratio_to_initial_state(self):
+    current_tvl = self.balance_A + self.balance_B * self.oracle.get_price()
+    initial_tvl = self.target_reserve_A + self.target_reserve_B * self.oracle.get_price()
+    return current_tvl / initial_tvl
+
+  ''' (price_A_selling_A, price_B_selling_B, exp selling A, exp selling B, target_reserve_A, target_reserve_B, fee_rate) per path '''
+  def update_path_constants(self):
+    price = np.broadcast_to(self.oracle.get_price(), self.num_paths)
+    conf_interval = np.broadcast_to(self.get_conf_interval(), self.num_paths)
+    price_A_selling_A = 1 / (price + conf_interval)
+    price_B_selling_B = price - conf_interval
+    self.path_constants = list(zip(
+      price_A_selling_A.tolist(), price_B_selling_B.tolist(),
+      (price_A_selling_A * self.target_reserve_A / self.target_reserve_B).tolist(),
+      (price_B_selling_B * self.target_reserve_B / self.target_reserve_A).tolist(),
+      self.target_reserve_A.tolist(), self.target_reserve_B.tolist(), self.fee_rate.tolist()))
+
+  def get_path_swap_out_A(self, k, balance_A, balance_B, token_B_input):
+    _, price_B_selling_B, _, exp, target_reserve_A, target_reserve_B, fee_rate = self.path_constants[k]
+    if self.enable_price_adjustment is True:
+      return deltafi_swap_out_adjusted(
+        balance_B, balance_A, target_reserve_B, target_reserve_A, price_B_selling_B, exp, fee_rate, token_B_input)
+    return deltafi_swap_out_regular(balance_B, balance_A, exp, fee_rate, token_B_input)
+
+  def get_path_swap_out_B(self, k, balance_A, balance_B, token_A_input):
+    price_A_selling_A, _, exp, _, target_reserve_A, target_reserve_B, fee_rate = self.path_constants[k]
+    if self.enable_price_adjustment is True:
+      return deltafi_swap_out_adjusted(
+        balance_A, balance_B, target_reserve_A, target_reserve_B, price_A_selling_A, exp, fee_rate, token_A_input)
+    return deltafi_swap_out_regular(balance_A, balance_B, exp, fee_rate, token_A_input)
+
+  def get_path_implied_price_A_for_B(self, k, balance_A, balance_B):
+    price_A_selling_A, _, _, _, target_reserve_A, target_reserve_B, fee_rate = self.path_constants[k]
+    price_modifier = target_reserve_A / target_reserve_B * balance_B / balance_A
+    if self.enable_price_adjustment and price_modifier > 1:
+      return price_A_selling_A
+    return price_A_selling_A * price_modifier * (1 - fee_rate)
+
+  def get_path_implied_price_B_for_A(self, k, balance_A, balance_B):
+    _, price_B_selling_B, _, _, target_reserve_A, target_reserve_B, fee_rate = self.path_constants[k]
+    price_modifier = target_reserve_B / target_reserve_A * balance_A / balance_B
+    if self.enable_price_adjustment and price_modifier > 1:
+      return price_B_selling_B
+    return price_B_selling_B * price_modifier * (1 - fee_rate)
+
+  ''' _get_optimal_arb_sell of path k on python floats '''
+  def _get_path_optimal_arb_sell(self, balance_in, balance_out, target_reserve_in, target_reserve_out, price, exp, fee_rate, target_price):
+    sell_in_to_target = 0
+    if self.enable_price_adjustment is True:
+      current_value = balance_out + balance_in * price
+      initial_value = target_reserve_out + target_reserve_in * price
+      sell_in_to_target = max(0, target_reserve_in * (current_value / initial_value) - balance_in)
+      if sell_in_to_target > 0 and price * (1 - fee_rate) * target_price <= 1:
+        return 0
+
+    balance_in_to_target = balance_in + sell_in_to_target
+    balance_out_to_target = balance_out - sell_in_to_target * price
+    optimal_balance_in = math.exp((math.log((1 - fee_rate) * balance_out_to_target * exp * target_price) + exp * math.log(balance_in_to_target)) / (exp + 1))
+    return max(sell_in_to_target, optimal_balance_in - balance_in)
+
+  def get_path_optimal_arb_sell_A(self, k, balance_A, balance_B, target_price_B_sell_B):
+    price_A_selling_A, _, exp, _, target_reserve_A, target_reserve_B, fee_rate = self.path_constants[k]
+    return self._get_path_optimal_arb_sell(
+      balance_A, balance_B, target_reserve_A, target_reserve_B, price_A_selling_A, exp, fee_rate, target_price_B_sell_B)
+
+  def get_path_optimal_arb_sell_B(self, k, balance_A, balance_B, target_price_A_sell_A):
+    _, price_B_selling_B, _, exp, target_reserve_A, target_reserve_B, fee_rate = self.path_constants[k]
+    return self._get_path_optimal_arb_sell(
+      balance_B, balance_A, target_reserve_B, target_reserve_A, price_B_selling_B, exp, fee_rate, target_price_A_sell_A)
+
+
+''' UniswapAMM swap formulas evaluated on all paths at once '''
+class BatchUniswapAMM(BatchAMM):
+  path_arrays = ('balance_A', 'balance_B', 'fee_rate', 'initial_reserve_A', 'initial_reserve_B')
+
+  def __init__(self, amm, num_paths) -> None:
+    super().__init__(num_paths, amm.balance_A, amm.balance_B, amm.oracle, amm.fee_rate)
+    self.initial_reserve_A = np.full(num_paths, amm.initial_reserve_A, dtype=np.float64)
+    self.initial_reserve_B = np.full(num_paths, amm.initial_reserve_B, dtype=np.float64)
+    self.name = amm.get_name()
+
+  def get_name(self):
+    return self.name
+
+  ''' (fee_rate,), the uniswap curve does not read the oracle '''
+  def get_curve(self, sell_A):
+    return (self.fee_rate,)
+
+  def get_curve_swap_out(self, balance_in, balance_out, curve, token_input):
+    return uniswap_swap_out(balance_in, balance_out, curve[0], token_input)
+
+  def get_curve_implied_price(self, balance_in, balance_out, curve):
+    return (balance_out / balance_in) * (1 - curve[0])
+
+  def get_curve_optimal_arb_sell(self, balance_in, balance_out, curve, target_price):
+    k = balance_in * balance_out
+    return np.maximum(0, np.sqrt((1 - curve[0]) * k * target_price) - balance_in)
+
+  def get_tvl_ratio_to_initial_state(self):
+    current_tvl = self.balance_A + self.balance_B * self.oracle.get_price()
+    initial_tvl = self.initial_reserve_A + self.initial_reserve_B * self.oracle.get_price()
+    return current_tvl / initial_tvl
+
+  ''' the fee rate per path, the uniswap curve does not read the oracle '''
+  def update_path_constants(self):
+    self.path_constants = self.fee_rate.tolist()
+
+  def get_path_swap_out_A(self, k, balance_A, balance_B, token_B_input):
+    return uniswap_swap_out(balance_B, balance_A, self.path_constants[k], token_B_input)
+
+  def get_path_swap_out_B(self, k, balance_A, balance_B, token_A_input):
+    return uniswap_swap_out(balance_A, balance_B, self.path_constants[k], token_A_input)
+
+  def get_path_implied_price_A_for_B(self, k, balance_A, balance_B):
+    return (balance_B / balance_A) * (1 - self.path_constants[k])
+
+  def get_path_implied_price_B_for_A(self, k, balance_A, balance_B):
+    return (balance_A / balance_B) * (1 - self.path_constants[k])
+
+  def get_path_optimal_arb_sell_A(self, k, balance_A, balance_B, target_price_B_sell_B):
+    k_product = balance_A * balance_B
+    return max(0, math.sqrt((1 - self.path_constants[k]) * k_product * target_price_B_sell_B) - balance_A)
+
+  def get_path_optimal_arb_sell_B(self, k, balance_A, balance_B, target_price_A_sell_A):
+    k_product = balance_A * balance_B
+    return max(0, math.sqrt((1 - self.path_constants[k]) * k_product * target_price_A_sell_A) - balance_B)
+
+
+'''
+the draws of the trades of one step on one amm, see the seed scheme above
+returns the active (path, slot) pairs, path by path in slot order, and their (NUM_TRADE_DRAWS, pairs) draws
+'''
+def _draw_step_trades(rng: np.random.Generator, selected_len, trade_prob):
+  num_paths = len(selected_len)
+  max_selected_len = int(selected_len.max()) if num_paths > 0 else 0
+  trade_gate = rng.random((num_paths, max_selected_len))
+  active = (np.arange(max_selected_len) < selected_len[:, None]) & (trade_gate < trade_prob)
+  path, slot = np.divmod(np.flatnonzero(active), max_selected_len)
+  return path, slot, rng.random((NUM_TRADE_DRAWS, len(path)))
+
+'''
+the parts of the trades of the active (path, slot) pairs that do not depend on the pool state: the sides, sizes
+and least accepted outputs of the retail traders and the target prices of the arbitraguers
+returns (is_retail, sell_A, retail_sell_amount, retail_min_amount, target_price_A_sell_A, target_price_B_sell_B),
+one value per pair
+'''
+def _get_trade_inputs(amm: BatchAMM, oracle: Oracle, trade_draws, trader_order, accepted_price_range, num_retail_traders, path, slot):
+  def get_path_values(value):
+    return value if np.ndim(value) == 0 else value[path]
+  trader = trader_order[path, slot]
+  price = get_path_values(oracle.get_price())
+  conf_interval = get_path_values(oracle.get_conf_interval())
+  max_sell_A_amount = get_path_values(amm.retail_max_sell_A_amount)
+  side, price_jitter_A, price_jitter_B, size, price_tolerance = (
+    trade_draws[DRAW_SIDE], trade_draws[DRAW_PRICE_JITTER_A], trade_draws[DRAW_PRICE_JITTER_B], trade_draws[DRAW_SIZE],
+    trade_draws[DRAW_PRICE_TOLERANCE])
+
+  is_retail = trader < num_retail_traders
+  sell_A = side < 0.5
+  price_tolerance = 1 - accepted_price_range[path, np.minimum(trader, num_retail_traders - 1)] * price_tolerance
+  retail_sell_amount = np.where(sell_A, max_sell_A_amount * price_jitter_B * size, (max_sell_A_amount / price) * price_jitter_B)
+  ''' the price of B the retail trader expects (1 / price_A_selling_A or price_B_selling_B), the arbitraguer target is mirrored '''
+  price_jitter = (1 - 2*price_jitter_A)*conf_interval
+  retail_price = price + price_jitter
+  retail_min_amount = retail_sell_amount * np.where(sell_A, 1 / retail_price, retail_price) * price_tolerance
+  target_price_A_sell_A = 1 / (price - price_jitter)
+  target_price_B_sell_B = price + (2*price_jitter_B - 1)*conf_interval
+  return is_retail, sell_A, retail_sell_amount, retail_min_amount, target_price_A_sell_A, target_price_B_sell_B
+
+'''
+ArbAgent.execute_trade with arb_mode="optimal" on the paths of path_index of amm
+curve_A and curve_B are the curves of the paths selling A and selling B, target prices one per path
+'''
+def _execute_arb_trades(amm: BatchAMM, path_index, curve_A, curve_B, target_price_A_sell_A, target_price_B_sell_B):
+  balance_A = amm.balance_A[path_index]
+  balance_B = amm.balance_B[path_index]
+  implied_price_B_sell_B = amm.get_curve_implied_price(balance_B, balance_A, curve_B)
+  implied_price_A_sell_A = amm.get_curve_implied_price(balance_A, balance_B, curve_A)
+  arbitrage_A = implied_price_A_sell_A * target_price_B_sell_B > 1
+  arbitrage_B = implied_price_B_sell_B * target_price_A_sell_A > 1
+
+  if arbitrage_A.any():
+    sell_A_amount = amm.get_curve_optimal_arb_sell(balance_A, balance_B, curve_A, target_price_B_sell_B)
+    buy_B_amount = amm.get_curve_swap_out(balance_A, balance_B, curve_A, sell_A_amount)
+    execute = arbitrage_A & (sell_A_amount > 0) & (buy_B_amount * target_price_B_sell_B > sell_A_amount)
+    np.add(balance_A, sell_A_amount, out=balance_A, where=execute)
+    np.subtract(balance_B, buy_B_amount, out=balance_B, where=execute)
+
+  if arbitrage_B.any():
+    sell_B_amount = amm.get_curve_optimal_arb_sell(balance_B, balance_A, curve_B, target_price_A_sell_A)
+    buy_A_amount = amm.get_curve_swap_out(balance_B, balance_A, curve_B, sell_B_amount)
+    execute = arbitrage_B & (sell_B_amount > 0) & (buy_A_amount * target_price_A_sell_A > sell_B_amount)
+    np.subtract(balance_A, buy_A_amount, out=balance_A, where=execute)
+    np.add(balance_B, sell_B_amount, out=balance_B, where=execute)
+
+  amm.balance_A[path_index] = balance_A
+  amm.balance_B[path_index] = balance_B
+
+'''
+the trades of one step on amm: the first selected_len traders of trader_order on every path, gated by trade_prob
+
+the trades of a path run in slot order but the paths are independent, so the r-th trades of all the paths run at
+once, rank by rank. the parts of the trades that do not depend on the pool state (see _get_trade_inputs) and the
+curves of the pools are read once for the whole step, laid out by rank, and with the paths sorted by decreasing
+number of trades the r-th trades are those of the first paths of the order, so every rank works on slices
+'''
+def _execute_step_trades(
+  amm: BatchAMM, oracle: Oracle, rng: np.random.Generator, trader_order, selected_len, accepted_price_range,
+  num_retail_traders, trade_prob):
+
+  path, slot, trade_draws = _draw_step_trades(rng, selected_len, trade_prob)
+  if len(path) == 0:
+    return
+  is_retail, sell_A, retail_sell_amount, retail_min_amount, target_price_A_sell_A, target_price_B_sell_B = _get_trade_inputs(
+    amm, oracle, trade_draws, trader_order, accepted_price_range, num_retail_traders, path, slot)
+
+  ''' the rank of every trade within its path and the position of its path in the sorted paths '''
+  num_paths = len(selected_len)
+  num_trades = np.bincount(path, minlength=num_paths)
+  rank = np.arange(len(path)) - np.repeat(np.cumsum(num_trades) - num_trades, num_trades)
+  order = np.argsort(-num_trades, kind="stable")
+  position = np.empty(num_paths, dtype=np.int64)
+  position[order] = np.arange(num_paths)
+  num_ranks = int(num_trades.max())
+  num_ranked_paths = np.bincount(rank, minlength=num_ranks)
+
+  '''
+  the retail trades as (rank, position) arrays, an arbitrage leaves a retail trade that is never accepted
+  the cells past the paths of a rank are left empty, the ranks never read them
+  '''
+  ranked_index = rank * num_paths + position[path]
+  ranked_trades = []
+  for value in (is_retail, sell_A, retail_sell_amount, retail_min_amount):
+    ranked_value = np.empty(num_ranks * num_paths, dtype=value.dtype)
+    ranked_value[ranked_index] = value
+    ranked_trades.append(ranked_value.reshape((num_ranks, num_paths)))
+  ranked_is_retail, ranked_sell_A, ranked_sell_amount, ranked_min_amount = ranked_trades
+
+  '''
+  the curves of the sorted paths selling A and selling B, a retail trade picks the one of its side,
+  the parts the same on both sides (e.g. the fee rate) are not picked
+  '''
+  sorted_amm = amm.take(order)
+  curve_parts = [
+    (np.broadcast_to(part_A, num_paths), None if part_A is part_B else np.broadcast_to(part_B, num_paths))
+    for part_A, part_B in zip(sorted_amm.get_curve(True), sorted_amm.get_curve(False))]
+
+  ''' the arbitrages in rank order, the ones of rank r are arb_index[arb_start[r]:arb_start[r + 1]] '''
+  arb_index = np.flatnonzero(~is_retail)
+  arb_index = arb_index[np.argsort(rank[arb_index], kind="stable")]
+  arb_start = np.concatenate(([0], np.cumsum(np.bincount(rank[arb_index], minlength=num_ranks))))
+  arb_position = position[path[arb_index]]
+  arb_curve_A = [part_A[arb_position] for part_A, _ in curve_parts]
+  arb_curve_B = [part_A[arb_position] if part_B is None else part_B[arb_position] for part_A, part_B in curve_parts]
+  arb_target_price_A_sell_A = target_price_A_sell_A[arb_index]
+  arb_target_price_B_sell_B = target_price_B_sell_B[arb_index]
+
+  for r in range(num_ranks):
+    n = num_ranked_paths[r]
+    balance_A = sorted_amm.balance_A[:n]
+    balance_B = sorted_amm.balance_B[:n]
+    trade_sell_A = ranked_sell_A[r, :n]
+    token_input = ranked_sell_amount[r, :n]
+    curve = [part_A[:n] if part_B is None else np.where(trade_sell_A, part_A[:n], part_B[:n]) for part_A, part_B in curve_parts]
+    token_output = sorted_amm.get_curve_swap_out(
+      np.where(trade_sell_A, balance_A, balance_B), np.where(trade_sell_A, balance_B, balance_A), curve, token_input)
+
+    accepted = ranked_is_retail[r, :n] & (token_output > ranked_min_amount[r, :n])
+    accepted_sell_A = accepted & trade_sell_A
+    accepted_sell_B = accepted ^ accepted_sell_A
+    np.add(balance_A, token_input, out=balance_A, where=accepted_sell_A)
+    np.subtract(balance_B, token_output, out=balance_B, where=accepted_sell_A)
+    np.subtract(balance_A, token_output, out=balance_A, where=accepted_sell_B)
+    np.add(balance_B, token_input, out=balance_B, where=accepted_sell_B)
+
+    start, end = arb_start[r], arb_start[r + 1]
+    if end > start:
+      _execute_arb_trades(
+        sorted_amm, arb_position[start:end], [part[start:end] for part in arb_curve_A], [part[start:end] for part in arb_curve_B],
+        arb_target_price_A_sell_A[start:end], arb_target_price_B_sell_B[start:end])
+
+  amm.balance_A[order] = sorted_amm.balance_A
+  amm.balance_B[order] = sorted_amm.balance_B
+
+
+''' ArbAgent.arbitrage_A with arb_mode="optimal" on path k of amm, balances holds the balance_A and balance_B lists of the paths '''
+def _path_arbitrage_A(amm: BatchAMM, k, balances, target_price_B_sell_B):
+  balance_A, balance_B = balances[0][k], balances[1][k]
+  sell_A_amount = amm.get_path_optimal_arb_sell_A(k, balance_A, balance_B, target_price_B_sell_B)
+  if sell_A_amount > 0:
+    buy_B_amount = amm.get_path_swap_out_B(k, balance_A, balance_B, sell_A_amount)
+    if buy_B_amount * target_price_B_sell_B > sell_A_amount:
+      balances[0][k] = balance_A + sell_A_amount
+      balances[1][k] = balance_B - buy_B_amount
+
+''' ArbAgent.arbitrage_B with arb_mode="optimal" on path k of amm, see _path_arbitrage_A '''
+def _path_arbitrage_B(amm: BatchAMM, k, balances, target_price_A_sell_A):
+  balance_A, balance_B = balances[0][k], balances[1][k]
+  sell_B_amount = amm.get_path_optimal_arb_sell_B(k, balance_A, balance_B, target_price_A_sell_A)
+  if sell_B_amount > 0:
+    buy_A_amount = amm.get_path_swap_out_A(k, balance_A, balance_B, sell_B_amount)
+    if buy_A_amount * target_price_A_sell_A > sell_B_amount:
+      balances[0][k] = balance_A - buy_A_amount
+      balances[1][k] = balance_B + sell_B_amount
+
+'''
+_execute_step_trades for the pools of a registry, same draws and same trades
+a pool of a registry has few paths (its pools) but each of them trades up to num_traders times a step, so instead of
+running the trades rank by rank over the paths, the state independent parts of the trades (see _get_trade_inputs)
+are computed at once for every active (pool, slot) pair, then the quotes and swaps run in order on python floats,
+pool by pool
+'''
+def _execute_pool_step_trades(
+  amm: BatchAMM, oracle: Oracle, rng: np.random.Generator, trader_order, selected_len, accepted_price_range,
+  num_retail_traders, trade_prob):
+
+  path, slot, trade_draws = _draw_step_trades(rng, selected_len, trade_prob)
+  if len(path) == 0:
+    return
+  is_retail, sell_A, retail_sell_amount, retail_min_amount, target_price_A_sell_A, target_price_B_sell_B = _get_trade_inputs(
+    amm, oracle, trade_draws, trader_order, accepted_price_range, num_retail_traders, path, slot)
+
+  amm.update_path_constants()
+  balances = (amm.balance_A.tolist(), amm.balance_B.tolist())
+  balance_A, balance_B = balances
+  for k, is_retail_trade, sell_A_trade, sell_amount, min_amount, target_A, target_B in zip(
+    path.tolist(), is_retail.tolist(), sell_A.tolist(), retail_sell_amount.tolist(), retail_min_amount.tolist(),
+    target_price_A_sell_A.tolist(), target_price_B_sell_B.tolist()):
+
+    if is_retail_trade:
+      if sell_A_trade:
+        buy_amount = amm.get_path_swap_out_B(k, balance_A[k], balance_B[k], sell_amount)
+        if buy_amount > min_amount:
+          balance_A[k] += sell_amount
+          balance_B[k] -= buy_amount
+      else:
+        buy_amount = amm.get_path_swap_out_A(k, balance_A[k], balance_B[k], sell_amount)
+        if buy_amount > min_amount:
+          balance_A[k] -= buy_amount
+          balance_B[k] += sell_amount
+    else:
+      arbitrage_A = amm.get_path_implied_price_A_for_B(k, balance_A[k], balance_B[k]) * target_B > 1
+      arbitrage_B = amm.get_path_implied_price_B_for_A(k, balance_A[k], balance_B[k]) * target_A > 1
+      if arbitrage_A:
+        _path_arbitrage_A(amm, k, balances, target_B)
+      if arbitrage_B:
+        _path_arbitrage_B(amm, k, balances, target_A)
+
+  amm.balance_A = np.array(balance_A, dtype=np.float64)
+  amm.balance_B = np.array(balance_B, dtype=np.float64)
+
+
+'''
+run num_paths independent copies of run_swap_simulation at once
+returns one (steps, num_paths) array of tvl ratio per amm in amm_list
+the amms of amm_list give the initial pool state, the batch amms quote against oracle, which can be
+a BatchOracle with one price path per path of the batch (see synthetic_data.py)
+'''
+def run_batch_swap_simulation(
+  num_retail_traders, num_arb_traders, trade_prob,
+  oracle: Oracle, amm_list: list[AMM], num_paths,
+  seed=None, plt=None, max_steps=None, title=""):
+
+  if max_steps is None:
+    max_steps = oracle.max_index
+  rng = np.random.default_rng(seed)
+  batch_amm_list: list[BatchAMM] = [amm.get_batch_amm(num_paths) for amm in amm_list]
+  for batch_amm in batch_amm_list:
+    batch_amm.oracle = oracle
+  if isinstance(oracle, BatchOracle):
+    assert(oracle.get_num_paths() == num_paths)
+
+  num_traders = num_retail_traders + num_arb_traders
+  accepted_price_range = RETAIL_MAX_PRICE_RANGE * rng.random((num_paths, num_retail_traders))
+  trader_order = np.tile(np.arange(num_traders), (num_paths, 1))
+  tvl_ratio_change_list = [[] for _ in range(len(amm_list))]
+
+  for _ in range(max_steps):
+    trader_order = rng.permuted(trader_order, axis=1)
+    selected_len = (rng.random(num_paths) * num_traders).astype(np.int64)
+
+    for k in range(len(batch_amm_list)):
+      amm = batch_amm_list[k]
+      _execute_step_trades(amm, oracle, rng, trader_order, selected_len, accepted_price_range, num_retail_traders, trade_prob)
+      tvl_ratio_change_list[k].append(amm.get_tvl_ratio_to_initial_state())
+
+    if oracle.step_foward() is False:
+      break
+
+  tvl_ratio_change_list = [np.array(tvl_ratio_change) for tvl_ratio_change in tvl_ratio_change_list]
+
+  if not plt is None:
+    plt.figure(figsize = (24,12))
+
+    for i in range(len(batch_amm_list)):
+      steps = np.arange(len(tvl_ratio_change_list[i]))
+      plt.plot(steps, tvl_ratio_change_list[i].mean(axis=1), label=batch_amm_list[i].get_name())
+      plt.fill_between(
+        steps, np.percentile(tvl_ratio_change_list[i], 5, axis=1), np.percentile(tvl_ratio_change_list[i], 95, axis=1), alpha=0.2)
+
+    plt.legend()
+    plt.title("num_retail_traders=" + str(num_retail_traders) + "\nnum_arb_traders=" + str(num_arb_traders) + "\nnum_paths=" + str(num_paths))
+    plt.xlabel("step")
+    plt.ylabel("pool tvl compare to the initial state (mean, 5%-95%) " + title)
+    plt.grid()
+    plt.show()
+
+  return tvl_ratio_change_list
+
+
+'''
+pools on several pairs of one MultiAssetOracle, run together by run_registry_swap_simulation
+the amms are built on the pair oracles of the multi asset oracle (oracle.get_pair_oracle(asset_A, asset_B))
+the pools of the same amm class and settings are stacked into one batch amm, one path per pool, whose trades
+run as in _execute_pool_step_trades: the state independent parts at once, the quotes and swaps pool by pool
+'''
+class PoolRegistry():
+  def __init__(self, oracle: MultiAssetOracle) -> None:
+    self.oracle = oracle
+    self.amms: list[AMM] = []
+    self.pairs: list[tuple] = []
+
+  def __len__(self):
+    return len(self.amms)
+
+  ''' add the pool of amm, trading asset_A (token A) for asset_B (token B), returns its pool id '''
+  def add_pool(self, amm: AMM, asset_A, asset_B) -> int:
+    self.oracle.get_asset_index(asset_A)
+    self.oracle.get_asset_index(asset_B)
+    self.amms.append(amm)
+    self.pairs.append((asset_A, asset_B))
+    return len(self.amms) - 1
+
+  def get_name(self, pool_id):
+    asset_A, asset_B = self.pairs[pool_id]
+    return self.amms[pool_id].get_name() + " " + str(asset_B) + "-" + str(asset_A)
+
+  ''' the pools of a group share the batch formulas, i.e. the amm class and its flags '''
+  def _get_group_key(self, amm: AMM):
+    return (type(amm), getattr(amm, "enable_price_adjustment", None), getattr(amm, "enable_conf_interval", None))
+
+  '''
+  (pool ids, batch amm) of every group of pools, with the state of the pools as they are now
+  a batch amm quotes against the PairsOracle of its pools, its retail traders sell up to RETAIL_MAX_SELL_A_AMOUNT
+  in numeraire, converted to asset_A at the current prices
+  '''
+  def get_batch_groups(self) -> list[tuple]:
+    groups: dict[tuple, list[int]] = {}
+    for pool_id in range(len(self.amms)):
+      groups.setdefault(self._get_group_key(self.amms[pool_id]), []).append(pool_id)
+
+    batch_groups = []
+    for pool_ids in groups.values():
+      amms = [self.amms[pool_id] for pool_id in pool_ids]
+      batch_amm: BatchAMM = type(amms[0].get_batch_amm(1)).from_amms(amms)
+      batch_amm.oracle = self.oracle.get_pairs_oracle([self.pairs[pool_id] for pool_id in pool_ids])
+      batch_amm.retail_max_sell_A_amount = RETAIL_MAX_SELL_A_AMOUNT / self.oracle.get_price()[batch_amm.oracle.asset_index_A]
+      batch_groups.append((np.array(pool_ids, dtype=np.int64), batch_amm))
+    return batch_groups
+
+'''
+run_swap_simulation on every pool of registry at once, the pairs are all stepped by the multi asset oracle
+every pool has its own num_retail_traders retail traders and num_arb_traders arbitraguers
+returns a (steps, num_pools) array of tvl ratio, one column per pool id
+
+the draws follow the seed scheme of run_batch_swap_simulation with one path per pool, so a registry of
+identical pools on one pair gives the run_batch_swap_simulation of that pool with num_paths=len(registry)
+(within float tolerance)
+'''
+def run_registry_swap_simulation(
+  num_retail_traders, num_arb_traders, trade_prob, registry: PoolRegistry,
+  seed=None, plt=None, max_steps=None, title=""):
+
+  oracle = registry.oracle
+  if max_steps is None:
+    max_steps = oracle.max_index
+  rng = np.random.default_rng(seed)
+  num_pools = len(registry)
+  batch_groups = registry.get_batch_groups()
+
+  num_traders = num_retail_traders + num_arb_traders
+  accepted_price_range = RETAIL_MAX_PRICE_RANGE * rng.random((num_pools, num_retail_traders))
+  trader_order = np.tile(np.arange(num_traders), (num_pools, 1))
+  tvl_ratio_change_list = []
+
+  for _ in range(max_steps):
+    trader_order = rng.permuted(trader_order, axis=1)
+    selected_len = (rng.random(num_pools) * num_traders).astype(np.int64)
+    tvl_ratio = np.empty(num_pools)
+
+    for pool_ids, amm in batch_groups:
+      _execute_pool_step_trades(
+        amm, amm.oracle, rng, trader_order[pool_ids], selected_len[pool_ids], accepted_price_range[pool_ids],
+        num_retail_traders, trade_prob)
+      tvl_ratio[pool_ids] = amm.get_tvl_ratio_to_initial_state()
+
+    tvl_ratio_change_list.append(tvl_ratio)
+    if oracle.step_foward() is False:
+      break
+
+  tvl_ratio_change_list = np.array(tvl_ratio_change_list).reshape((-1, num_pools))
+
+  if not plt is None:
+    plt.figure(figsize = (24,12))
+
+    steps = np.arange(len(tvl_ratio_change_list))
+    for pool_id in range(num_pools):
+      plt.plot(steps, tvl_ratio_change_list[:, pool_id], label=registry.get_name(pool_id))
+
+    plt.legend()
+    plt.title("num_retail_traders=" + str(num_retail_traders) + "\nnum_arb_traders=" + str(num_arb_traders) + "\nnum_pools=" + str(num_pools))
+    plt.xlabel("step")
+    plt.ylabel("pool tvl compare to the initial state " + title)
+    plt.grid()
+    plt.show()
+
+  return tvl_ratio_change_list
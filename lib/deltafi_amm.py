@@ -1,12 +1,48 @@
-from lib.lp_bots import DeltafiAMMLP
+import math
+import random
+import numpy as np
 from .prototypes import AMM
+from .recorder import EVENT_SWAP_A_FOR_B, EVENT_SWAP_B_FOR_A
 from .price_data import Oracle
+from .lp_bots import DeltafiAMMLP
+from .batch_simulation import BatchDeltafiAMM
+from .kernels import BACKENDS, deltafi_swap_out_regular, deltafi_swap_out_adjusted
+
+PRICE_MODES = ("spot", "twap", "ema")
+
+''' quantities of DeltafiAMM that only change with the oracle step or the target reserves '''
+class DeltafiStepCache():
+  __slots__ = (
+    "price", "price_B_selling_B", "price_A_selling_A", "exp_buy_A", "exp_buy_B",
+    "reserve_ratio_A_to_B", "reserve_ratio_B_to_A", "initial_value_in_A", "initial_value_in_B", "initial_tvl",
+  )
+
+  def __init__(self, amm) -> None:
+    ''' price is the oracle price the tvl is measured at, the curve quotes off get_quote_price() '''
+    self.price = amm.oracle.get_price()
+    quote_price = amm.get_quote_price()
+    self.price_B_selling_B = quote_price - amm.get_conf_interval()
+    self.price_A_selling_A = 1 / (quote_price + amm.get_conf_interval())
+    self.exp_buy_A = self.price_B_selling_B * amm.target_reserve_B / amm.target_reserve_A
+    self.exp_buy_B = self.price_A_selling_A * amm.target_reserve_A / amm.target_reserve_B
+    self.reserve_ratio_A_to_B = amm.target_reserve_A / amm.target_reserve_B
+    self.reserve_ratio_B_to_A = amm.target_reserve_B / amm.target_reserve_A
+    self.initial_value_in_A = amm.target_reserve_A + amm.target_reserve_B * self.price_B_selling_B
+    self.initial_value_in_B = amm.target_reserve_A * self.price_A_selling_A + amm.target_reserve_B
+    self.initial_tvl = amm.target_reserve_A + amm.target_reserve_B * self.price
 
 ''' simple V2 implementation '''
 class DeltafiAMM(AMM):
+  __slots__ = (
+    "target_reserve_A", "target_reserve_B", "balance_A", "balance_B", "share_A_supply", "share_B_supply",
+    "oracle", "fee_rate", "enable_external_exchange", "enable_price_adjustment", "enable_conf_interval", "backend",
+    "price_mode", "price_window", "price_blend",
+  )
+
   def __init__(
     self, initial_reserve_A, initial_reserve_B, oracle: Oracle, fee_rate=0, 
-    enable_external_exchange=False, enable_price_adjustment=False, enable_conf_interval=False):
+    enable_external_exchange=False, enable_price_adjustment=False, enable_conf_interval=False, backend="python",
+    price_mode="spot", price_window=None, price_blend=1):
     
     '''
     target reserve for calculating the A to B ratio only
@@ -39,6 +75,25 @@ class DeltafiAMM(AMM):
     self.enable_price_adjustment = enable_price_adjustment
     self.enable_conf_interval = enable_conf_interval
 
+    ''' "python" quotes with the methods below, "numba" with the compiled kernels of kernels.py '''
+    assert(backend in BACKENDS)
+    self.backend = backend
+
+    '''
+    price the curve quotes off: "spot" the oracle price, "twap" the oracle twap over price_window steps
+    (None for the twap published with the oracle), "ema" the oracle ema of span price_window
+    price_blend is the weight of the twap / ema against the spot price, 1 quotes off the twap / ema only
+    the tvl is always measured at the spot price
+    '''
+    assert(price_mode in PRICE_MODES)
+    assert(price_mode != "ema" or price_window is not None)
+    self.price_mode = price_mode
+    self.price_window = price_window
+    self.price_blend = price_blend
+
+    self.invalidate_step_cache()
+    self.set_recorder(None)
+
   def get_name(self):
     name = "deltafi V2"
     if self.enable_external_exchange is True:
@@ -47,6 +102,8 @@ class DeltafiAMM(AMM):
       name += " + price adjustment"
     if self.enable_conf_interval is True:
       name += " + confidence interval"
+    if self.price_mode != "spot":
+      name += " + " + self.price_mode + " quote"
 
     if self.fee_rate > 0:
       name += ",fee rate=" + str(self.fee_rate*100) + "%"
@@ -64,10 +121,24 @@ class DeltafiAMM(AMM):
       return self.oracle.get_conf_interval()
     return 0
 
+  def get_quote_price(self):
+    price = self.oracle.get_price()
+    if self.price_mode == "spot":
+      return price
+    if self.price_mode == "twap":
+      reference_price = self.oracle.get_twap(self.price_window)
+    else:
+      reference_price = self.oracle.get_ema(self.price_window)
+    return price + self.price_blend * (reference_price - price)
+
+  def _compute_step_cache(self):
+    return DeltafiStepCache(self)
+
   ''' implied price for how much A we can buy when selling 1 B '''
   def get_implied_price_B_for_A(self):
-    price_B_selling_B = self.oracle.get_price() - self.get_conf_interval()
-    price_modifier = self.target_reserve_B / self.target_reserve_A * self.balance_A / self.balance_B
+    step_cache = self.get_step_cache()
+    price_B_selling_B = step_cache.price_B_selling_B
+    price_modifier = step_cache.reserve_ratio_B_to_A * self.balance_A / self.balance_B
 
     if self.enable_price_adjustment and price_modifier > 1:
       return price_B_selling_B
@@ -77,8 +148,9 @@ class DeltafiAMM(AMM):
 
   ''' implied price for how much B we can buy when selling 1 A '''
   def get_implied_price_A_for_B(self):
-    price_A_selling_A = 1 / (self.oracle.get_price() + self.get_conf_interval())
-    price_modifier = self.target_reserve_A / self.target_reserve_B * self.balance_B / self.balance_A
+    step_cache = self.get_step_cache()
+    price_A_selling_A = step_cache.price_A_selling_A
+    price_modifier = step_cache.reserve_ratio_A_to_B * self.balance_B / self.balance_A
 
     if self.enable_price_adjustment and price_modifier > 1:
       return price_A_selling_A
@@ -88,10 +160,11 @@ class DeltafiAMM(AMM):
 
   ''' get how much token A can be bought with token B with price adjustment '''
   def _get_swap_out_A_adjusted(self, token_B_input):
-    price_B_selling_B = self.oracle.get_price() - self.get_conf_interval()
+    step_cache = self.get_step_cache()
+    price_B_selling_B = step_cache.price_B_selling_B
 
     current_value_in_A = self.balance_A + self.balance_B * price_B_selling_B
-    initial_value_in_A = self.target_reserve_A + self.target_reserve_B * price_B_selling_B
+    initial_value_in_A = step_cache.initial_value_in_A
 
     target_A = self.target_reserve_A * (current_value_in_A / initial_value_in_A)
     target_B = self.target_reserve_B * (current_value_in_A / initial_value_in_A)
@@ -105,7 +178,7 @@ class DeltafiAMM(AMM):
     
     if sell_B_to_target > 0:
       buy_A_to_target = sell_B_to_target * price_B_selling_B
-      exp = price_B_selling_B * self.target_reserve_B / self.target_reserve_A
+      exp = step_cache.exp_buy_A
       buy_A_beyond_target = (self.balance_A - buy_A_to_target) * (1 - ((self.balance_B + sell_B_to_target) / (token_B_input + self.balance_B))**exp)
 
       return (buy_A_to_target + buy_A_beyond_target) * (1 - self.fee_rate)
@@ -114,22 +187,26 @@ class DeltafiAMM(AMM):
 
   ''' get how much token A can be bought with token B without price adjustment '''
   def _get_swap_out_A_regular(self, token_B_input):
-    price_B_selling_B = self.oracle.get_price() - self.get_conf_interval()
-    exp = price_B_selling_B * self.target_reserve_B / self.target_reserve_A
+    step_cache = self.get_step_cache()
+    price_B_selling_B = step_cache.price_B_selling_B
+    exp = step_cache.exp_buy_A
     result = self.balance_A * (1 - (self.balance_B / (token_B_input + self.balance_B))**exp)
 
     return result * (1 - self.fee_rate)
 
   def get_swap_out_A(self, token_B_input):
+    if self.backend == "numba":
+      return self._get_swap_out_A_kernel(token_B_input)
     if self.enable_price_adjustment is True:
       return self._get_swap_out_A_adjusted(token_B_input)
     return self._get_swap_out_A_regular(token_B_input)
 
   ''' get how much token B can be bought with token A with price adjustment '''
   def _get_swap_out_B_adjusted(self, token_A_input):
-    price_A_selling_A = 1 / (self.oracle.get_price() + self.get_conf_interval())
+    step_cache = self.get_step_cache()
+    price_A_selling_A = step_cache.price_A_selling_A
     current_value_in_B = self.balance_A * price_A_selling_A + self.balance_B
-    initial_value_in_B = self.target_reserve_A * price_A_selling_A + self.target_reserve_B
+    initial_value_in_B = step_cache.initial_value_in_B
 
     target_A = self.target_reserve_A * (current_value_in_B / initial_value_in_B)
     target_B = self.target_reserve_B * (current_value_in_B / initial_value_in_B)
@@ -144,7 +221,7 @@ class DeltafiAMM(AMM):
     
     if sell_A_to_target > 0:
       buy_B_to_target = sell_A_to_target * price_A_selling_A
-      exp = price_A_selling_A * self.target_reserve_A / self.target_reserve_B
+      exp = step_cache.exp_buy_B
       buy_B_beyond_target = (self.balance_B - buy_B_to_target) * (1 - ((self.balance_A + sell_A_to_target) / (token_A_input + self.balance_A))**exp)
 
       return (buy_B_to_target + buy_B_beyond_target) * (1 - self.fee_rate)
@@ -153,17 +230,176 @@ class DeltafiAMM(AMM):
 
   ''' get how much token B can be bought with token A without price adjustment '''
   def _get_swap_out_B_regular(self, token_A_input):
-    price_A_selling_A = 1 / (self.oracle.get_price() + self.get_conf_interval())
-    exp = price_A_selling_A * self.target_reserve_A / self.target_reserve_B
+    step_cache = self.get_step_cache()
+    price_A_selling_A = step_cache.price_A_selling_A
+    exp = step_cache.exp_buy_B
     result = self.balance_B * (1 - (self.balance_A / (token_A_input + self.balance_A))**exp)
 
     return result*(1 - self.fee_rate)
 
   def get_swap_out_B(self, token_A_input):
+    if self.backend == "numba":
+      return self._get_swap_out_B_kernel(token_A_input)
     if self.enable_price_adjustment is True:
       return self._get_swap_out_B_adjusted(token_A_input)
     return self._get_swap_out_B_regular(token_A_input)
 
+  ''' get_swap_out_A with the compiled kernels '''
+  def _get_swap_out_A_kernel(self, token_B_input):
+    step_cache = self.get_step_cache()
+    if self.enable_price_adjustment is True:
+      return deltafi_swap_out_adjusted(
+        self.balance_B, self.balance_A, self.target_reserve_B, self.target_reserve_A,
+        step_cache.price_B_selling_B, step_cache.exp_buy_A, self.fee_rate, token_B_input)
+    return deltafi_swap_out_regular(self.balance_B, self.balance_A, step_cache.exp_buy_A, self.fee_rate, token_B_input)
+
+  ''' get_swap_out_B with the compiled kernels '''
+  def _get_swap_out_B_kernel(self, token_A_input):
+    step_cache = self.get_step_cache()
+    if self.enable_price_adjustment is True:
+      return deltafi_swap_out_adjusted(
+        self.balance_A, self.balance_B, self.target_reserve_A, self.target_reserve_B,
+        step_cache.price_A_selling_A, step_cache.exp_buy_B, self.fee_rate, token_A_input)
+    return deltafi_swap_out_regular(self.balance_A, self.balance_B, step_cache.exp_buy_B, self.fee_rate, token_A_input)
+
+  '''
+  balance of the input token after the profit maximising trade on the curve
+  output = (1 - fee) * balance_out * (1 - (balance_in / (balance_in + input))**exp)
+  selling the output elsewhere at target_price, the marginal gain is zero when
+  (balance_in + input)**(exp + 1) = (1 - fee) * balance_out * exp * balance_in**exp * target_price
+  '''
+  def _get_optimal_balance_in(self, balance_in, balance_out, exp, target_price):
+    return math.exp((math.log((1 - self.fee_rate) * balance_out * exp * target_price) + exp * math.log(balance_in)) / (exp + 1))
+
+  ''' amount of A to sell for B that maximises the arbitraguer gain when B is sold elsewhere at target_price_B_sell_B '''
+  def get_optimal_arb_sell_A(self, target_price_B_sell_B):
+    step_cache = self.get_step_cache()
+    price_A_selling_A = step_cache.price_A_selling_A
+    exp = step_cache.exp_buy_B
+
+    if self.enable_price_adjustment is True:
+      current_value_in_B = self.balance_A * price_A_selling_A + self.balance_B
+      initial_value_in_B = step_cache.initial_value_in_B
+      sell_A_to_target = self.target_reserve_A * (current_value_in_B / initial_value_in_B) - self.balance_A
+
+      ''' the curve beyond the target is never cheaper than the flat oracle price before it '''
+      if sell_A_to_target > 0:
+        if price_A_selling_A * (1 - self.fee_rate) * target_price_B_sell_B <= 1:
+          return 0
+        buy_B_to_target = sell_A_to_target * price_A_selling_A
+        optimal_balance_A = self._get_optimal_balance_in(
+          self.balance_A + sell_A_to_target, self.balance_B - buy_B_to_target, exp, target_price_B_sell_B)
+        return max(sell_A_to_target, optimal_balance_A - self.balance_A)
+
+    optimal_balance_A = self._get_optimal_balance_in(self.balance_A, self.balance_B, exp, target_price_B_sell_B)
+    return max(0, optimal_balance_A - self.balance_A)
+
+  ''' amount of B to sell for A that maximises the arbitraguer gain when A is sold elsewhere at target_price_A_sell_A '''
+  def get_optimal_arb_sell_B(self, target_price_A_sell_A):
+    step_cache = self.get_step_cache()
+    price_B_selling_B = step_cache.price_B_selling_B
+    exp = step_cache.exp_buy_A
+
+    if self.enable_price_adjustment is True:
+      current_value_in_A = self.balance_A + self.balance_B * price_B_selling_B
+      initial_value_in_A = step_cache.initial_value_in_A
+      sell_B_to_target = self.target_reserve_B * (current_value_in_A / initial_value_in_A) - self.balance_B
+
+      if sell_B_to_target > 0:
+        if price_B_selling_B * (1 - self.fee_rate) * target_price_A_sell_A <= 1:
+          return 0
+        buy_A_to_target = sell_B_to_target * price_B_selling_B
+        optimal_balance_B = self._get_optimal_balance_in(
+          self.balance_B + sell_B_to_target, self.balance_A - buy_A_to_target, exp, target_price_A_sell_A)
+        return max(sell_B_to_target, optimal_balance_B - self.balance_B)
+
+    optimal_balance_B = self._get_optimal_balance_in(self.balance_B, self.balance_A, exp, target_price_A_sell_A)
+    return max(0, optimal_balance_B - self.balance_B)
+
+  '''
+  quote ladders and inverse quotes over arrays of sizes, one array evaluation of the closed form curve whatever the backend
+  the curve helpers are side generic, selling the "in" token for the "out" token, price is the flat price of the
+  price adjustment (amount of out token for 1 in token) and exp the exponent of the step cache
+  '''
+  def _get_curve_selling_B(self):
+    step_cache = self.get_step_cache()
+    return self.balance_B, self.balance_A, self.target_reserve_B, self.target_reserve_A, step_cache.price_B_selling_B, step_cache.exp_buy_A
+
+  def _get_curve_selling_A(self):
+    step_cache = self.get_step_cache()
+    return self.balance_A, self.balance_B, self.target_reserve_A, self.target_reserve_B, step_cache.price_A_selling_A, step_cache.exp_buy_B
+
+  ''' amount of in token the flat part of the price adjustment takes, 0 without price adjustment or past the target '''
+  def _get_sell_in_to_target(self, balance_in, balance_out, target_in, target_out, price):
+    if self.enable_price_adjustment is not True:
+      return 0
+    current_value = balance_out + balance_in * price
+    initial_value = target_out + target_in * price
+    return max(0, target_in * (current_value / initial_value) - balance_in)
+
+  def _get_swap_out_ladder(self, balance_in, balance_out, target_in, target_out, price, exp, token_inputs):
+    token_inputs = np.asarray(token_inputs, dtype=float)
+    sell_in_to_target = self._get_sell_in_to_target(balance_in, balance_out, target_in, target_out, price)
+    if sell_in_to_target == 0:
+      return deltafi_swap_out_regular(balance_in, balance_out, exp, self.fee_rate, token_inputs)
+
+    buy_out_to_target = sell_in_to_target * price
+    buy_out_beyond_target = (balance_out - buy_out_to_target) * (1 - ((balance_in + sell_in_to_target) / (token_inputs + balance_in))**exp)
+    token_outputs = np.where(token_inputs < sell_in_to_target, token_inputs * price, buy_out_to_target + buy_out_beyond_target)
+    return token_outputs * (1 - self.fee_rate)
+
+  ''' input of the regular curve for outputs before the fee: (balance_in / (balance_in + input))**exp = 1 - output / balance_out '''
+  @staticmethod
+  def _get_swap_in_regular(balance_in, balance_out, exp, token_outputs):
+    remaining_out = np.maximum(1 - token_outputs / balance_out, 0)
+    with np.errstate(divide="ignore"):
+      return balance_in * (remaining_out**(-1 / exp) - 1)
+
+  def _get_swap_in(self, balance_in, balance_out, target_in, target_out, price, exp, token_outputs):
+    token_outputs = np.asarray(token_outputs, dtype=float) / (1 - self.fee_rate)
+    sell_in_to_target = self._get_sell_in_to_target(balance_in, balance_out, target_in, target_out, price)
+    if sell_in_to_target == 0:
+      return self._get_swap_in_regular(balance_in, balance_out, exp, token_outputs)
+
+    buy_out_to_target = sell_in_to_target * price
+    sell_in_beyond_target = self._get_swap_in_regular(
+      balance_in + sell_in_to_target, balance_out - buy_out_to_target, exp, np.maximum(token_outputs - buy_out_to_target, 0))
+    return np.where(token_outputs < buy_out_to_target, token_outputs / price, sell_in_to_target + sell_in_beyond_target)
+
+  '''
+  the marginal price of the regular curve is (1 - fee) * exp * balance_out * balance_in**exp / (balance_in + input)**(exp + 1),
+  the same solve as _get_optimal_balance_in with target_price = 1 / implied_price
+  '''
+  def _get_swap_in_for_price(self, balance_in, balance_out, target_in, target_out, price, exp, implied_prices):
+    implied_prices = np.asarray(implied_prices, dtype=float)
+    sell_in_to_target = self._get_sell_in_to_target(balance_in, balance_out, target_in, target_out, price)
+    buy_out_to_target = sell_in_to_target * price
+    balance_in += sell_in_to_target
+    balance_out -= buy_out_to_target
+    optimal_balance_in = np.exp((np.log((1 - self.fee_rate) * balance_out * exp / implied_prices) + exp * math.log(balance_in)) / (exp + 1))
+    sell_in_amount = np.maximum(sell_in_to_target, optimal_balance_in - (balance_in - sell_in_to_target))
+    if sell_in_to_target == 0:
+      return sell_in_amount
+    return np.where(price * (1 - self.fee_rate) <= implied_prices, 0.0, sell_in_amount)
+
+  def get_swap_out_A_ladder(self, token_B_inputs):
+    return self._get_swap_out_ladder(*self._get_curve_selling_B(), token_B_inputs)
+
+  def get_swap_out_B_ladder(self, token_A_inputs):
+    return self._get_swap_out_ladder(*self._get_curve_selling_A(), token_A_inputs)
+
+  def get_swap_in_B(self, token_A_outputs):
+    return self._get_swap_in(*self._get_curve_selling_B(), token_A_outputs)
+
+  def get_swap_in_A(self, token_B_outputs):
+    return self._get_swap_in(*self._get_curve_selling_A(), token_B_outputs)
+
+  def get_swap_in_A_for_price(self, implied_prices_A_for_B):
+    return self._get_swap_in_for_price(*self._get_curve_selling_A(), implied_prices_A_for_B)
+
+  def get_swap_in_B_for_price(self, implied_prices_B_for_A):
+    return self._get_swap_in_for_price(*self._get_curve_selling_B(), implied_prices_B_for_A)
+
   ''' do the swap: sell A for B '''
   def swap_A_for_B(self, token_A_input):
     implied_price = self.get_implied_price_A_for_B()
@@ -173,6 +409,8 @@ class DeltafiAMM(AMM):
     self.balance_B -= token_B_output
 
     actual_price = token_B_output / token_A_input
+    if self.recorder is not None:
+      self._record_swap(EVENT_SWAP_A_FOR_B, token_A_input, token_B_output, implied_price, actual_price)
 
     return token_A_input, abs(implied_price - actual_price) / implied_price
 
@@ -185,16 +423,17 @@ class DeltafiAMM(AMM):
     self.balance_A -= token_A_output
     self.balance_B += token_B_input
     actual_price = token_A_output / token_B_input
+    if self.recorder is not None:
+      self._record_swap(EVENT_SWAP_B_FOR_A, token_B_input, token_A_output, implied_price, actual_price)
 
     return token_A_output, abs(implied_price - actual_price) / implied_price
   
   ''' using current oracle price, get current_tvl/initial_tvl '''
   def get_tvl_ratio_to_initial_state(self):
+    step_cache = self.get_step_cache()
+    current_tvl = self.balance_A + self.balance_B * step_cache.price
 
-    current_tvl = self.balance_A + self.balance_B * self.oracle.get_price()
-    initial_tvl = self.target_reserve_A + self.target_reserve_B * self.oracle.get_price()
-    
-    return current_tvl / initial_tvl
+    return current_tvl / step_cache.initial_tvl
 
   ''' 
   do the deposit
@@ -220,18 +459,15 @@ class DeltafiAMM(AMM):
     self.share_B_supply += share_B
     self.target_reserve_A = normalized_balance_A + token_A_amount
     self.target_reserve_B = normalized_balance_B + token_B_amount
+    self.invalidate_step_cache()
 
     return share_A, share_B, token_A_amount
   
   '''
-  do the withdraw
-  input share A and share B amount, calculate how much token A and token B to come out
-  there is no restriction between share A and share B here
-  but in reality, we will record the LP's total share and only allow LP
-  the withdraw same percentage of his share A and share B
+  token amounts coming out for share A and share B, against the current balances
+  they are linear in the shares, so share_A and share_B can also be arrays of several positions
   '''
-  def lp_withdraw(self, share_A, share_B):
-  
+  def _get_withdraw_amounts(self, share_A, share_B):
     selected_balance_A = self.balance_A
     selected_balance_B = self.balance_B
 
@@ -254,6 +490,9 @@ class DeltafiAMM(AMM):
     token_A_amount += delta_A * share_tvl_ratio
     token_B_amount += delta_B * share_tvl_ratio
 
+    return token_A_amount, token_B_amount, selected_balance_A, selected_balance_B
+
+  def _apply_withdraw(self, share_A, share_B, token_A_amount, token_B_amount, selected_balance_A, selected_balance_B):
     selected_balance_A -= selected_balance_A * (share_A / self.share_A_supply)
     selected_balance_B -= selected_balance_B * (share_B / self.share_B_supply)
 
@@ -265,11 +504,45 @@ class DeltafiAMM(AMM):
 
     self.target_reserve_A = selected_balance_A
     self.target_reserve_B = selected_balance_B
+    self.invalidate_step_cache()
+
+  '''
+  do the withdraw
+  input share A and share B amount, calculate how much token A and token B to come out
+  there is no restriction between share A and share B here
+  but in reality, we will record the LP's total share and only allow LP
+  the withdraw same percentage of his share A and share B
+  '''
+  def lp_withdraw(self, share_A, share_B):
+    token_A_amount, token_B_amount, selected_balance_A, selected_balance_B = self._get_withdraw_amounts(share_A, share_B)
+    self._apply_withdraw(share_A, share_B, token_A_amount, token_B_amount, selected_balance_A, selected_balance_B)
 
     return token_A_amount, token_B_amount
+
+  '''
+  withdraw of several lp positions (arrays of share A and share B) against the same pool state
+  the pool ends up as after lp_withdraw of the total shares, arrays of the amounts are returned
+  '''
+  def lp_withdraw_batch(self, shares_A, shares_B):
+    token_A_amounts, token_B_amounts, selected_balance_A, selected_balance_B = self._get_withdraw_amounts(shares_A, shares_B)
+    self._apply_withdraw(
+      shares_A.sum(), shares_B.sum(), token_A_amounts.sum(), token_B_amounts.sum(), selected_balance_A, selected_balance_B)
+
+    return token_A_amounts, token_B_amounts
   
   ''' get the lp bot used for deposit/withdraw simulation '''
-  def get_lp_bot(self, max_deposit_record, min_holding_cycles, deposit_prob, withdraw_prob):
+  def get_lp_bot(self, max_deposit_record=1000, min_holding_cycles=10000, deposit_prob=1, withdraw_prob=0.05, rng=random):
     return DeltafiAMMLP(
       self, oracle=self.oracle, max_deposit_record=max_deposit_record, min_holding_cycles=min_holding_cycles, 
-      deposit_prob=deposit_prob, withdraw_prob=withdraw_prob)
+      deposit_prob=deposit_prob, withdraw_prob=withdraw_prob, rng=rng)
+
+  ''' get the batched copy used for monte carlo simulation over many paths '''
+  def get_batch_amm(self, num_paths):
+    return BatchDeltafiAMM(self, num_paths)
+
+  def get_state(self):
+    return self.balance_A, self.balance_B, self.target_reserve_A, self.target_reserve_B, self.share_A_supply, self.share_B_supply
+
+  def set_state(self, state):
+    self.balance_A, self.balance_B, self.target_reserve_A, self.target_reserve_B, self.share_A_supply, self.share_B_supply = state
+    self.invalidate_step_cache()
@@ -0,0 +1,440 @@
+import math
+import random
+import numpy as np
+
+from .price_data import Oracle, StreamingOracle
+from .prototypes import AMM
+from .deltafi_amm import DeltafiAMM
+from .uniswap_amm import UniswapAMM
+from .internal_arb_amm import DeltafiInternalArbAMM, UniswapInternalArbAMM
+from .trading_bots import RetailAgentPool
+from .rng import RandomStreams
+from .batch_simulation import RETAIL_MAX_SELL_A_AMOUNT
+from .kernels import (
+  HAS_NUMBA, compile_kernel, deltafi_swap_out_regular, deltafi_swap_out_adjusted, uniswap_swap_out,
+  deltafi_internal_arb_optimal_trade, uniswap_internal_arb_rebalance,
+)
+
+'''
+fast mode of run_swap_simulation: the whole step loop (trader selection, retail and arb trades, swaps
+and tvl recording) in one routine working on a table of pool states, compiled when numba is installed
+
+it follows the object based loop of simulation.py, which stays the reference, trade by trade
+but draws its random numbers from its own generator (seeded from the random module) and selects the
+traders of a step with a partial shuffle, so it matches the reference in distribution, not path by path
+compiled, the generator is the one of numba, uncompiled it is the random module, reseeded for the run and then
+restored, so the draws of the caller on the random module do not depend on the fast run
+'''
+
+KIND_DELTAFI = 0
+KIND_UNISWAP = 1
+KIND_DELTAFI_INTERNAL_ARB = 2
+KIND_UNISWAP_INTERNAL_ARB = 3
+
+''' columns of the float pool state table '''
+BALANCE_A = 0
+BALANCE_B = 1
+ARB_BALANCE_A = 2
+ARB_BALANCE_B = 3
+''' target reserves of the deltafi curve (of the child pool for the internal arb amm) '''
+TARGET_RESERVE_A = 4
+TARGET_RESERVE_B = 5
+''' reserves the tvl ratio is measured against, also the target ratio of the internal arb rebalance '''
+INITIAL_RESERVE_A = 6
+INITIAL_RESERVE_B = 7
+FEE_RATE = 8
+ARB_REBALANCE_RATIO = 9
+NUM_POOL_COLUMNS = 10
+
+''' columns of the int pool flag table '''
+KIND = 0
+PRICE_ADJUSTMENT = 1
+CONF_INTERVAL = 2
+NUM_FLAG_COLUMNS = 3
+
+ARB_MODES = {"search": 0, "optimal": 1}
+ARB_MODE_OPTIMAL = 1
+
+@compile_kernel
+def _is_uniswap(flags, k):
+  return flags[k, KIND] == KIND_UNISWAP or flags[k, KIND] == KIND_UNISWAP_INTERNAL_ARB
+
+@compile_kernel
+def _get_conf_interval(flags, k, conf_interval):
+  if flags[k, CONF_INTERVAL] == 1:
+    return conf_interval
+  return 0.0
+
+''' balances the pool quotes with: after the rebalance for the internal arb amms, the current ones otherwise '''
+@compile_kernel
+def _get_rebalanced_balances(pools, flags, k, price):
+  balance_A = pools[k, BALANCE_A]
+  balance_B = pools[k, BALANCE_B]
+  arb_balance_A = pools[k, ARB_BALANCE_A]
+  arb_balance_B = pools[k, ARB_BALANCE_B]
+
+  if flags[k, KIND] == KIND_UNISWAP_INTERNAL_ARB:
+    return uniswap_internal_arb_rebalance(balance_A, balance_B, arb_balance_A, arb_balance_B, price)
+
+  if flags[k, KIND] == KIND_DELTAFI_INTERNAL_ARB:
+    target_ratio_A_to_B = pools[k, INITIAL_RESERVE_A] / pools[k, INITIAL_RESERVE_B]
+    delta_A, delta_B = deltafi_internal_arb_optimal_trade(target_ratio_A_to_B, balance_A, balance_B, price)
+
+    if delta_A > 0:
+      arb_sell_A = max(0.0, min(delta_A*pools[k, ARB_REBALANCE_RATIO], arb_balance_A))
+      arb_buy_B = _get_swap_out_B(pools, flags, k, price, 0.0, balance_A, balance_B, arb_sell_A)
+      return balance_A + arb_sell_A, balance_B - arb_buy_B, arb_balance_A - arb_sell_A, arb_balance_B + arb_buy_B
+    elif delta_B > 0:
+      arb_sell_B = max(0.0, min(delta_B*pools[k, ARB_REBALANCE_RATIO], arb_balance_B))
+      arb_buy_A = _get_swap_out_A(pools, flags, k, price, 0.0, balance_A, balance_B, arb_sell_B)
+      return balance_A - arb_buy_A, balance_B + arb_sell_B, arb_balance_A + arb_buy_A, arb_balance_B - arb_sell_B
+
+  return balance_A, balance_B, arb_balance_A, arb_balance_B
+
+''' amount of B bought with token_A_input of A on the given balances of pool k '''
+@compile_kernel
+def _get_swap_out_B(pools, flags, k, price, conf_interval, balance_A, balance_B, token_A_input):
+  fee_rate = pools[k, FEE_RATE]
+  if _is_uniswap(flags, k):
+    return uniswap_swap_out(balance_A, balance_B, fee_rate, token_A_input)
+
+  target_reserve_A = pools[k, TARGET_RESERVE_A]
+  target_reserve_B = pools[k, TARGET_RESERVE_B]
+  price_A_selling_A = 1 / (price + _get_conf_interval(flags, k, conf_interval))
+  exp = price_A_selling_A * target_reserve_A / target_reserve_B
+  if flags[k, PRICE_ADJUSTMENT] == 1:
+    return deltafi_swap_out_adjusted(balance_A, balance_B, target_reserve_A, target_reserve_B, price_A_selling_A, exp, fee_rate, token_A_input)
+  return deltafi_swap_out_regular(balance_A, balance_B, exp, fee_rate, token_A_input)
+
+''' amount of A bought with token_B_input of B on the given balances of pool k '''
+@compile_kernel
+def _get_swap_out_A(pools, flags, k, price, conf_interval, balance_A, balance_B, token_B_input):
+  fee_rate = pools[k, FEE_RATE]
+  if _is_uniswap(flags, k):
+    return uniswap_swap_out(balance_B, balance_A, fee_rate, token_B_input)
+
+  target_reserve_A = pools[k, TARGET_RESERVE_A]
+  target_reserve_B = pools[k, TARGET_RESERVE_B]
+  price_B_selling_B = price - _get_conf_interval(flags, k, conf_interval)
+  exp = price_B_selling_B * target_reserve_B / target_reserve_A
+  if flags[k, PRICE_ADJUSTMENT] == 1:
+    return deltafi_swap_out_adjusted(balance_B, balance_A, target_reserve_B, target_reserve_A, price_B_selling_B, exp, fee_rate, token_B_input)
+  return deltafi_swap_out_regular(balance_B, balance_A, exp, fee_rate, token_B_input)
+
+''' how much B we can buy when selling 1 A '''
+@compile_kernel
+def _get_implied_price_A_for_B(pools, flags, k, price, conf_interval, balance_A, balance_B):
+  fee_rate = pools[k, FEE_RATE]
+  if _is_uniswap(flags, k):
+    return (balance_B / balance_A) * (1 - fee_rate)
+
+  price_A_selling_A = 1 / (price + _get_conf_interval(flags, k, conf_interval))
+  price_modifier = (pools[k, TARGET_RESERVE_A] / pools[k, TARGET_RESERVE_B]) * balance_B / balance_A
+  if flags[k, PRICE_ADJUSTMENT] == 1 and price_modifier > 1:
+    return price_A_selling_A
+  return price_A_selling_A * price_modifier * (1 - fee_rate)
+
+''' how much A we can buy when selling 1 B '''
+@compile_kernel
+def _get_implied_price_B_for_A(pools, flags, k, price, conf_interval, balance_A, balance_B):
+  fee_rate = pools[k, FEE_RATE]
+  if _is_uniswap(flags, k):
+    return (balance_A / balance_B) * (1 - fee_rate)
+
+  price_B_selling_B = price - _get_conf_interval(flags, k, conf_interval)
+  price_modifier = (pools[k, TARGET_RESERVE_B] / pools[k, TARGET_RESERVE_A]) * balance_A / balance_B
+  if flags[k, PRICE_ADJUSTMENT] == 1 and price_modifier > 1:
+    return price_B_selling_B
+  return price_B_selling_B * price_modifier * (1 - fee_rate)
+
+''' DeltafiAMM._get_optimal_balance_in '''
+@compile_kernel
+def _get_optimal_balance_in(fee_rate, balance_in, balance_out, exp, target_price):
+  return math.exp((math.log((1 - fee_rate) * balance_out * exp * target_price) + exp * math.log(balance_in)) / (exp + 1))
+
+''' closed form get_optimal_arb_sell_A of the amms '''
+@compile_kernel
+def _get_optimal_arb_sell_A(pools, flags, k, price, conf_interval, balance_A, balance_B, target_price_B_sell_B):
+  fee_rate = pools[k, FEE_RATE]
+  if _is_uniswap(flags, k):
+    return max(0.0, math.sqrt((1 - fee_rate) * (balance_A * balance_B) * target_price_B_sell_B) - balance_A)
+
+  target_reserve_A = pools[k, TARGET_RESERVE_A]
+  target_reserve_B = pools[k, TARGET_RESERVE_B]
+  price_A_selling_A = 1 / (price + _get_conf_interval(flags, k, conf_interval))
+  exp = price_A_selling_A * target_reserve_A / target_reserve_B
+
+  if flags[k, PRICE_ADJUSTMENT] == 1:
+    current_value_in_B = balance_A * price_A_selling_A + balance_B
+    initial_value_in_B = target_reserve_A * price_A_selling_A + target_reserve_B
+    sell_A_to_target = target_reserve_A * (current_value_in_B / initial_value_in_B) - balance_A
+    if sell_A_to_target > 0:
+      if price_A_selling_A * (1 - fee_rate) * target_price_B_sell_B <= 1:
+        return 0.0
+      buy_B_to_target = sell_A_to_target * price_A_selling_A
+      optimal_balance_A = _get_optimal_balance_in(
+        fee_rate, balance_A + sell_A_to_target, balance_B - buy_B_to_target, exp, target_price_B_sell_B)
+      return max(sell_A_to_target, optimal_balance_A - balance_A)
+
+  optimal_balance_A = _get_optimal_balance_in(fee_rate, balance_A, balance_B, exp, target_price_B_sell_B)
+  return max(0.0, optimal_balance_A - balance_A)
+
+''' closed form get_optimal_arb_sell_B of the amms '''
+@compile_kernel
+def _get_optimal_arb_sell_B(pools, flags, k, price, conf_interval, balance_A, balance_B, target_price_A_sell_A):
+  fee_rate = pools[k, FEE_RATE]
+  if _is_uniswap(flags, k):
+    return max(0.0, math.sqrt((1 - fee_rate) * (balance_A * balance_B) * target_price_A_sell_A) - balance_B)
+
+  target_reserve_A = pools[k, TARGET_RESERVE_A]
+  target_reserve_B = pools[k, TARGET_RESERVE_B]
+  price_B_selling_B = price - _get_conf_interval(flags, k, conf_interval)
+  exp = price_B_selling_B * target_reserve_B / target_reserve_A
+
+  if flags[k, PRICE_ADJUSTMENT] == 1:
+    current_value_in_A = balance_A + balance_B * price_B_selling_B
+    initial_value_in_A = target_reserve_A + target_reserve_B * price_B_selling_B
+    sell_B_to_target = target_reserve_B * (current_value_in_A / initial_value_in_A) - balance_B
+    if sell_B_to_target > 0:
+      if price_B_selling_B * (1 - fee_rate) * target_price_A_sell_A <= 1:
+        return 0.0
+      buy_A_to_target = sell_B_to_target * price_B_selling_B
+      optimal_balance_B = _get_optimal_balance_in(
+        fee_rate, balance_B + sell_B_to_target, balance_A - buy_A_to_target, exp, target_price_A_sell_A)
+      return max(sell_B_to_target, optimal_balance_B - balance_B)
+
+  optimal_balance_B = _get_optimal_balance_in(fee_rate, balance_B, balance_A, exp, target_price_A_sell_A)
+  return max(0.0, optimal_balance_B - balance_B)
+
+@compile_kernel
+def _set_balances(pools, k, balance_A, balance_B, arb_balance_A, arb_balance_B):
+  pools[k, BALANCE_A] = balance_A
+  pools[k, BALANCE_B] = balance_B
+  pools[k, ARB_BALANCE_A] = arb_balance_A
+  pools[k, ARB_BALANCE_B] = arb_balance_B
+
+''' RetailAgentPool.maybe_execute_trade '''
+@compile_kernel
+def _retail_trade(pools, flags, k, price, conf_interval, accepted_price_range):
+  if random.random() < 0.5:
+    price_A_selling_A = 1 / (price + (1 - 2*random.random())*conf_interval)
+    sell_A_amount = RETAIL_MAX_SELL_A_AMOUNT * random.random() * random.random()
+    accepted_min_B_amount = sell_A_amount * price_A_selling_A * (1 - accepted_price_range * random.random())
+    balance_A, balance_B, arb_balance_A, arb_balance_B = _get_rebalanced_balances(pools, flags, k, price)
+    buy_B_amount = _get_swap_out_B(pools, flags, k, price, conf_interval, balance_A, balance_B, sell_A_amount)
+
+    if buy_B_amount > accepted_min_B_amount:
+      _set_balances(pools, k, balance_A + sell_A_amount, balance_B - buy_B_amount, arb_balance_A, arb_balance_B)
+  else:
+    price_B_selling_B = price + (1 - 2*random.random())*conf_interval
+    sell_B_amount = (RETAIL_MAX_SELL_A_AMOUNT / price) * random.random()
+    accept_min_A_amount = sell_B_amount * price_B_selling_B * (1 - accepted_price_range * random.random())
+    balance_A, balance_B, arb_balance_A, arb_balance_B = _get_rebalanced_balances(pools, flags, k, price)
+    buy_A_amount = _get_swap_out_A(pools, flags, k, price, conf_interval, balance_A, balance_B, sell_B_amount)
+
+    if buy_A_amount > accept_min_A_amount:
+      _set_balances(pools, k, balance_A - buy_A_amount, balance_B + sell_B_amount, arb_balance_A, arb_balance_B)
+
+''' ArbAgent.arbitrage_A '''
+@compile_kernel
+def _arbitrage_A(pools, flags, k, price, conf_interval, arb_mode, target_price_B_sell_B):
+  balance_A, balance_B, arb_balance_A, arb_balance_B = _get_rebalanced_balances(pools, flags, k, price)
+
+  if arb_mode == ARB_MODE_OPTIMAL:
+    sell_A_amount = _get_optimal_arb_sell_A(pools, flags, k, price, conf_interval, balance_A, balance_B, target_price_B_sell_B)
+    if sell_A_amount > 0:
+      buy_B_amount = _get_swap_out_B(pools, flags, k, price, conf_interval, balance_A, balance_B, sell_A_amount)
+      if buy_B_amount * target_price_B_sell_B > sell_A_amount:
+        _set_balances(pools, k, balance_A + sell_A_amount, balance_B - buy_B_amount, arb_balance_A, arb_balance_B)
+    return
+
+  ''' the search starts from the balance before the rebalance, as get_balance_A does '''
+  sell_A_amount = pools[k, BALANCE_A] * 0.1
+  buy_B_amount = _get_swap_out_B(pools, flags, k, price, conf_interval, balance_A, balance_B, sell_A_amount)
+  while sell_A_amount > 0.000001 and (buy_B_amount / sell_A_amount) * target_price_B_sell_B <= 1:
+    sell_A_amount /= 2
+    buy_B_amount = _get_swap_out_B(pools, flags, k, price, conf_interval, balance_A, balance_B, sell_A_amount)
+
+  if (buy_B_amount / sell_A_amount) * target_price_B_sell_B > 1:
+    _set_balances(pools, k, balance_A + sell_A_amount, balance_B - buy_B_amount, arb_balance_A, arb_balance_B)
+
+''' ArbAgent.arbitrage_B '''
+@compile_kernel
+def _arbitrage_B(pools, flags, k, price, conf_interval, arb_mode, target_price_A_sell_A):
+  balance_A, balance_B, arb_balance_A, arb_balance_B = _get_rebalanced_balances(pools, flags, k, price)
+
+  if arb_mode == ARB_MODE_OPTIMAL:
+    sell_B_amount = _get_optimal_arb_sell_B(pools, flags, k, price, conf_interval, balance_A, balance_B, target_price_A_sell_A)
+    if sell_B_amount > 0:
+      buy_A_amount = _get_swap_out_A(pools, flags, k, price, conf_interval, balance_A, balance_B, sell_B_amount)
+      if buy_A_amount * target_price_A_sell_A > sell_B_amount:
+        _set_balances(pools, k, balance_A - buy_A_amount, balance_B + sell_B_amount, arb_balance_A, arb_balance_B)
+    return
+
+  sell_B_amount = pools[k, BALANCE_B] * 0.1
+  buy_A_amount = _get_swap_out_A(pools, flags, k, price, conf_interval, balance_A, balance_B, sell_B_amount)
+  while sell_B_amount > 0.000000001 and (buy_A_amount / sell_B_amount) * target_price_A_sell_A <= 1:
+    sell_B_amount /= 2
+    buy_A_amount = _get_swap_out_A(pools, flags, k, price, conf_interval, balance_A, balance_B, sell_B_amount)
+
+  if (buy_A_amount / sell_B_amount) * target_price_A_sell_A > 1:
+    _set_balances(pools, k, balance_A - buy_A_amount, balance_B + sell_B_amount, arb_balance_A, arb_balance_B)
+
+''' ArbAgent.maybe_execute_trade '''
+@compile_kernel
+def _arb_trade(pools, flags, k, price, conf_interval, arb_mode):
+  target_price_A_sell_A = 1 / (price + (2*random.random() - 1)*conf_interval)
+  target_price_B_sell_B = price + (2*random.random() - 1)*conf_interval
+
+  balance_A, balance_B, _, _ = _get_rebalanced_balances(pools, flags, k, price)
+  implied_price_B_sell_B = _get_implied_price_B_for_A(pools, flags, k, price, conf_interval, balance_A, balance_B)
+  implied_price_A_sell_A = _get_implied_price_A_for_B(pools, flags, k, price, conf_interval, balance_A, balance_B)
+
+  if implied_price_A_sell_A * target_price_B_sell_B > 1:
+    _arbitrage_A(pools, flags, k, price, conf_interval, arb_mode, target_price_B_sell_B)
+
+  if implied_price_B_sell_B * target_price_A_sell_A > 1:
+    _arbitrage_B(pools, flags, k, price, conf_interval, arb_mode, target_price_A_sell_A)
+
+@compile_kernel
+def _get_tvl_ratio(pools, k, price):
+  total_A = pools[k, ARB_BALANCE_A] + pools[k, BALANCE_A]
+  total_B = pools[k, ARB_BALANCE_B] + pools[k, BALANCE_B]
+  return (total_A + total_B * price) / (pools[k, INITIAL_RESERVE_A] + pools[k, INITIAL_RESERVE_B] * price)
+
+'''
+the step loop, one step per column of tvl_ratios
+trader ids below num_retail_traders are retail traders, the others are arbitraguers
+'''
+@compile_kernel
+def _run_steps(
+  pools, flags, prices, conf_intervals, accepted_price_range, num_retail_traders, num_arb_traders,
+  trade_prob, arb_mode, seed, tvl_ratios):
+
+  random.seed(seed)
+  num_traders = num_retail_traders + num_arb_traders
+  traders = np.arange(num_traders)
+
+  for step in range(tvl_ratios.shape[1]):
+    price = prices[step]
+    conf_interval = conf_intervals[step]
+
+    ''' partial shuffle: the first selected_len traders are a uniform random draw without replacement '''
+    selected_len = int(random.random() * num_traders)
+    for j in range(selected_len):
+      swap_index = j + int(random.random() * (num_traders - j))
+      trader = traders[swap_index]
+      traders[swap_index] = traders[j]
+      traders[j] = trader
+
+    for k in range(pools.shape[0]):
+      for j in range(selected_len):
+        if random.random() < trade_prob:
+          if traders[j] < num_retail_traders:
+            _retail_trade(pools, flags, k, price, conf_interval, accepted_price_range[traders[j]])
+          else:
+            _arb_trade(pools, flags, k, price, conf_interval, arb_mode)
+
+      tvl_ratios[k, step] = _get_tvl_ratio(pools, k, price)
+
+''' (pool state row, pool flag row) of an amm '''
+def get_pool_state(amm: AMM):
+  state = np.zeros(NUM_POOL_COLUMNS)
+  flags = np.zeros(NUM_FLAG_COLUMNS, dtype=np.int64)
+
+  if isinstance(amm, DeltafiInternalArbAMM) or isinstance(amm, UniswapInternalArbAMM):
+    child_amm = amm.child_amm
+    state[ARB_BALANCE_A] = amm.arb_balance_A
+    state[ARB_BALANCE_B] = amm.arb_balance_B
+    state[INITIAL_RESERVE_A] = amm.target_balance_A
+    state[INITIAL_RESERVE_B] = amm.target_balance_B
+    state[ARB_REBALANCE_RATIO] = amm.arb_rebalance_ratio
+    flags[KIND] = KIND_DELTAFI_INTERNAL_ARB if isinstance(amm, DeltafiInternalArbAMM) else KIND_UNISWAP_INTERNAL_ARB
+  else:
+    child_amm = amm
+
+  state[BALANCE_A] = child_amm.balance_A
+  state[BALANCE_B] = child_amm.balance_B
+  state[FEE_RATE] = child_amm.fee_rate
+
+  if isinstance(child_amm, DeltafiAMM):
+    if child_amm.price_mode != "spot":
+      raise ValueError("fast mode does not support the price mode: " + child_amm.price_mode)
+    state[TARGET_RESERVE_A] = child_amm.target_reserve_A
+    state[TARGET_RESERVE_B] = child_amm.target_reserve_B
+    flags[PRICE_ADJUSTMENT] = child_amm.enable_price_adjustment
+    flags[CONF_INTERVAL] = child_amm.enable_conf_interval
+    if child_amm is amm:
+      state[INITIAL_RESERVE_A] = amm.target_reserve_A
+      state[INITIAL_RESERVE_B] = amm.target_reserve_B
+      flags[KIND] = KIND_DELTAFI
+  elif isinstance(child_amm, UniswapAMM):
+    if child_amm is amm:
+      state[INITIAL_RESERVE_A] = amm.initial_reserve_A
+      state[INITIAL_RESERVE_B] = amm.initial_reserve_B
+      flags[KIND] = KIND_UNISWAP
+  else:
+    raise ValueError("fast mode does not support the amm: " + amm.get_name())
+
+  return state, flags
+
+''' write the balances of a pool state row back to the amm '''
+def set_pool_state(amm: AMM, state):
+  if isinstance(amm, DeltafiInternalArbAMM) or isinstance(amm, UniswapInternalArbAMM):
+    amm.arb_balance_A = float(state[ARB_BALANCE_A])
+    amm.arb_balance_B = float(state[ARB_BALANCE_B])
+    amm = amm.child_amm
+  amm.balance_A = float(state[BALANCE_A])
+  amm.balance_B = float(state[BALANCE_B])
+
+'''
+run_swap_simulation in fast mode, returns the same tvl_ratio_change_list
+the amms end in their final state and the oracle at the same index as after the reference loop
+rng draws the retail population and, when seed is None, the seed of the loop: the random module (default),
+a random.Random or a RandomStreams of rng.py, whose "fast" stream gives the seed, so the run only depends on its seed,
+and whose "retail_population" stream draws the same population as the object based loop (see simulation._get_agents)
+'''
+def run_fast_swap_simulation(
+  num_retail_traders, num_arb_traders, trade_prob,
+  oracle: Oracle, amm_list: list[AMM], max_steps=None, arb_mode="search", seed=None, rng=random) -> list[list[float]]:
+
+  assert(not isinstance(oracle, StreamingOracle))
+  assert(arb_mode in ARB_MODES)
+  if max_steps is None:
+    max_steps = oracle.max_index
+  if isinstance(rng, RandomStreams):
+    if seed is None:
+      seed = rng.get_seed("fast")
+    rng = rng.get("retail_population")
+  elif seed is None:
+    seed = int(rng.random() * (2**31))
+
+  retail_traders = RetailAgentPool(oracle, num_retail_traders, rng)
+  accepted_price_range = np.array(retail_traders.accepted_price_range, dtype=np.float64)
+
+  pool_states = [get_pool_state(amm) for amm in amm_list]
+  pools = np.array([state for state, _ in pool_states], dtype=np.float64).reshape(len(amm_list), NUM_POOL_COLUMNS)
+  flags = np.array([flag for _, flag in pool_states], dtype=np.int64).reshape(len(amm_list), NUM_FLAG_COLUMNS)
+
+  ''' the reference loop stops after the step at max_index '''
+  start = oracle.index
+  num_steps = min(max_steps, oracle.max_index - start + 1)
+  prices = np.ascontiguousarray(oracle.price_history[start:start + num_steps], dtype=np.float64)
+  conf_intervals = np.ascontiguousarray(oracle.conf_intervals[start:start + num_steps], dtype=np.float64)
+  tvl_ratios = np.zeros((len(amm_list), num_steps))
+
+  ''' uncompiled, _run_steps seeds and draws from the random module itself, whose state is put back afterwards '''
+  random_state = None if HAS_NUMBA else random.getstate()
+  try:
+    _run_steps(
+      pools, flags, prices, conf_intervals, accepted_price_range, num_retail_traders, num_arb_traders,
+      trade_prob, ARB_MODES[arb_mode], seed, tvl_ratios)
+  finally:
+    if random_state is not None:
+      random.setstate(random_state)
+
+  for k in range(len(amm_list)):
+    set_pool_state(amm_list[k], pools[k])
+  oracle.set_index(min(start + num_steps, oracle.max_index))
+
+  return tvl_ratios.tolist()
@@ -5,12 +5,17 @@ from .uniswap_amm import UniswapAMM
 
 from lib.price_data import Oracle
 from .prototypes import AMM
+from .kernels import BACKENDS, deltafi_internal_arb_optimal_trade, uniswap_internal_arb_rebalance
 import math
 
 ''' parent class for uniswap/deltafi amm with internal arb '''
 class InternalArbAMM(AMM):
+  __slots__ = (
+    "arb_balance_A", "arb_balance_B", "child_amm", "arb_pool_ratio", "arb_rebalance_ratio",
+    "oracle", "target_balance_A", "target_balance_B", "_rebalance_cache_key", "_rebalance_cache_balances", "backend",
+  )
 
-  def __init__(self, initial_balance_A, initial_balance_B, oracle: Oracle, arb_pool_ratio=0.1, arb_rebalance_ratio=1) -> None:
+  def __init__(self, initial_balance_A, initial_balance_B, oracle: Oracle, arb_pool_ratio=0.1, arb_rebalance_ratio=1, backend="python") -> None:
     self.arb_balance_A = initial_balance_A * arb_pool_ratio
     self.arb_balance_B = initial_balance_B * arb_pool_ratio
     self.child_amm = AMM()
@@ -27,29 +32,72 @@ class InternalArbAMM(AMM):
     self.target_balance_A = initial_balance_A
     self.target_balance_B = initial_balance_B
 
+    ''' backend of the rebalance and of the child amm, see kernels.py '''
+    assert(backend in BACKENDS)
+    self.backend = backend
+
+    self.invalidate_rebalance_cache()
+    self.invalidate_step_cache()
+    self.set_recorder(None)
+
+  ''' the swaps are executed by the child amm, which records them under the id of this amm '''
+  def set_recorder(self, recorder, recorder_id=0):
+    super().set_recorder(recorder, recorder_id)
+    self.child_amm.set_recorder(recorder, recorder_id)
+
   def get_balance_A(self):
     return self.child_amm.get_balance_A()
 
   def get_balance_B(self):
     return self.child_amm.get_balance_B()
 
+  # (oracle price, target A to B ratio, initial tvl at the oracle price)
+  def _compute_step_cache(self):
+    price = self.oracle.get_price()
+    return price, self.target_balance_A / self.target_balance_B, self.target_balance_A + self.target_balance_B * price
+
   @abstractclassmethod
   def rebalance(self):
     raise NotImplementedError
 
+  def _get_balances(self):
+    return self.child_amm.balance_A, self.child_amm.balance_B, self.arb_balance_A, self.arb_balance_B
+
+  def _set_balances(self, balances):
+    self.child_amm.balance_A, self.child_amm.balance_B, self.arb_balance_A, self.arb_balance_B = balances
+
+  ''' 
+  balances after rebalance(), which only depend on the oracle step and the balances before it
+  they are computed once and reused by every quote until a swap or an oracle step changes the key
+  '''
+  def _get_rebalanced_balances(self):
+    key = (self.oracle.index, self.child_amm.balance_A, self.child_amm.balance_B, self.arb_balance_A, self.arb_balance_B)
+    if key != self._rebalance_cache_key:
+      balances = self._get_balances()
+      self.rebalance()
+      self._rebalance_cache_balances = self._get_balances()
+      self._rebalance_cache_key = key
+      self._set_balances(balances)
+
+    return self._rebalance_cache_balances
+
+  ''' needed only when the rebalance parameters (e.g. arb_rebalance_ratio or fee rate) are changed in place '''
+  def invalidate_rebalance_cache(self):
+    self._rebalance_cache_key = None
+    self._rebalance_cache_balances = None
+
+  ''' the rebalance cache and the step caches of this amm and of the child amm '''
+  def invalidate_caches(self):
+    self.invalidate_rebalance_cache()
+    self.invalidate_step_cache()
+    self.child_amm.invalidate_caches()
+
   def _simulate_rebalance_with_func(self, func, *args):
-    balance_A = self.child_amm.balance_A
-    balance_B = self.child_amm.balance_B 
-    arb_balance_A = self.arb_balance_A
-    arb_balance_B = self.arb_balance_B
+    balances = self._get_balances()
 
-    self.rebalance()
+    self._set_balances(self._get_rebalanced_balances())
     result = func(*args)
-
-    self.child_amm.balance_A = balance_A
-    self.child_amm.balance_B = balance_B
-    self.arb_balance_A = arb_balance_A
-    self.arb_balance_B = arb_balance_B
+    self._set_balances(balances)
 
     return result
 
@@ -69,29 +117,66 @@ class InternalArbAMM(AMM):
       return self._simulate_rebalance_with_func(self.child_amm.get_swap_out_B, token_A_input)
     return self.child_amm.get_swap_out_B(token_A_input)
   
+  def get_optimal_arb_sell_A(self, target_price_B_sell_B):
+    return self._simulate_rebalance_with_func(self.child_amm.get_optimal_arb_sell_A, target_price_B_sell_B)
+
+  def get_optimal_arb_sell_B(self, target_price_A_sell_A):
+    return self._simulate_rebalance_with_func(self.child_amm.get_optimal_arb_sell_B, target_price_A_sell_A)
+
+  ''' the quote ladders and inverse quotes of the child amm after the rebalance '''
+  def get_swap_out_A_ladder(self, token_B_inputs):
+    return self._simulate_rebalance_with_func(self.child_amm.get_swap_out_A_ladder, token_B_inputs)
+
+  def get_swap_out_B_ladder(self, token_A_inputs):
+    return self._simulate_rebalance_with_func(self.child_amm.get_swap_out_B_ladder, token_A_inputs)
+
+  def get_swap_in_B(self, token_A_outputs):
+    return self._simulate_rebalance_with_func(self.child_amm.get_swap_in_B, token_A_outputs)
+
+  def get_swap_in_A(self, token_B_outputs):
+    return self._simulate_rebalance_with_func(self.child_amm.get_swap_in_A, token_B_outputs)
+
+  def get_swap_in_A_for_price(self, implied_prices_A_for_B):
+    return self._simulate_rebalance_with_func(self.child_amm.get_swap_in_A_for_price, implied_prices_A_for_B)
+
+  def get_swap_in_B_for_price(self, implied_prices_B_for_A):
+    return self._simulate_rebalance_with_func(self.child_amm.get_swap_in_B_for_price, implied_prices_B_for_A)
+
   def swap_A_for_B(self, token_A_input):
-    self.rebalance()
+    self._set_balances(self._get_rebalanced_balances())
     return self.child_amm.swap_A_for_B(token_A_input)
 
   def swap_B_for_A(self, token_B_input):
-    self.rebalance()
+    self._set_balances(self._get_rebalanced_balances())
     return self.child_amm.swap_B_for_A(token_B_input)
 
+  ''' the arb pool balances and the state of the child amm '''
+  def get_state(self):
+    return self.arb_balance_A, self.arb_balance_B, self.target_balance_A, self.target_balance_B, self.child_amm.get_state()
+
+  def set_state(self, state):
+    self.arb_balance_A, self.arb_balance_B, self.target_balance_A, self.target_balance_B, child_state = state
+    self.child_amm.set_state(child_state)
+    self.invalidate_rebalance_cache()
+    self.invalidate_step_cache()
+
   def get_tvl_ratio_to_initial_state(self):
     total_A = self.arb_balance_A + self.child_amm.balance_A 
     total_B = self.arb_balance_B + self.child_amm.balance_B 
 
-    current_tvl = total_A + total_B * self.oracle.get_price()
-    initial_tvl = self.target_balance_A + self.target_balance_B * self.oracle.get_price()
+    price, _, initial_tvl = self.get_step_cache()
+    current_tvl = total_A + total_B * price
 
     return current_tvl / initial_tvl
 
 class DeltafiInternalArbAMM(InternalArbAMM):
-  def __init__(self, initial_balance_A, initial_balance_B, oracle: Oracle, arb_pool_ratio=0.1, arb_rebalance_ratio=1, fee_rate=0, enable_external_exchange=False):
-    super().__init__(initial_balance_A, initial_balance_B, oracle, arb_pool_ratio, arb_rebalance_ratio)
+  __slots__ = ("enable_external_exchange",)
+
+  def __init__(self, initial_balance_A, initial_balance_B, oracle: Oracle, arb_pool_ratio=0.1, arb_rebalance_ratio=1, fee_rate=0, enable_external_exchange=False, backend="python"):
+    super().__init__(initial_balance_A, initial_balance_B, oracle, arb_pool_ratio, arb_rebalance_ratio, backend)
     self.child_amm: DeltafiAMM = DeltafiAMM(
       self.target_balance_A - self.arb_balance_A, self.target_balance_B - self.arb_balance_B, 
-      oracle=oracle, fee_rate=fee_rate, enable_external_exchange=False, enable_price_adjustment=False
+      oracle=oracle, fee_rate=fee_rate, enable_external_exchange=False, enable_price_adjustment=False, backend=backend
     )
 
     self.enable_external_exchange = enable_external_exchange
@@ -107,9 +192,9 @@ class DeltafiInternalArbAMM(InternalArbAMM):
     return sell_A_amount, sell_B_amount
 
   def rebalance(self):
-    oracle_price = self.oracle.get_price()
-    target_ratio_A_to_B = self.target_balance_A / self.target_balance_B
-    delta_A, delta_B = self.get_optimal_trade(target_ratio_A_to_B, self.child_amm.get_balance_A(), self.child_amm.get_balance_B(), oracle_price)
+    oracle_price, target_ratio_A_to_B, _ = self.get_step_cache()
+    get_optimal_trade = deltafi_internal_arb_optimal_trade if self.backend == "numba" else self.get_optimal_trade
+    delta_A, delta_B = get_optimal_trade(target_ratio_A_to_B, self.child_amm.get_balance_A(), self.child_amm.get_balance_B(), oracle_price)
 
     if delta_A > 0:
       arb_sell_A = max(0, min(delta_A*self.arb_rebalance_ratio, self.arb_balance_A))
@@ -131,19 +216,26 @@ class DeltafiInternalArbAMM(InternalArbAMM):
 
 
 class UniswapInternalArbAMM(InternalArbAMM):
-  def __init__(self, initial_balance_A, initial_balance_B, oracle: Oracle, arb_pool_ratio=0.1, arb_rebalance_ratio=1, fee_rate=0, enable_external_exchange=False):
-    super().__init__(initial_balance_A, initial_balance_B, oracle, arb_pool_ratio, arb_rebalance_ratio)
+  __slots__ = ("enable_external_exchange",)
+
+  def __init__(self, initial_balance_A, initial_balance_B, oracle: Oracle, arb_pool_ratio=0.1, arb_rebalance_ratio=1, fee_rate=0, enable_external_exchange=False, backend="python"):
+    super().__init__(initial_balance_A, initial_balance_B, oracle, arb_pool_ratio, arb_rebalance_ratio, backend)
     self.enable_external_exchange = enable_external_exchange
     self.child_amm: UniswapAMM = UniswapAMM(
       initial_balance_A - self.arb_balance_A, initial_balance_B - self.arb_balance_B, 
-      oracle=oracle, fee_rate=fee_rate
+      oracle=oracle, fee_rate=fee_rate, backend=backend
     )
   
   def get_name(self):
     return "uniswap + internal pool"
 
   def rebalance(self):
-    oracle_price = self.oracle.get_price()
+    oracle_price, _, _ = self.get_step_cache()
+    if self.backend == "numba":
+      self.child_amm.balance_A, self.child_amm.balance_B, self.arb_balance_A, self.arb_balance_B = uniswap_internal_arb_rebalance(
+        self.child_amm.balance_A, self.child_amm.balance_B, self.arb_balance_A, self.arb_balance_B, oracle_price)
+      return
+
     current_k = self.child_amm.balance_A * self.child_amm.balance_B
     target_B = math.sqrt(current_k / oracle_price)
     target_A = target_B * oracle_price
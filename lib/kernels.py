@@ -0,0 +1,111 @@
+import math
+import numpy as np
+
+try:
+  from numba import njit
+  HAS_NUMBA = True
+except ImportError:
+  HAS_NUMBA = False
+
+'''
+swap math of the amms as plain functions of floats, compiled in nopython mode when numba is installed
+without numba they run as regular python functions, so backend="numba" always works
+
+the amm classes keep their own implementation as the reference, an amm built with backend="numba" calls these instead
+the branch free kernels (deltafi_swap_out_regular, uniswap_swap_out) also accept numpy arrays
+'''
+
+BACKENDS = ("python", "numba")
+
+def compile_kernel(func):
+  if HAS_NUMBA:
+    return njit(cache=True)(func)
+  return func
+
+'''
+deltafi curve without price adjustment, selling token_input of the "in" token for the "out" token
+exp is the exponent of the step cache (exp_buy_A when selling B, exp_buy_B when selling A)
+'''
+@compile_kernel
+def deltafi_swap_out_regular(balance_in, balance_out, exp, fee_rate, token_input):
+  result = balance_out * (1 - (balance_in / (token_input + balance_in))**exp)
+  return result * (1 - fee_rate)
+
+'''
+deltafi curve with price adjustment: flat at price (amount of out token for 1 in token) until
+the pool is back at its target ratio, then the regular curve from there
+'''
+@compile_kernel
+def deltafi_swap_out_adjusted(balance_in, balance_out, target_reserve_in, target_reserve_out, price, exp, fee_rate, token_input):
+  current_value = balance_out + balance_in * price
+  initial_value = target_reserve_out + target_reserve_in * price
+
+  target_out = target_reserve_out * (current_value / initial_value)
+  target_in = target_reserve_in * (current_value / initial_value)
+
+  sell_in_to_target = target_in - balance_in
+
+  if token_input < sell_in_to_target:
+    token_output = token_input * price
+    assert(balance_out - token_output >= target_out)
+    return token_output * (1 - fee_rate)
+
+  if sell_in_to_target > 0:
+    buy_out_to_target = sell_in_to_target * price
+    buy_out_beyond_target = (balance_out - buy_out_to_target) * (1 - ((balance_in + sell_in_to_target) / (token_input + balance_in))**exp)
+    return (buy_out_to_target + buy_out_beyond_target) * (1 - fee_rate)
+
+  return deltafi_swap_out_regular(balance_in, balance_out, exp, fee_rate, token_input)
+
+@compile_kernel
+def uniswap_swap_out(balance_in, balance_out, fee_rate, token_input):
+  k = balance_out * balance_in
+  token_output = balance_out - k / (balance_in + token_input)
+  return token_output * (1 - fee_rate)
+
+''' the (sell_A_amount, sell_B_amount) of DeltafiInternalArbAMM.get_optimal_trade '''
+@compile_kernel
+def deltafi_internal_arb_optimal_trade(target_ratio_A_to_B, balance_A, balance_B, oracle_price):
+  P = 1 / oracle_price
+  sell_A_amount = (((balance_B * target_ratio_A_to_B) * balance_A**(P*target_ratio_A_to_B))**(1/((P*target_ratio_A_to_B) + 1))) - balance_A
+  sell_B_amount = (((balance_A / target_ratio_A_to_B) * balance_B**(oracle_price/target_ratio_A_to_B))**(1/((oracle_price/target_ratio_A_to_B) + 1))) - balance_B
+  return sell_A_amount, sell_B_amount
+
+'''
+UniswapInternalArbAMM.rebalance: the arb pool trades the child pool back to the oracle price along its curve
+returns the child balances and the arb balances after the rebalance
+'''
+@compile_kernel
+def uniswap_internal_arb_rebalance(balance_A, balance_B, arb_balance_A, arb_balance_B, oracle_price):
+  current_k = balance_A * balance_B
+  target_B = math.sqrt(current_k / oracle_price)
+  target_A = target_B * oracle_price
+
+  delta_A = target_A - balance_A
+  delta_B = target_B - balance_B
+
+  if delta_A > 0:
+    arb_sell_A = max(0.0, min(delta_A, arb_balance_A))
+    old_balance_B = balance_B
+    balance_A += arb_sell_A
+    balance_B = current_k / balance_A
+    arb_balance_A -= arb_sell_A
+    arb_balance_B += old_balance_B - balance_B
+  elif delta_B > 0:
+    arb_sell_B = max(0.0, min(delta_B, arb_balance_B))
+    old_balance_A = balance_A
+    balance_B += arb_sell_B
+    balance_A = current_k / balance_B
+    arb_balance_A += old_balance_A - balance_A
+    arb_balance_B -= arb_sell_B
+
+  return balance_A, balance_B, arb_balance_A, arb_balance_B
+
+''' exponential moving average of values along the first axis with smoothing factor alpha, starting at values[0] '''
+@compile_kernel
+def ema_series(values, alpha):
+  result = np.empty_like(values)
+  result[0] = values[0]
+  for i in range(1, len(values)):
+    result[i] = alpha * values[i] + (1 - alpha) * result[i - 1]
+  return result
@@ -1,49 +1,191 @@
 import random
+from abc import abstractclassmethod
+import numpy as np
 from .prototypes import AMM, LPBot
 from .price_data import Oracle
+from .recorder import EVENT_LP_DEPOSIT, EVENT_LP_WITHDRAW
 
-class UniswapLPBot(LPBot):
+'''
+deposit records of an lp bot, stored as parallel float64 arrays (one per column) plus the deposit cycle
+a record is due for withdrawal every min_holding_cycles after its deposit, so the records are bucketed
+by deposit_cycle % min_holding_cycles and a cycle only touches the bucket of the records due at it
+'''
+class DepositBook():
+  def __init__(self, capacity, min_holding_cycles, column_names: list[str]) -> None:
+    self.min_holding_cycles = min_holding_cycles
+    self.columns = {name: np.zeros(capacity) for name in column_names}
+    self.deposit_cycle = np.zeros(capacity, dtype=np.int64)
+    ''' slots of removed records are reused, the last freed one first '''
+    self.free_slots = list(range(capacity - 1, -1, -1))
+    self.capacity = capacity
+    self.due_slots: dict[int, list[int]] = {}
+
+  def __len__(self):
+    return self.capacity - len(self.free_slots)
+
+  def add(self, cycle, values: dict):
+    slot = self.free_slots.pop()
+    for name, value in values.items():
+      self.columns[name][slot] = value
+    self.deposit_cycle[slot] = cycle
+    self.due_slots.setdefault(cycle % self.min_holding_cycles, []).append(slot)
+    return slot
+
+  ''' slots of the records deposited a multiple of min_holding_cycles before cycle '''
+  def get_due_slots(self, cycle) -> list[int]:
+    return self.due_slots.get(cycle % self.min_holding_cycles, [])
+
+  ''' remove the records in slots, which must all be due at cycle '''
+  def remove(self, cycle, slots: list[int]):
+    removed_slots = set(slots)
+    key = cycle % self.min_holding_cycles
+    self.due_slots[key] = [slot for slot in self.due_slots[key] if slot not in removed_slots]
+    if len(self.due_slots[key]) == 0:
+      del self.due_slots[key]
+    self.free_slots.extend(slots)
+
+  ''' the records and the slot bookkeeping, see SimulationState in simulation.py '''
+  def get_state(self):
+    return self.columns, self.deposit_cycle, self.free_slots, self.due_slots
+
+  def set_state(self, state):
+    columns, deposit_cycle, free_slots, due_slots = state
+    self.columns = {name: np.array(column) for name, column in columns.items()}
+    self.deposit_cycle = np.array(deposit_cycle)
+    self.free_slots = list(free_slots)
+    self.due_slots = {key: list(slots) for key, slots in due_slots.items()}
+
+''' parent class for the lp bots keeping their deposits in a DepositBook '''
+class DepositBookLPBot(LPBot):
   def __init__(
-    self, amm: AMM, oracle: Oracle, 
-    max_deposit_record=1, min_holding_cycles=10000, deposit_prob=1, withdraw_prob=0.05
+    self, amm: AMM, oracle: Oracle, column_names: list[str],
+    max_deposit_record=1000, min_holding_cycles=10000, deposit_prob=1, withdraw_prob=0.05, rng=random
   ) -> None:
       super().__init__(amm, oracle, max_deposit_record, min_holding_cycles, deposit_prob, withdraw_prob)
-      # (share, deposit_A_amount, deposit_B_amount, deposit_cycle)
-      self.deposit_record: list[tuple([float, float, float, int])] = []
+      self.deposit_book = DepositBook(max_deposit_record, min_holding_cycles, column_names)
+      ''' the random module (default), a random.Random or a BufferedRandom stream of rng.py '''
+      self.rng = rng
+
+  ''' withdraw the records in slots, due at cycle, with one batched withdraw '''
+  @abstractclassmethod
+  def _withdraw(self, cycle, slots: list[int]):
+    raise NotImplementedError
 
-  def _remove_record_idx(self, idx):
-    assert(idx < len(self.deposit_record))
-    self.deposit_record[idx] = self.deposit_record[-1]
-    self.deposit_record.pop()
+  ''' deposit deposit_B_amount of B (and the matching A) and add the record to the deposit book '''
+  @abstractclassmethod
+  def _deposit(self, cycle, deposit_B_amount):
+    raise NotImplementedError
+
+  ''' gain of the withdrawn records at the oracle price, returns (lp_returns, holding_cycles) '''
+  def _get_returns(self, cycle, slots: list[int], withdraw_A_amounts, withdraw_B_amounts):
+    columns = self.deposit_book.columns
+    price = self.oracle.get_price()
+    withdraw_tvl = withdraw_A_amounts + withdraw_B_amounts * price
+    deposit_tvl = columns["deposit_A_amount"][slots] + columns["deposit_B_amount"][slots] * price
+    lp_returns = (withdraw_tvl / deposit_tvl) - 1
+    holding_cycles = cycle - self.deposit_book.deposit_cycle[slots]
+    self.result_list.extend((lp_returns / holding_cycles).tolist())
+    return lp_returns, holding_cycles
 
   def update_record(self, cycle):
-    record_removal_idx = []
-    for i in range(len(self.deposit_record)):
-      share, deposit_A_amount, deposit_B_amount, deposit_cycle = self.deposit_record[i]
-      if (cycle - deposit_cycle)%self.min_holding_cycles == 0 and random.random() < self.withdraw_prob:
-        withdraw_A_amount, withdraw_B_amount = self.amm.lp_withdraw(share)
-        withdraw_tvl = withdraw_A_amount + withdraw_B_amount * self.oracle.get_price()
-        deposit_tvl = deposit_A_amount + deposit_B_amount * self.oracle.get_price()
-
-        if withdraw_tvl > deposit_tvl:
-          print(deposit_A_amount, deposit_B_amount)
-          print(withdraw_A_amount, withdraw_B_amount)
-          print("")
-        self.result_list.append(((withdraw_tvl / deposit_tvl) - 1) / (cycle - deposit_cycle))
-        record_removal_idx.append(i)
-    
-    record_removal_idx.reverse()
-    for i in record_removal_idx:
-      self._remove_record_idx(i)
-    
-    if len(self.deposit_record) >= self.max_deposit_record or random.random() > self.deposit_prob:
-      return
-    
-    deposit_B_amount = self.max_deposit_B_amount * random.random()
-    share, deposit_A_amount = self.amm.lp_deposit(deposit_B_amount)
+    self.withdraw_due(cycle)
+    self.maybe_deposit(cycle)
+
+  def withdraw_due(self, cycle):
+    due_slots = self.deposit_book.get_due_slots(cycle)
+    rng = self.rng
+    withdraw_slots = [slot for slot in due_slots if rng.random() < self.withdraw_prob]
+    if len(withdraw_slots) > 0:
+      self._withdraw(cycle, withdraw_slots)
+      self.deposit_book.remove(cycle, withdraw_slots)
+    return len(withdraw_slots), len(due_slots) - len(withdraw_slots)
+
+  def maybe_deposit(self, cycle):
+    if self.is_full() or self.rng.random() > self.deposit_prob:
+      return False
 
-    self.deposit_record.append(tuple([share, deposit_A_amount, deposit_B_amount, cycle]))
+    self._deposit(cycle, self.max_deposit_B_amount * self.rng.random())
+    return True
+
+  def is_full(self):
+    return len(self.deposit_book) >= self.max_deposit_record
+
+  def get_due_cycles(self, first_cycle):
+    return sorted(first_cycle + (key - first_cycle) % self.min_holding_cycles for key in self.deposit_book.due_slots)
 
   def get_result(self):
     return self.result_list
 
+  ''' the deposit book and the results so far, the rng is part of the state of the simulation '''
+  def get_state(self):
+    return self.deposit_book.get_state(), self.result_list
+
+  def set_state(self, state):
+    deposit_book_state, result_list = state
+    self.deposit_book.set_state(deposit_book_state)
+    self.result_list = list(result_list)
+
+class UniswapLPBot(DepositBookLPBot):
+  def __init__(
+    self, amm: AMM, oracle: Oracle,
+    max_deposit_record=1, min_holding_cycles=10000, deposit_prob=1, withdraw_prob=0.05, rng=random
+  ) -> None:
+      super().__init__(
+        amm, oracle, ["share", "deposit_A_amount", "deposit_B_amount"],
+        max_deposit_record, min_holding_cycles, deposit_prob, withdraw_prob, rng)
+
+  def _withdraw(self, cycle, slots: list[int]):
+    shares = self.deposit_book.columns["share"][slots]
+    withdraw_A_amounts, withdraw_B_amounts = self.amm.lp_withdraw_batch(shares)
+    lp_returns, holding_cycles = self._get_returns(cycle, slots, withdraw_A_amounts, withdraw_B_amounts)
+
+    ''' a withdrawal worth more than the deposit shows up as a positive lp_return in the event log '''
+    if self.amm.recorder is not None:
+      for i in range(len(slots)):
+        self.amm.recorder.record(
+          EVENT_LP_WITHDRAW, self.amm.recorder_id, -withdraw_A_amounts[i], -withdraw_B_amounts[i], self.oracle.get_price(),
+          self.amm.get_balance_A(), self.amm.get_balance_B(), share_A=-shares[i], share_B=0,
+          lp_return=lp_returns[i], holding_cycles=holding_cycles[i])
+
+  def _deposit(self, cycle, deposit_B_amount):
+    share, deposit_A_amount = self.amm.lp_deposit(deposit_B_amount)
+    if self.amm.recorder is not None:
+      self.amm.recorder.record(
+        EVENT_LP_DEPOSIT, self.amm.recorder_id, deposit_A_amount, deposit_B_amount, self.oracle.get_price(),
+        self.amm.get_balance_A(), self.amm.get_balance_B(), share_A=share, share_B=0)
+
+    self.deposit_book.add(cycle, {"share": share, "deposit_A_amount": deposit_A_amount, "deposit_B_amount": deposit_B_amount})
+
+''' lp bot of the deltafi amm, every deposit gets both a share A and a share B '''
+class DeltafiAMMLP(DepositBookLPBot):
+  def __init__(
+    self, amm: AMM, oracle: Oracle,
+    max_deposit_record=1000, min_holding_cycles=10000, deposit_prob=1, withdraw_prob=0.05, rng=random
+  ) -> None:
+      super().__init__(
+        amm, oracle, ["share_A", "share_B", "deposit_A_amount", "deposit_B_amount"],
+        max_deposit_record, min_holding_cycles, deposit_prob, withdraw_prob, rng)
+
+  def _withdraw(self, cycle, slots: list[int]):
+    shares_A = self.deposit_book.columns["share_A"][slots]
+    shares_B = self.deposit_book.columns["share_B"][slots]
+    withdraw_A_amounts, withdraw_B_amounts = self.amm.lp_withdraw_batch(shares_A, shares_B)
+    lp_returns, holding_cycles = self._get_returns(cycle, slots, withdraw_A_amounts, withdraw_B_amounts)
+
+    if self.amm.recorder is not None:
+      for i in range(len(slots)):
+        self.amm.recorder.record(
+          EVENT_LP_WITHDRAW, self.amm.recorder_id, -withdraw_A_amounts[i], -withdraw_B_amounts[i], self.oracle.get_price(),
+          self.amm.get_balance_A(), self.amm.get_balance_B(), share_A=-shares_A[i], share_B=-shares_B[i],
+          lp_return=lp_returns[i], holding_cycles=holding_cycles[i])
+
+  def _deposit(self, cycle, deposit_B_amount):
+    share_A, share_B, deposit_A_amount = self.amm.lp_deposit(deposit_B_amount)
+    if self.amm.recorder is not None:
+      self.amm.recorder.record(
+        EVENT_LP_DEPOSIT, self.amm.recorder_id, deposit_A_amount, deposit_B_amount, self.oracle.get_price(),
+        self.amm.get_balance_A(), self.amm.get_balance_B(), share_A=share_A, share_B=share_B)
+
+    self.deposit_book.add(cycle, {
+      "share_A": share_A, "share_B": share_B, "deposit_A_amount": deposit_A_amount, "deposit_B_amount": deposit_B_amount,
+    })
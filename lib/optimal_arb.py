@@ -0,0 +1,95 @@
+import numpy as np
+
+'''
+profit maximising trade size for an arbitraguer that sells token X at the amm and
+sells the bought token Y elsewhere at target_price (amount of X for 1 Y)
+
+the profit target_price * get_swap_out(x) - x is concave for all our curves,
+so the optimum is the root of its derivative target_price * get_swap_out'(x) - 1
+'''
+
+''' step used for the numerical derivative of the swap out curve, relative to the trade size '''
+DERIVATIVE_STEP = 1e-6
+MAX_ITERATIONS = 100
+
+def _get_marginal_profit(get_swap_out, target_price, x, scale):
+  h = DERIVATIVE_STEP * max(x, scale)
+  low = max(x - h, 0)
+  return target_price * (get_swap_out(x + h) - get_swap_out(low)) / (x + h - low) - 1
+
+'''
+bracketed secant solve of the optimal trade size for any swap out curve, on the finite difference marginal profit
+upper_bound is only the initial guess of the bracket, it is doubled until the marginal profit turns negative,
+an empty pool (upper_bound <= 0) has no trade
+'''
+def solve_optimal_trade(get_swap_out, target_price, upper_bound, tolerance=1e-9) -> float:
+  if upper_bound <= 0:
+    return 0
+  scale = upper_bound * DERIVATIVE_STEP
+  if _get_marginal_profit(get_swap_out, target_price, 0, scale) <= 0:
+    return 0
+
+  low, high = 0, upper_bound
+  for _ in range(MAX_ITERATIONS):
+    if _get_marginal_profit(get_swap_out, target_price, high, scale) < 0:
+      break
+    low, high = high, high * 2
+
+  x = (low + high) / 2
+  g = _get_marginal_profit(get_swap_out, target_price, x, scale)
+  previous_x, previous_g = low, _get_marginal_profit(get_swap_out, target_price, low, scale)
+  previous_width = high - low
+  for _ in range(MAX_ITERATIONS):
+    if g > 0:
+      low = x
+    else:
+      high = x
+    if high - low <= tolerance * high:
+      break
+
+    '''
+    secant step through the last two iterates,
+    bisect when it leaves the bracket or the bracket stops shrinking fast enough
+    '''
+    next_x = (low + high) / 2
+    shrinking = high - low <= previous_width / 2
+    previous_width = high - low
+    if shrinking and g != previous_g:
+      secant_x = x - g * (x - previous_x) / (g - previous_g)
+      if low < secant_x < high:
+        next_x = secant_x
+
+    previous_x, previous_g = x, g
+    x = next_x
+    g = _get_marginal_profit(get_swap_out, target_price, x, scale)
+
+  return x
+
+'''
+inverse of a swap out curve: input needed for every output of token_outputs, bisected over the whole array at once
+get_swap_out_ladder is the swap out curve over an array of inputs, upper_bound the initial guess of the bracket,
+doubled until the curve pays the output, an output the curve never pays (e.g. the whole pool balance) gets inf
+'''
+def solve_swap_in(get_swap_out_ladder, token_outputs, upper_bound, tolerance=1e-9) -> np.ndarray:
+  token_outputs = np.asarray(token_outputs, dtype=float)
+  if upper_bound <= 0:
+    return np.where(token_outputs <= 0, 0.0, np.inf)
+  low = np.zeros_like(token_outputs)
+  high = np.full_like(token_outputs, upper_bound)
+  for _ in range(MAX_ITERATIONS):
+    short = get_swap_out_ladder(high) < token_outputs
+    if not short.any():
+      break
+    low = np.where(short, high, low)
+    high = np.where(short, high * 2, high)
+  reachable = ~short
+
+  for _ in range(MAX_ITERATIONS):
+    x = (low + high) / 2
+    paid = get_swap_out_ladder(x) >= token_outputs
+    low = np.where(paid, low, x)
+    high = np.where(paid, x, high)
+    if np.all(high - low <= tolerance * high):
+      break
+
+  return np.where(reachable, high, np.inf)
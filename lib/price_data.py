@@ -1,132 +1,529 @@
+import copy
 import pandas as pd
+import numpy as np
 import json
-from os.path import exists
-import ast
-import csv
-import random
+from .series_cache import get_cache_dir, has_columns, save_columns, load_columns, ColumnWriter
+from .kernels import ema_series
 
-# this simulation is only about ETH-USDC
+PYTH_DATA_FILE = "../data/ETH_prices.csv"
+BINANCE_TRADES_FILE = "../data/ETH_USDC-trades.json"
+
+# the raw dumps are read in chunks of this many rows / bytes to keep the memory flat
+PYTH_CHUNK_ROWS = 1000000
+BINANCE_CHUNK_BYTES = 64 * 1024 * 1024
+
+# this oracle is about ETH-USDC, see MultiAssetOracle for several assets
 # the price in this oracle always refers to number of USDC to buy 1 ETH
+# price_history and conf_intervals can be lists or (memory-mapped) numpy arrays
+# twap_history is an optional twap published along the prices (e.g. the pyth twap), see get_twap
+#
+# get_twap, get_ema and get_volatility read a series computed over the whole history on the first query
+# of a window (from prefix sums for the rolling windows, in one pass for an ema), so a query is an array read
 class Oracle():
-  def __init__(self, price_history, conf_intervals) -> None:
+  def __init__(self, price_history, conf_intervals, twap_history=None) -> None:
     assert(len(conf_intervals) == len(price_history))
-    
+    assert(twap_history is None or len(twap_history) == len(price_history))
+
     self.price_history = price_history
     self.conf_intervals = conf_intervals
+    self.twap_history = twap_history
     self.max_index = len(price_history) - 1
-    self.index = 0
-  
+    self._window_series = {}
+    self.set_index(0)
+
+  def set_index(self, index):
+    self.index = index
+    # current values are kept as python floats, numpy scalars are slow in the amm math
+    self.price = float(self.price_history[index])
+    self.conf_interval = float(self.conf_intervals[index])
+
   def step_foward(self):
     if self.index >= self.max_index:
         return False
-    self.index += 1
+    self.set_index(self.index + 1)
     return True
 
+  # independent oracle at the same step sharing the price data, see SimulationState.fork
+  def fork(self):
+    return copy.copy(self)
+
+  # scale the prices and conf intervals (and the published twap) from index start on by factor, e.g. a crash of the price
+  # (one factor per path or asset for the batch oracles), start defaults to the current step
+  # the arrays are copied before the write, so the forks sharing them keep their prices
+  # the amms cache the prices of the current step: they need invalidate_caches(), see SimulationState.apply_price_shock
+  def apply_price_shock(self, factor, start=None):
+    if start is None:
+      start = self.index
+    self.price_history = np.array(self.price_history, dtype=np.float64)
+    self.price_history[start:] *= factor
+    self.conf_intervals = np.array(self.conf_intervals, dtype=np.float64)
+    self.conf_intervals[start:] *= factor
+    if self.twap_history is not None:
+      self.twap_history = np.array(self.twap_history, dtype=np.float64)
+      self.twap_history[start:] *= factor
+    self._window_series = {}
+    self.set_index(self.index)
+
   def get_price(self):
-    return self.price_history[self.index]
-  
+    return self.price
+
   def get_conf_interval(self):
-    return self.conf_intervals[self.index]
+    return self.conf_interval
+
+  # series of ("twap", window), ("ema", span) or ("volatility", window) over the whole price history
+  def _get_window_series(self, key):
+    if key not in self._window_series:
+      self._window_series[key] = get_window_series(np.asarray(self.price_history, dtype=np.float64), key[0], key[1])
+    return self._window_series[key]
+
+  def _to_value(self, value):
+    return float(value)
 
+  # mean price of the last window steps up to the current one (fewer at the start of the history)
+  # window=None returns the published twap_history
+  def get_twap(self, window=None):
+    if window is None:
+      assert(self.twap_history is not None)
+      return self._to_value(self.twap_history[self.index])
+    return self._to_value(self._get_window_series(("twap", window))[self.index])
+
+  # ema of the prices up to the current step, with smoothing factor 2 / (span + 1)
+  def get_ema(self, span):
+    return self._to_value(self._get_window_series(("ema", span))[self.index])
+
+  # standard deviation of the log returns of the last window steps up to the current one (per step, not annualized)
+  def get_volatility(self, window):
+    return self._to_value(self._get_window_series(("volatility", window))[self.index])
+
+'''
+twap, ema or volatility (see Oracle) at every step of prices, along the first axis
+the rolling windows are differences of prefix sums, so the cost does not depend on the window
+'''
+def get_window_series(prices, kind, window):
+  if kind == "ema":
+    return ema_series(np.ascontiguousarray(prices), 2 / (window + 1))
+
+  ends = np.arange(1, len(prices) + 1)
+  if kind == "twap":
+    starts = np.maximum(0, ends - window)
+    price_sums = np.concatenate([np.zeros((1,) + prices.shape[1:]), np.cumsum(prices, axis=0)])
+    counts = (ends - starts).reshape((-1,) + (1,) * (prices.ndim - 1))
+    return (price_sums[ends] - price_sums[starts]) / counts
+
+  if kind == "volatility":
+    ''' the return of step i is log(price[i] / price[i - 1]), step 0 has none '''
+    log_returns = np.diff(np.log(prices), axis=0)
+    ends = ends - 1
+    starts = np.maximum(0, ends - window)
+    return_sums = np.concatenate([np.zeros((1,) + prices.shape[1:]), np.cumsum(log_returns, axis=0)])
+    return_square_sums = np.concatenate([np.zeros((1,) + prices.shape[1:]), np.cumsum(log_returns**2, axis=0)])
+    counts = np.maximum(ends - starts, 1).reshape((-1,) + (1,) * (prices.ndim - 1))
+    mean = (return_sums[ends] - return_sums[starts]) / counts
+    variance = (return_square_sums[ends] - return_square_sums[starts]) / counts - mean**2
+    return np.sqrt(np.maximum(variance, 0))
+
+  raise ValueError("unknown window series: " + str(kind))
+
+'''
+stream the pyth dump as chunks of columns: price, twap, conf_interval, conf_interval_ratio and slot
+the dump is a comma separated file with a header line
+'''
+def iter_pyth_chunks(chunk_rows=PYTH_CHUNK_ROWS):
+  reader = pd.read_csv(PYTH_DATA_FILE, sep=",", header=None, skiprows=1, usecols=[3, 7, 8, 9], chunksize=chunk_rows, float_precision="round_trip")
+  for chunk in reader:
+    price = chunk[7].to_numpy(dtype=np.float64)
+    conf_interval = chunk[8].to_numpy(dtype=np.float64)
+    yield {
+      "price": price,
+      "twap": chunk[9].to_numpy(dtype=np.float64),
+      "conf_interval": conf_interval,
+      "conf_interval_ratio": conf_interval / price,
+      "slot": chunk[3].to_numpy(dtype=np.float64),
+    }
+
+''' parse the pyth dump into the cached columns, chunk by chunk '''
 def parse_pyth_data():
-  pyth_data_file = "../data/ETH_prices.csv"
-  conf_interval_history_filename = "../data/pyth_confidence_internval.json"
-  twap_history_filename = "../data/pyth_twap.json"
-  price_history_filename = "../data/pyth_price.json"
-
-  with open(pyth_data_file, "r") as eth_prices_csv:
-    price_history = []
-    slots = []
-    twap_history = []
-    conf_interval_ratio_list = []
-    reader = csv.reader(eth_prices_csv, delimiter="\t")
-
-    for i, line in enumerate(reader):
-      if i == 0:
-        continue
-      line = line[0].split(",")
-      price = float(line[7])
-      slot = int(line[3])
-      twap = float(line[9])
-
-      twap_history.append(twap)
-      price_history.append(price)
-      slots.append(slot)
-      
-      conf_interval = float(line[8])
-      conf_interval_ratio = conf_interval / price
-      conf_interval_ratio_list.append(conf_interval_ratio)
-
-    if not exists(conf_interval_history_filename):
-      with open(conf_interval_history_filename, "w") as outputFile:
-        outputFile.write(str(conf_interval_ratio_list))
-    
-    if not exists(twap_history_filename):
-      with open(twap_history_filename, "w") as outputFile:
-        outputFile.write(str(twap_history))
-    
-    if not exists(price_history_filename):
-      with open(price_history_filename, "w") as outputFile:
-        outputFile.write(str(price_history))
+  column_names = ["price", "twap", "conf_interval", "conf_interval_ratio", "slot"]
+  with ColumnWriter(get_cache_dir("pyth", PYTH_DATA_FILE), PYTH_DATA_FILE, column_names) as writer:
+    for chunk in iter_pyth_chunks():
+      writer.append(chunk)
 
+''' all the pyth columns as memory-mapped float64 arrays, the dump is parsed on first use only '''
+def get_pyth_columns() -> dict:
+  cache_dir = get_cache_dir("pyth", PYTH_DATA_FILE)
+  if not has_columns(cache_dir, PYTH_DATA_FILE):
+    parse_pyth_data()
+  return load_columns(cache_dir)
 
 def get_pyth_confidence_interval_history():
-  conf_interval_history_filename = "../data/pyth_confidence_internval.json"
-      
-  if not exists(conf_interval_history_filename):
-    parse_pyth_data()
+  return get_pyth_columns()["conf_interval_ratio"]
 
-  with open(conf_interval_history_filename, "r") as inputFile:
-    return ast.literal_eval(inputFile.read())
-  
 def get_pyth_twap_history():
-  twap_history_filename = "../data/pyth_twap.json"
-      
-  if not exists(twap_history_filename):
-    parse_pyth_data()
+  return get_pyth_columns()["twap"]
 
-  with open(twap_history_filename, "r") as inputFile:
-    return ast.literal_eval(inputFile.read())
-  
 def get_pyth_price_history():
-  price_history_filename = "../data/pyth_price.json"
-      
-  if not exists(price_history_filename):
-    parse_pyth_data()
+  return get_pyth_columns()["price"]
 
-  with open(price_history_filename, "r") as inputFile:
-    return ast.literal_eval(inputFile.read())
+''' oracle on the pyth price, conf interval and twap, backed by the memory-mapped cache '''
+def get_pyth_oracle() -> Oracle:
+  columns = get_pyth_columns()
+  return Oracle(columns["price"], columns["conf_interval"], columns["twap"])
 
-def generate_conf_interval(price_history: list[float]) -> list[float]:
-  sample_conf_interval_ratio = get_pyth_confidence_interval_history()
-  random_conf_interval = []
+'''
+oracle fed by an iterator of (price_chunk, conf_interval_chunk), only the current chunk is held in memory
+it can only step forward, length is the total number of prices the iterator yields
+'''
+class StreamingOracle(Oracle):
+  def __init__(self, chunks, length) -> None:
+    self.chunks = iter(chunks)
+    self.chunk_start = 0
+    self.price_history, self.conf_intervals = next(self.chunks)
+    assert(len(self.conf_intervals) == len(self.price_history))
+    self.twap_history = None
+    self.max_index = length - 1
+    self._window_series = {}
+    self.set_index(0)
 
-  for price in price_history:
-    selected_index = int(random.random() * len(sample_conf_interval_ratio))
-    random_conf_interval.append(price * sample_conf_interval_ratio[selected_index])
+  ''' the window series are built over the whole history, which a streaming oracle does not hold '''
+  def _get_window_series(self, key):
+    raise TypeError("a StreamingOracle does not hold the whole history for twap / ema / volatility windows, use an Oracle over the full history")
 
-  return random_conf_interval
+  ''' the chunks can only be read once '''
+  def fork(self):
+    raise TypeError("a StreamingOracle reads its chunks only once and can not be forked, fork an Oracle over the full history")
 
-def get_binance_price_data_history(step_len):
-  fileName = "../data/price_history_step-" + str(step_len) + ".json"
-  if exists(fileName):
-    with open(fileName, "r") as inputFile:
-      return ast.literal_eval(inputFile.read())
+  def apply_price_shock(self, factor, start=None):
+    raise TypeError("a StreamingOracle only holds its current chunk and can not be shocked, shock an Oracle over the full history")
+
+  def set_index(self, index):
+    assert(index >= self.chunk_start)
+    while index >= self.chunk_start + len(self.price_history):
+      self.chunk_start += len(self.price_history)
+      self.price_history, self.conf_intervals = next(self.chunks)
+      assert(len(self.conf_intervals) == len(self.price_history))
+
+    self.index = index
+    self.price = float(self.price_history[index - self.chunk_start])
+    self.conf_interval = float(self.conf_intervals[index - self.chunk_start])
+
+'''
+oracle over num_paths price paths at once, for the batch simulation
+price_history and conf_intervals are (steps, num_paths) arrays, get_price and get_conf_interval
+return the row of the current step, i.e. one value per path
+'''
+class BatchOracle(Oracle):
+  def set_index(self, index):
+    self.index = index
+    self.price = self.price_history[index]
+    self.conf_interval = self.conf_intervals[index]
+
+  def get_num_paths(self):
+    return self.price_history.shape[1]
+
+  def _to_value(self, value):
+    return value
 
-  json_data = json.load(open("../data/ETH_USDC-trades.json"))
-  pandas_data = pd.DataFrame(data=json_data, columns=['timestamp', 'id', 'unnamed', 'side', 'price', 'amount', 'total'])
-  pandas_data.id = pandas_data.id.astype(int)
+  ''' the oracle of the paths in path_index at the current step, used for quoting on a subset of paths '''
+  def take(self, path_index):
+    subset = copy.copy(self)
+    subset.price = self.price[path_index]
+    subset.conf_interval = self.conf_interval[path_index]
+    return subset
 
-  price_history = [pandas_data.loc[0].price]
-  current_timestamp = pandas_data.loc[0].timestamp
+'''
+oracle over several assets sharing one index, e.g. ETH, BTC and SOL in USD
+price_history and conf_intervals are (steps, num_assets) arrays of the asset prices in a common numeraire,
+get_price and get_conf_interval return the row of the current step, i.e. one value per asset
 
-  for i in range(len(pandas_data)):
-    if pandas_data.loc[i].timestamp > current_timestamp + step_len:
-      price_history.append(pandas_data.loc[i].price)
-      current_timestamp = pandas_data.loc[i].timestamp
+the pools trade pairs of the assets: get_pair_oracle gives the oracle of one pair for the scalar amms,
+get_pairs_oracle the oracle of many pairs at once for the batch amms (see PoolRegistry in batch_simulation.py)
+'''
+class MultiAssetOracle(BatchOracle):
+  def __init__(self, asset_names: list[str], price_history, conf_intervals) -> None:
+    assert(np.shape(price_history)[1] == len(asset_names))
+    self.asset_names = list(asset_names)
+    self.asset_indices = {self.asset_names[i]: i for i in range(len(self.asset_names))}
+    super().__init__(price_history, conf_intervals)
 
-  with open("../data/price_history_step-" + str(step_len) + ".json", "w") as outfile:
-    outfile.write(str(price_history))
+  def get_num_assets(self):
+    return len(self.asset_names)
 
-  return price_history
+  def get_asset_index(self, asset):
+    if asset not in self.asset_indices:
+      raise ValueError("unknown asset: " + str(asset))
+    return self.asset_indices[asset]
+
+  ''' oracle of the pair, the price is the number of asset_A to buy 1 asset_B '''
+  def get_pair_oracle(self, asset_A, asset_B) -> "PairOracle":
+    return PairOracle(self, asset_A, asset_B)
+
+  ''' oracle of every (asset_A, asset_B) of pairs, one value per pair '''
+  def get_pairs_oracle(self, pairs: list[tuple]) -> "PairsOracle":
+    return PairsOracle(self, pairs)
+
+'''
+price and conf interval of the pairs (asset_index_A[i], asset_index_B[i]) from the rows of prices and conf_intervals
+the price of a pair is price_B / price_A, its conf interval adds up the relative conf intervals of both assets
+'''
+def get_pair_prices(prices, conf_intervals, asset_index_A, asset_index_B):
+  price = prices[..., asset_index_B] / prices[..., asset_index_A]
+  conf_interval = price * (conf_intervals[..., asset_index_A] / prices[..., asset_index_A] + conf_intervals[..., asset_index_B] / prices[..., asset_index_B])
+  return price, conf_interval
+
+'''
+oracle of the pair (asset_A, asset_B) of a MultiAssetOracle, the price is the number of asset_A to buy 1 asset_B
+it has no index of its own: it reads the index of the multi asset oracle, so stepping any view or the multi asset
+oracle steps every pair together, and the current values are only computed once per index
+'''
+class PairOracle(Oracle):
+  def __init__(self, oracle: MultiAssetOracle, asset_A, asset_B) -> None:
+    self.multi_asset_oracle = oracle
+    self.asset_index_A = oracle.get_asset_index(asset_A)
+    self.asset_index_B = oracle.get_asset_index(asset_B)
+    self.max_index = oracle.max_index
+    self.twap_history = None
+    self._window_series = {}
+    self._history = None
+    self._values_index = None
+
+  @property
+  def index(self):
+    return self.multi_asset_oracle.index
+
+  def set_index(self, index):
+    self.multi_asset_oracle.set_index(index)
+
+  def _update_values(self):
+    oracle = self.multi_asset_oracle
+    price, conf_interval = get_pair_prices(oracle.price, oracle.conf_interval, self.asset_index_A, self.asset_index_B)
+    self.price = float(price)
+    self.conf_interval = float(conf_interval)
+    self._values_index = oracle.index
+
+  def get_price(self):
+    if self._values_index != self.multi_asset_oracle.index:
+      self._update_values()
+    return self.price
 
+  def get_conf_interval(self):
+    if self._values_index != self.multi_asset_oracle.index:
+      self._update_values()
+    return self.conf_interval
+
+  ''' the whole pair history, computed on first use (window queries, fast mode) '''
+  def _get_history(self):
+    if self._history is None:
+      oracle = self.multi_asset_oracle
+      self._history = get_pair_prices(
+        np.asarray(oracle.price_history), np.asarray(oracle.conf_intervals), self.asset_index_A, self.asset_index_B)
+    return self._history
+
+  @property
+  def price_history(self):
+    return self._get_history()[0]
+
+  @property
+  def conf_intervals(self):
+    return self._get_history()[1]
+
+  ''' the index and the prices belong to the multi asset oracle, fork or shock it instead '''
+  def fork(self):
+    raise TypeError("a PairOracle follows the index of its MultiAssetOracle, fork the MultiAssetOracle")
+
+  def apply_price_shock(self, factor, start=None):
+    raise TypeError("a PairOracle reads the prices of its MultiAssetOracle, shock the MultiAssetOracle")
+
+'''
+oracle of many pairs of a MultiAssetOracle, one value per pair, read by the batch amms of a PoolRegistry
+like PairOracle it follows the index of the multi asset oracle, set_index steps the multi asset oracle
+'''
+class PairsOracle(BatchOracle):
+  def __init__(self, oracle: MultiAssetOracle, pairs: list[tuple]) -> None:
+    self.multi_asset_oracle = oracle
+    self.asset_index_A = np.array([oracle.get_asset_index(pair[0]) for pair in pairs], dtype=np.int64)
+    self.asset_index_B = np.array([oracle.get_asset_index(pair[1]) for pair in pairs], dtype=np.int64)
+    self.max_index = oracle.max_index
+    self.twap_history = None
+    self._window_series = {}
+    self._values_index = None
+
+  @property
+  def index(self):
+    return self.multi_asset_oracle.index
+
+  def set_index(self, index):
+    self.multi_asset_oracle.set_index(index)
+
+  ''' the window series are built over a price history, which this view does not hold '''
+  def _get_window_series(self, key):
+    raise TypeError("a PairsOracle holds no price history for twap / ema / volatility windows, use the PairOracle of each pair")
+
+  ''' see PairOracle '''
+  def fork(self):
+    raise TypeError("a PairsOracle follows the index of its MultiAssetOracle, fork the MultiAssetOracle")
+
+  def apply_price_shock(self, factor, start=None):
+    raise TypeError("a PairsOracle reads the prices of its MultiAssetOracle, shock the MultiAssetOracle")
+
+  def get_num_paths(self):
+    return len(self.asset_index_A)
+
+  def _update_values(self):
+    oracle = self.multi_asset_oracle
+    self.price, self.conf_interval = get_pair_prices(oracle.price, oracle.conf_interval, self.asset_index_A, self.asset_index_B)
+    self._values_index = oracle.index
+
+  def get_price(self):
+    if self._values_index != self.multi_asset_oracle.index:
+      self._update_values()
+    return self.price
+
+  def get_conf_interval(self):
+    if self._values_index != self.multi_asset_oracle.index:
+      self._update_values()
+    return self.conf_interval
+
+  def take(self, path_index):
+    if self._values_index != self.multi_asset_oracle.index:
+      self._update_values()
+    subset = super().take(path_index)
+    subset.asset_index_A = self.asset_index_A[path_index]
+    subset.asset_index_B = self.asset_index_B[path_index]
+    return subset
+
+''' streaming oracle reading the pyth dump directly, without building the cache '''
+def get_pyth_streaming_oracle(chunk_rows=PYTH_CHUNK_ROWS) -> StreamingOracle:
+  with open(PYTH_DATA_FILE, "r") as inputFile:
+    length = sum(1 for _ in inputFile) - 1
+  chunks = ((chunk["price"], chunk["conf_interval"]) for chunk in iter_pyth_chunks(chunk_rows))
+  return StreamingOracle(chunks, length)
+
+'''
+conf interval of every price: the price times a conf interval ratio sampled from the pyth history
+the samples are drawn at once from rng, a numpy Generator (e.g. RandomStreams.get_generator), default numpy.random
+'''
+def generate_conf_interval(price_history, rng: np.random.Generator=None) -> np.ndarray:
+  sample_conf_interval_ratio = np.asarray(get_pyth_confidence_interval_history())
+  draws = (np.random if rng is None else rng).random(len(price_history))
+  selected_index = (draws * len(sample_conf_interval_ratio)).astype(np.int64)
+  return np.asarray(price_history, dtype=np.float64) * sample_conf_interval_ratio[selected_index]
+
+'''
+rows of a json array of flat arrays (the binance trade dump), parsed chunk by chunk
+the rows must not hold nested arrays, which is the case for the trade dump
+'''
+def iter_json_array_chunks(filename, chunk_bytes=BINANCE_CHUNK_BYTES):
+  with open(filename, "r") as inputFile:
+    buffer = inputFile.read(chunk_bytes).lstrip()
+    assert(buffer.startswith("["))
+    buffer = buffer[1:]
+
+    while True:
+      data = inputFile.read(chunk_bytes)
+      if not data:
+        buffer = buffer.rstrip()
+        assert(buffer.endswith("]"))
+        rows_text = buffer[:-1].strip()
+        if rows_text:
+          yield json.loads("[" + rows_text + "]")
+        return
+
+      buffer += data
+      ''' cut at the last comma between two rows, i.e. preceded by the closing bracket of a row '''
+      separator = buffer.rfind(",")
+      while separator >= 0:
+        previous = separator - 1
+        while previous >= 0 and buffer[previous].isspace():
+          previous -= 1
+        if previous >= 0 and buffer[previous] == "]":
+          break
+        separator = buffer.rfind(",", 0, separator)
+
+      if separator >= 0:
+        rows_text = buffer[:separator].strip()
+        buffer = buffer[separator + 1:]
+        if rows_text:
+          yield json.loads("[" + rows_text + "]")
+
+''' timestamp, price and amount of every binance trade, the raw json dump is streamed once into the cache '''
+def get_binance_trade_columns() -> dict:
+  cache_dir = get_cache_dir("binance_trades", BINANCE_TRADES_FILE)
+  if not has_columns(cache_dir, BINANCE_TRADES_FILE):
+    with ColumnWriter(cache_dir, BINANCE_TRADES_FILE, ["timestamp", "price", "amount"]) as writer:
+      for json_data in iter_json_array_chunks(BINANCE_TRADES_FILE):
+        pandas_data = pd.DataFrame(data=json_data, columns=['timestamp', 'id', 'unnamed', 'side', 'price', 'amount', 'total'])
+        writer.append({"timestamp": pandas_data.timestamp, "price": pandas_data.price, "amount": pandas_data.amount})
+  return load_columns(cache_dir)
+
+'''
+indices of the trades sampled every step_len: the first trade is sampled,
+then the first trade whose timestamp is more than step_len after the previously sampled one
+'''
+def get_step_indices(timestamps, step_len):
+  timestamps = np.asarray(timestamps)
+  if len(timestamps) == 0:
+    return np.zeros(0, dtype=np.int64)
+
+  if np.all(timestamps[1:] >= timestamps[:-1]):
+    next_index = np.searchsorted(timestamps, timestamps + step_len, side="right").tolist()
+    indices = [0]
+    i = next_index[0]
+    while i < len(timestamps):
+      indices.append(i)
+      i = next_index[i]
+    return np.array(indices, dtype=np.int64)
+
+  ''' a dump that is not in time order keeps the sequential scan '''
+  timestamps = timestamps.tolist()
+  indices = [0]
+  current_timestamp = timestamps[0]
+  for i in range(len(timestamps)):
+    if timestamps[i] > current_timestamp + step_len:
+      indices.append(i)
+      current_timestamp = timestamps[i]
+  return np.array(indices, dtype=np.int64)
+
+'''
+one bar per sampled trade, covering the trades up to the next sampled one
+price is the sampled trade price (same as open)
+'''
+def get_price_bars(trade_columns: dict, indices) -> dict:
+  timestamp = np.asarray(trade_columns["timestamp"])
+  price = np.asarray(trade_columns["price"])
+  amount = np.asarray(trade_columns["amount"])
+  if len(indices) == 0:
+    return {name: np.zeros(0) for name in ["price", "timestamp", "open", "high", "low", "close", "volume", "vwap"]}
+
+  volume = np.add.reduceat(amount, indices)
+  notional = np.add.reduceat(price * amount, indices)
+  return {
+    "price": price[indices],
+    "timestamp": timestamp[indices],
+    "open": price[indices],
+    "high": np.maximum.reduceat(price, indices),
+    "low": np.minimum.reduceat(price, indices),
+    "close": price[np.append(indices[1:], len(price)) - 1],
+    "volume": volume,
+    "vwap": np.divide(notional, volume, out=price[indices].copy(), where=volume > 0),
+  }
+
+''' resample the binance trades for every step_len in step_lens, reading the trades once '''
+def cache_binance_price_bars(step_lens):
+  trade_columns = None
+  for step_len in step_lens:
+    cache_dir = get_cache_dir("binance_bars", BINANCE_TRADES_FILE, {"step_len": step_len})
+    if has_columns(cache_dir, BINANCE_TRADES_FILE):
+      continue
+
+    if trade_columns is None:
+      trade_columns = get_binance_trade_columns()
+    indices = get_step_indices(trade_columns["timestamp"], step_len)
+    save_columns(cache_dir, BINANCE_TRADES_FILE, get_price_bars(trade_columns, indices))
+
+''' price, timestamp, open, high, low, close, volume and vwap columns of the bars of step_len '''
+def get_binance_price_bars(step_len) -> dict:
+  cache_binance_price_bars([step_len])
+  return load_columns(get_cache_dir("binance_bars", BINANCE_TRADES_FILE, {"step_len": step_len}))
+
+def get_binance_price_data_history(step_len):
+  return get_binance_price_bars(step_len)["price"]
@@ -1,9 +1,13 @@
 
 from abc import abstractclassmethod
+import numpy as np
 from .price_data import Oracle
+from .optimal_arb import solve_optimal_trade, solve_swap_in
+from .recorder import EVENT_SWAP_A_FOR_B
 
 # virtual class for all amm types
 class AMM():
+  __slots__ = ("_step_cache_index", "_step_cache", "recorder", "recorder_id")
   @abstractclassmethod
   def get_name(self):
     raise NotImplementedError
@@ -25,6 +29,33 @@ class AMM():
   @abstractclassmethod
   def get_swap_out_B(self, token_A_input: float):
     raise NotImplementedError
+  # amount of A to sell for B that maximises the gain of an arbitraguer selling B elsewhere at target_price_B_sell_B
+  # curves without a closed form use the bracketed secant solve of optimal_arb.py
+  def get_optimal_arb_sell_A(self, target_price_B_sell_B) -> float:
+    return solve_optimal_trade(self.get_swap_out_B, target_price_B_sell_B, self.get_balance_A() * 0.1)
+  # amount of B to sell for A that maximises the gain of an arbitraguer selling A elsewhere at target_price_A_sell_A
+  def get_optimal_arb_sell_B(self, target_price_A_sell_A) -> float:
+    return solve_optimal_trade(self.get_swap_out_A, target_price_A_sell_A, self.get_balance_B() * 0.1)
+  # get_swap_out_A over an array of token B inputs (a quote ladder), returned as an array of the same shape
+  # the amms with closed form curves quote the whole ladder in one array evaluation
+  def get_swap_out_A_ladder(self, token_B_inputs) -> np.ndarray:
+    return np.vectorize(self.get_swap_out_A, otypes=[float])(token_B_inputs)
+  def get_swap_out_B_ladder(self, token_A_inputs) -> np.ndarray:
+    return np.vectorize(self.get_swap_out_B, otypes=[float])(token_A_inputs)
+  # inverse quotes: amount of B to sell to buy token_A_outputs of A, inf for an output the pool never pays
+  def get_swap_in_B(self, token_A_outputs) -> np.ndarray:
+    return solve_swap_in(self.get_swap_out_A_ladder, token_A_outputs, self.get_balance_B() * 0.1)
+  # amount of A to sell to buy token_B_outputs of B
+  def get_swap_in_A(self, token_B_outputs) -> np.ndarray:
+    return solve_swap_in(self.get_swap_out_B_ladder, token_B_outputs, self.get_balance_A() * 0.1)
+  # amount of A to sell for the marginal price of the curve (B bought by the last A sold) to fall to implied_price_A_for_B,
+  # 0 when it is already there; without fee it is the get_implied_price_A_for_B after the trade
+  # selling B elsewhere at target_price_B_sell_B, the optimal arb is get_swap_in_A_for_price(1 / target_price_B_sell_B)
+  def get_swap_in_A_for_price(self, implied_prices_A_for_B) -> np.ndarray:
+    return np.vectorize(lambda price: self.get_optimal_arb_sell_A(1 / price), otypes=[float])(implied_prices_A_for_B)
+  # amount of B to sell for the marginal price of the curve (A bought by the last B sold) to fall to implied_price_B_for_A
+  def get_swap_in_B_for_price(self, implied_prices_B_for_A) -> np.ndarray:
+    return np.vectorize(lambda price: self.get_optimal_arb_sell_B(1 / price), otypes=[float])(implied_prices_B_for_A)
   @abstractclassmethod
   def swap_A_for_B(self, token_A_input):
     raise NotImplementedError
@@ -43,9 +74,50 @@ class AMM():
   @abstractclassmethod
   def get_lp_bot(self):
     raise NotImplementedError
+  # quantities derived from the oracle step that do not depend on the pool balances,
+  # recomputed only when the oracle index moves or after invalidate_step_cache()
+  def get_step_cache(self):
+    if self._step_cache_index != self.oracle.index:
+      self._step_cache = self._compute_step_cache()
+      self._step_cache_index = self.oracle.index
+    return self._step_cache
+  def invalidate_step_cache(self):
+    self._step_cache_index = None
+    self._step_cache = None
+  # drop every cached quantity, needed after the prices of the current step or the parameters change in place
+  def invalidate_caches(self):
+    self.invalidate_step_cache()
+  @abstractclassmethod
+  def _compute_step_cache(self):
+    raise NotImplementedError
+  # events of this amm are written to recorder under recorder_id, nothing is recorded when it is None
+  def set_recorder(self, recorder, recorder_id=0):
+    self.recorder = recorder
+    self.recorder_id = recorder_id
+  def _record_swap(self, event, token_input, token_output, implied_price, actual_price):
+    if event == EVENT_SWAP_A_FOR_B:
+      amount_A, amount_B = token_input, -token_output
+    else:
+      amount_A, amount_B = -token_output, token_input
+    self.recorder.record(
+      event, self.recorder_id, amount_A, amount_B, self.oracle.get_price(), self.get_balance_A(), self.get_balance_B(),
+      implied_price=implied_price, actual_price=actual_price)
+  # mutable state of the amm (balances, reserves, share supplies) for the snapshots of SimulationState,
+  # the parameters (e.g. the fee rate) are not part of it, so a fork can change them
+  @abstractclassmethod
+  def get_state(self) -> tuple:
+    raise NotImplementedError
+  @abstractclassmethod
+  def set_state(self, state: tuple):
+    raise NotImplementedError
+  # copy of the amm state batched over num_paths independent paths
+  @abstractclassmethod
+  def get_batch_amm(self, num_paths):
+    raise NotImplementedError
 
 
 class TradingBot():
+  __slots__ = ()
   @abstractclassmethod
   def maybe_execute_trade(self, amm: AMM):
     raise NotImplementedError
@@ -70,4 +142,33 @@ class LPBot():
   
   @abstractclassmethod
   def get_result(self) -> list[float]:
+    raise NotImplementedError
+
+  # the two halves of update_record, for run_event_simulation, which runs them as separate events:
+  # the withdrawals of the records due at cycle, returns (records withdrawn, records due again min_holding_cycles later)
+  @abstractclassmethod
+  def withdraw_due(self, cycle) -> tuple:
+    raise NotImplementedError
+
+  # the deposit of cycle, with deposit_prob when the bot has room, returns whether it deposited
+  @abstractclassmethod
+  def maybe_deposit(self, cycle) -> bool:
+    raise NotImplementedError
+
+  @abstractclassmethod
+  def is_full(self) -> bool:
+    raise NotImplementedError
+
+  # the cycles from first_cycle to first_cycle + min_holding_cycles - 1 at which records are due
+  @abstractclassmethod
+  def get_due_cycles(self, first_cycle) -> list[int]:
+    raise NotImplementedError
+
+  # deposit records and results, for the snapshots of SimulationState
+  @abstractclassmethod
+  def get_state(self) -> tuple:
+    raise NotImplementedError
+
+  @abstractclassmethod
+  def set_state(self, state: tuple):
     raise NotImplementedError
\ No newline at end of file
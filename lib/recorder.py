@@ -0,0 +1,146 @@
+import glob
+import os
+from os.path import join
+
+import numpy as np
+import pandas as pd
+
+try:
+  import pyarrow
+  import pyarrow.parquet
+except ImportError:
+  pyarrow = None
+
+'''
+columnar event log of a simulation run
+
+the amms record every swap and the lp bots every deposit and withdrawal into one EventRecorder
+events are buffered in preallocated typed arrays and flushed to one file per chunk of chunk_size events
+(parquet when pyarrow is installed, npz otherwise), so a run of millions of events holds no python objects
+and can be analysed afterwards with load_events
+'''
+
+EVENT_SWAP_A_FOR_B = 0
+EVENT_SWAP_B_FOR_A = 1
+EVENT_LP_DEPOSIT = 2
+EVENT_LP_WITHDRAW = 3
+EVENT_NAMES = ["swap_A_for_B", "swap_B_for_A", "lp_deposit", "lp_withdraw"]
+
+''' who triggered the event, set by the simulation loop through EventRecorder.actor '''
+ACTOR_UNKNOWN = 0
+ACTOR_RETAIL = 1
+ACTOR_ARB = 2
+ACTOR_LP = 3
+ACTOR_NAMES = ["unknown", "retail", "arb", "lp"]
+
+'''
+step: oracle step of the event
+amm: id given to the amm with AMM.set_recorder
+amount_A/amount_B: change of the pool balances, positive when the token goes into the pool
+implied_price/actual_price: quoted and executed price of a swap (output per 1 input), nan for lp events
+oracle_price, balance_A, balance_B: oracle price and pool balances after the event
+share_A/share_B: lp shares minted or burned, uniswap only has one share and leaves share_B at 0
+lp_return: (withdrawn value / deposited value) - 1 at the oracle price, lp withdrawals only
+holding_cycles: cycles between deposit and withdrawal, -1 for other events
+'''
+COLUMN_DTYPES = {
+  "step": np.int64,
+  "event": np.int8,
+  "actor": np.int8,
+  "amm": np.int16,
+  "amount_A": np.float64,
+  "amount_B": np.float64,
+  "implied_price": np.float64,
+  "actual_price": np.float64,
+  "oracle_price": np.float64,
+  "balance_A": np.float64,
+  "balance_B": np.float64,
+  "share_A": np.float64,
+  "share_B": np.float64,
+  "lp_return": np.float64,
+  "holding_cycles": np.int64,
+}
+
+DEFAULT_CHUNK_SIZE = 1000000
+CHUNK_PREFIX = "events-"
+
+class EventRecorder():
+  __slots__ = ("output_dir", "chunk_size", "file_format", "step", "actor", "columns", "length", "num_chunks", "_rows")
+
+  def __init__(self, output_dir, chunk_size=DEFAULT_CHUNK_SIZE, file_format=None) -> None:
+    if file_format is None:
+      file_format = "npz" if pyarrow is None else "parquet"
+    assert(file_format in ("npz", "parquet"))
+    assert(file_format != "parquet" or pyarrow is not None)
+
+    os.makedirs(output_dir, exist_ok=True)
+    for filename in _get_chunk_filenames(output_dir):
+      os.remove(filename)
+
+    self.output_dir = output_dir
+    self.chunk_size = chunk_size
+    self.file_format = file_format
+    self.step = 0
+    self.actor = ACTOR_UNKNOWN
+    self.columns = {name: np.empty(chunk_size, dtype=dtype) for name, dtype in COLUMN_DTYPES.items()}
+    self.length = 0
+    self.num_chunks = 0
+    ''' the columns in COLUMN_DTYPES order, so record can fill a row without dict lookups '''
+    self._rows = list(self.columns.values())
+
+  def record(
+    self, event, amm_id, amount_A, amount_B, oracle_price, balance_A, balance_B,
+    implied_price=np.nan, actual_price=np.nan, share_A=np.nan, share_B=np.nan, lp_return=np.nan, holding_cycles=-1):
+
+    values = (
+      self.step, event, self.actor, amm_id, amount_A, amount_B, implied_price, actual_price,
+      oracle_price, balance_A, balance_B, share_A, share_B, lp_return, holding_cycles,
+    )
+    i = self.length
+    for column, value in zip(self._rows, values):
+      column[i] = value
+
+    self.length += 1
+    if self.length == self.chunk_size:
+      self.flush()
+
+  ''' write the buffered events as a new chunk file '''
+  def flush(self):
+    if self.length == 0:
+      return
+
+    columns = {name: column[:self.length] for name, column in self.columns.items()}
+    filename = join(self.output_dir, CHUNK_PREFIX + "%06d." % self.num_chunks + self.file_format)
+    if self.file_format == "parquet":
+      pyarrow.parquet.write_table(pyarrow.table(columns), filename)
+    else:
+      np.savez(filename, **columns)
+
+    self.num_chunks += 1
+    self.length = 0
+
+  def close(self):
+    self.flush()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+def _get_chunk_filenames(output_dir):
+  return sorted(glob.glob(join(output_dir, CHUNK_PREFIX + "*.npz")) + glob.glob(join(output_dir, CHUNK_PREFIX + "*.parquet")))
+
+''' all the events recorded in output_dir, in recording order '''
+def load_events(output_dir) -> pd.DataFrame:
+  frames = []
+  for filename in _get_chunk_filenames(output_dir):
+    if filename.endswith(".parquet"):
+      frames.append(pd.read_parquet(filename))
+    else:
+      with np.load(filename) as chunk:
+        frames.append(pd.DataFrame({name: chunk[name] for name in COLUMN_DTYPES}))
+
+  if len(frames) == 0:
+    return pd.DataFrame({name: np.zeros(0, dtype=dtype) for name, dtype in COLUMN_DTYPES.items()})
+  return pd.concat(frames, ignore_index=True)
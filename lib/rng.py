@@ -0,0 +1,177 @@
+import copy
+import itertools
+import math
+import operator
+import random
+import zlib
+import numpy as np
+
+'''
+seeded random number streams for reproducible runs, also across processes
+
+RandomStreams(seed) hands out independent substreams addressed by a key of names and ints,
+e.g. streams.get("retail", 3) is the stream of the retail traders of pool 3
+the same seed and key always give the same numbers, whatever the other streams draw and in whatever process,
+a sweep worker can take its own streams with streams.fork("worker", worker_index)
+
+a stream is a BufferedRandom: random() is served from blocks drawn at once by a numpy.random.Generator
+it has the random() and shuffle() of the random module, so the agents take either of them as rng
+'''
+
+DEFAULT_BLOCK_SIZE = 4096
+
+class BufferedRandom():
+  __slots__ = ("generator", "block_size", "random", "_block_state", "_block_iterator")
+
+  def __init__(self, generator: np.random.Generator, block_size=DEFAULT_BLOCK_SIZE) -> None:
+    self.generator = generator
+    self.block_size = block_size
+    self._start(None, 0)
+
+  '''
+  random() is the c level next of a chain over the blocks, so a draw costs no python frame
+  the chain starts at draw position of the block drawn from the generator state block_state (None for no block yet),
+  the generator state of every block is kept so that get_state does not have to hold the block itself
+  '''
+  def _start(self, block_state, position):
+    block = []
+    if block_state is not None:
+      state = self.generator.bit_generator.state
+      self.generator.bit_generator.state = block_state
+      block = self.generator.random(self.block_size).tolist()[position:]
+      self.generator.bit_generator.state = state
+    self._block_state = block_state
+    self._block_iterator = iter(block)
+    self.random = itertools.chain.from_iterable(self._iter_blocks()).__next__
+
+  def _iter_blocks(self):
+    yield self._block_iterator
+    while True:
+      self._block_state = self.generator.bit_generator.state
+      self._block_iterator = iter(self.generator.random(self.block_size).tolist())
+      yield self._block_iterator
+
+  ''' (generator state, generator state of the current block, draws of the block already served) '''
+  def get_state(self):
+    if self._block_state is None:
+      return self.generator.bit_generator.state, None, 0
+    return self.generator.bit_generator.state, self._block_state, self.block_size - operator.length_hint(self._block_iterator)
+
+  def set_state(self, state):
+    self.generator.bit_generator.state, block_state, position = state
+    self._start(block_state, position)
+
+  ''' copies and pickles continue from the same draw '''
+  def __reduce__(self):
+    return BufferedRandom, (self.generator, self.block_size), self.get_state()
+
+  def __setstate__(self, state):
+    self.set_state(state)
+
+  ''' in place shuffle of the list x with one permutation of the generator '''
+  def shuffle(self, x: list):
+    x[:] = [x[i] for i in self.generator.permutation(len(x)).tolist()]
+
+  ''' size draws as a float64 array, drawn directly from the generator '''
+  def random_array(self, size):
+    return self.generator.random(size)
+
+''' state of rng (a BufferedRandom, the random module or a random.Random), see SimulationState in simulation.py '''
+def get_rng_state(rng):
+  if isinstance(rng, BufferedRandom):
+    return rng.get_state()
+  return rng.getstate()
+
+def set_rng_state(rng, state):
+  if isinstance(rng, BufferedRandom):
+    rng.set_state(state)
+  else:
+    rng.setstate(state)
+
+''' independent copy of rng at the same draw, the copy of the random module is a random.Random '''
+def copy_rng(rng):
+  if rng is random:
+    rng_copy = random.Random()
+    rng_copy.setstate(random.getstate())
+    return rng_copy
+  return copy.deepcopy(rng)
+
+''' size draws of rng as a float64 array, rng is a BufferedRandom, the random module or a random.Random '''
+def random_array(rng, size):
+  if isinstance(rng, BufferedRandom):
+    return rng.random_array(size)
+  return np.array([rng.random() for _ in range(size)], dtype=np.float64)
+
+'''
+sorted indices below n of independent bernoulli(p) successes, i.e. a binomial(n, p) count of uniform positions,
+drawn by geometric skips between the successes: the cost is one draw per success, not one per index
+'''
+def bernoulli_indices(rng, n, p) -> list[int]:
+  if p >= 1:
+    return list(range(n))
+  if p <= 0:
+    return []
+  log_q = math.log(1 - p)
+  indices = []
+  i = int(math.log(1 - rng.random()) / log_q)
+  while i < n:
+    indices.append(i)
+    i += 1 + int(math.log(1 - rng.random()) / log_q)
+  return indices
+
+'''
+k distinct uniform indices below n in random order, like the first k of a shuffle of range(n)
+rejection on a set while k is small against n, a partial shuffle otherwise, so the cost is O(k)
+'''
+def sample_indices(rng, n, k) -> list[int]:
+  assert(0 <= k <= n)
+  if 3 * k > n:
+    indices = list(range(n))
+    for i in range(k):
+      j = i + int(rng.random() * (n - i))
+      indices[i], indices[j] = indices[j], indices[i]
+    return indices[:k]
+
+  seen = set()
+  indices = []
+  while len(indices) < k:
+    i = int(rng.random() * n)
+    if i not in seen:
+      seen.add(i)
+      indices.append(i)
+  return indices
+
+''' names are hashed with crc32 (stable across processes, unlike hash()) above the range of the int keys '''
+def _get_key_word(part) -> int:
+  if isinstance(part, str):
+    return zlib.crc32(part.encode()) | (1 << 32)
+  assert(int(part) == part and 0 <= part < (1 << 32))
+  return int(part)
+
+class RandomStreams():
+  ''' seed is an int, None (fresh os entropy, see seed_sequence.entropy) or a numpy SeedSequence '''
+  def __init__(self, seed=None, block_size=DEFAULT_BLOCK_SIZE) -> None:
+    if isinstance(seed, np.random.SeedSequence):
+      self.seed_sequence = seed
+    else:
+      self.seed_sequence = np.random.SeedSequence(seed)
+    self.block_size = block_size
+
+  def _get_seed_sequence(self, key) -> np.random.SeedSequence:
+    spawn_key = tuple(self.seed_sequence.spawn_key) + tuple(_get_key_word(part) for part in key)
+    return np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=spawn_key)
+
+  def get_generator(self, *key) -> np.random.Generator:
+    return np.random.Generator(np.random.PCG64(self._get_seed_sequence(key)))
+
+  ''' a new BufferedRandom at the start of the stream of key, every call restarts the stream '''
+  def get(self, *key) -> BufferedRandom:
+    return BufferedRandom(self.get_generator(*key), self.block_size)
+
+  ''' int seed in [0, 2**31) of the stream of key, for code seeded with a plain int '''
+  def get_seed(self, *key) -> int:
+    return int(self._get_seed_sequence(key).generate_state(1)[0]) >> 1
+
+  ''' streams of their own under key, e.g. one per sweep worker '''
+  def fork(self, *key) -> "RandomStreams":
+    return RandomStreams(self._get_seed_sequence(key), self.block_size)
@@ -0,0 +1,260 @@
+from .prototypes import AMM
+from .price_data import Oracle
+
+'''
+router across a set of pools, quoting and trading the best split over the multi hop routes between two assets
+
+a route is a tuple of hops (pool_id, sells_A): the hop sells the token A of the pool when sells_A is True
+the routes between two assets are every path of at most max_hops pools that does not visit an asset twice,
+they are found once and cached until a pool is added
+
+an amount is split in num_splits equal chunks, each chunk goes to the route with the best marginal output
+routes sharing a pool are quoted as if they were independent, so the executed output can be a bit lower than the quote
+
+the pool quotes and the splits are cached for the current oracle step, so repeated queries within a step
+(e.g. a quote followed by the swap of the same amount) do not quote the pools again
+like the step cache of the amms, the cache is dropped when the oracle index moves and after a swap through the router,
+a pool traded directly (not through the router) needs invalidate_quote_cache()
+'''
+
+DEFAULT_MAX_HOPS = 3
+DEFAULT_NUM_SPLITS = 4
+
+class Router():
+  ''' oracle is the oracle stepping the pools, e.g. the MultiAssetOracle of their pair oracles '''
+  def __init__(self, oracle: Oracle, max_hops=DEFAULT_MAX_HOPS, num_splits=DEFAULT_NUM_SPLITS) -> None:
+    assert(max_hops >= 1 and num_splits >= 1)
+    self.oracle = oracle
+    self.max_hops = max_hops
+    self.num_splits = num_splits
+    self.amms: list[AMM] = []
+    self.pairs: list[tuple] = []
+    ''' pool ids of the pools of every asset '''
+    self._asset_pools: dict = {}
+    self._routes: dict[tuple, list[tuple]] = {}
+    self._pool_quotes: list[dict] = []
+    self._splits: dict[tuple, tuple] = {}
+    self._quote_cache_index = None
+
+  def __len__(self):
+    return len(self.amms)
+
+  ''' add the pool of amm, trading asset_A (token A) for asset_B (token B), returns its pool id '''
+  def add_pool(self, amm: AMM, asset_A, asset_B) -> int:
+    assert(asset_A != asset_B)
+    pool_id = len(self.amms)
+    self.amms.append(amm)
+    self.pairs.append((asset_A, asset_B))
+    self._asset_pools.setdefault(asset_A, []).append(pool_id)
+    self._asset_pools.setdefault(asset_B, []).append(pool_id)
+    self._pool_quotes.append({})
+    self._routes = {}
+    self.invalidate_quote_cache()
+    return pool_id
+
+  ''' the pair of the router seen as one amm, asset_A is its token A and asset_B its token B '''
+  def get_pair(self, asset_A, asset_B) -> "RoutedPair":
+    return RoutedPair(self, asset_A, asset_B)
+
+  ''' every route from asset_in to asset_out, see above '''
+  def get_routes(self, asset_in, asset_out) -> list[tuple]:
+    key = (asset_in, asset_out)
+    if key not in self._routes:
+      routes = []
+      self._find_routes(asset_in, asset_out, (), {asset_in}, routes)
+      self._routes[key] = routes
+    return self._routes[key]
+
+  def _find_routes(self, asset, asset_out, route, visited, routes):
+    if len(route) == self.max_hops:
+      return
+    for pool_id in self._asset_pools.get(asset, []):
+      asset_A, asset_B = self.pairs[pool_id]
+      sells_A = asset == asset_A
+      next_asset = asset_B if sells_A else asset_A
+      if next_asset in visited:
+        continue
+      next_route = route + ((pool_id, sells_A),)
+      if next_asset == asset_out:
+        routes.append(next_route)
+        continue
+      visited.add(next_asset)
+      self._find_routes(next_asset, asset_out, next_route, visited, routes)
+      visited.remove(next_asset)
+
+  ''' drop the cached quotes of pool_id and every cached split, or of all the pools when pool_id is None '''
+  def invalidate_quote_cache(self, pool_id=None):
+    if pool_id is None:
+      self._pool_quotes = [{} for _ in range(len(self.amms))]
+    else:
+      self._pool_quotes[pool_id] = {}
+    self._splits = {}
+    self._quote_cache_index = self.oracle.index
+
+  def _check_quote_cache(self):
+    if self._quote_cache_index != self.oracle.index:
+      self.invalidate_quote_cache()
+
+  def get_pool_swap_out(self, pool_id, sells_A, token_input):
+    self._check_quote_cache()
+    quotes = self._pool_quotes[pool_id]
+    key = (sells_A, token_input)
+    token_output = quotes.get(key)
+    if token_output is None:
+      amm = self.amms[pool_id]
+      token_output = amm.get_swap_out_B(token_input) if sells_A else amm.get_swap_out_A(token_input)
+      quotes[key] = token_output
+    return token_output
+
+  ''' how much of the token bought 1 token sold buys at the margin, cached with the quotes of the pool '''
+  def get_pool_implied_price(self, pool_id, sells_A):
+    self._check_quote_cache()
+    quotes = self._pool_quotes[pool_id]
+    key = ("implied_price", sells_A)
+    implied_price = quotes.get(key)
+    if implied_price is None:
+      amm = self.amms[pool_id]
+      implied_price = amm.get_implied_price_A_for_B() if sells_A else amm.get_implied_price_B_for_A()
+      quotes[key] = implied_price
+    return implied_price
+
+  ''' output of route for token_input, a route is empty past a hop without output '''
+  def get_route_swap_out(self, route, token_input):
+    amount = token_input
+    for pool_id, sells_A in route:
+      if amount <= 0:
+        return 0
+      amount = self.get_pool_swap_out(pool_id, sells_A, amount)
+    return amount
+
+  '''
+  split of token_input of asset_in over the routes to asset_out, returns (amounts, outputs), one per route
+  greedy over the chunks: only the route that took the last chunk is quoted again
+  '''
+  def get_split(self, asset_in, asset_out, token_input):
+    self._check_quote_cache()
+    key = (asset_in, asset_out, token_input)
+    split = self._splits.get(key)
+    if split is None:
+      split = self._get_split(asset_in, asset_out, token_input)
+      self._splits[key] = split
+    return split
+
+  def _get_split(self, asset_in, asset_out, token_input):
+    routes = self.get_routes(asset_in, asset_out)
+    amounts = [0.0] * len(routes)
+    outputs = [0.0] * len(routes)
+    if len(routes) == 0 or token_input <= 0:
+      return amounts, outputs
+
+    chunk = token_input / self.num_splits
+    next_outputs = [self.get_route_swap_out(route, chunk) for route in routes]
+    for _ in range(self.num_splits):
+      best = 0
+      for r in range(1, len(routes)):
+        if next_outputs[r] - outputs[r] > next_outputs[best] - outputs[best]:
+          best = r
+      amounts[best] += chunk
+      outputs[best] = next_outputs[best]
+      next_outputs[best] = self.get_route_swap_out(routes[best], amounts[best] + chunk)
+    return amounts, outputs
+
+  ''' amount of asset_out bought with token_input of asset_in over the best split '''
+  def get_swap_out(self, asset_in, asset_out, token_input):
+    return sum(self.get_split(asset_in, asset_out, token_input)[1])
+
+  '''
+  sell token_input of asset_in for asset_out over the best split, hop by hop, returns the amount bought
+  the output of a hop is the pool quote just before its swap, which is what the pool pays out
+  '''
+  def swap(self, asset_in, asset_out, token_input):
+    routes = self.get_routes(asset_in, asset_out)
+    amounts, _ = self.get_split(asset_in, asset_out, token_input)
+    token_output = 0
+    for r in range(len(routes)):
+      amount = amounts[r]
+      for pool_id, sells_A in routes[r]:
+        if amount <= 0:
+          break
+        hop_output = self.get_pool_swap_out(pool_id, sells_A, amount)
+        amm = self.amms[pool_id]
+        if sells_A:
+          amm.swap_A_for_B(amount)
+        else:
+          amm.swap_B_for_A(amount)
+        self.invalidate_quote_cache(pool_id)
+        amount = hop_output
+      else:
+        token_output += amount
+    return token_output
+
+  '''
+  marginal price of asset_out in asset_in over the best route: how much asset_out 1 asset_in buys,
+  the product of the implied prices of the hops
+  '''
+  def get_implied_price(self, asset_in, asset_out):
+    best_price = 0
+    for route in self.get_routes(asset_in, asset_out):
+      price = 1
+      for pool_id, sells_A in route:
+        price *= self.get_pool_implied_price(pool_id, sells_A)
+      best_price = max(best_price, price)
+    return best_price
+
+  ''' amount of asset held by the pools of the router '''
+  def get_balance(self, asset):
+    balance = 0
+    for pool_id in self._asset_pools.get(asset, []):
+      amm = self.amms[pool_id]
+      balance += amm.get_balance_A() if self.pairs[pool_id][0] == asset else amm.get_balance_B()
+    return balance
+
+'''
+one pair of a router, traded like a single amm, so the trading bots (RetailAgent, RetailAgentPool, ArbAgent)
+trade through the router by taking it as their amm, e.g. arb_agent.maybe_execute_trade(router.get_pair("USDC", "ETH"))
+the pools keep their own tvl and lp accounting, the pair has none
+'''
+class RoutedPair(AMM):
+  __slots__ = ("router", "oracle", "asset_A", "asset_B")
+
+  def __init__(self, router: Router, asset_A, asset_B) -> None:
+    self.router = router
+    self.oracle = router.oracle
+    self.asset_A = asset_A
+    self.asset_B = asset_B
+    self.recorder = None
+
+  def get_name(self):
+    return "router " + str(self.asset_B) + "-" + str(self.asset_A)
+
+  def get_balance_A(self):
+    return self.router.get_balance(self.asset_A)
+
+  def get_balance_B(self):
+    return self.router.get_balance(self.asset_B)
+
+  def get_implied_price_A_for_B(self):
+    return self.router.get_implied_price(self.asset_A, self.asset_B)
+
+  def get_implied_price_B_for_A(self):
+    return self.router.get_implied_price(self.asset_B, self.asset_A)
+
+  def get_swap_out_A(self, token_B_input):
+    return self.router.get_swap_out(self.asset_B, self.asset_A, token_B_input)
+
+  def get_swap_out_B(self, token_A_input):
+    return self.router.get_swap_out(self.asset_A, self.asset_B, token_A_input)
+
+  ''' same return as the pool swaps: (token_A_input, slippage) against the implied price of the best route '''
+  def swap_A_for_B(self, token_A_input):
+    implied_price = self.get_implied_price_A_for_B()
+    token_B_output = self.router.swap(self.asset_A, self.asset_B, token_A_input)
+    actual_price = token_B_output / token_A_input
+    return token_A_input, abs(implied_price - actual_price) / implied_price
+
+  ''' same return as the pool swaps: (token_A_output, slippage) against the implied price of the best route '''
+  def swap_B_for_A(self, token_B_input):
+    implied_price = self.get_implied_price_B_for_A()
+    token_A_output = self.router.swap(self.asset_B, self.asset_A, token_B_input)
+    actual_price = token_A_output / token_B_input
+    return token_A_output, abs(implied_price - actual_price) / implied_price
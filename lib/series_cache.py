@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+from os.path import basename, exists, getmtime, getsize, join
+
+import numpy as np
+
+'''
+binary columnar cache for the price series derived from the raw data dumps
+
+a cache is a directory holding one raw float64 file per column and a small meta.json header
+(length, column names and the stat of the source file it was derived from)
+the columns are loaded back as read-only memory maps, so loading is instant and
+several processes share one page-cached copy
+'''
+
+CACHE_DIR = "../data/cache"
+META_FILENAME = "meta.json"
+COLUMN_EXTENSION = ".f64"
+
+''' cache directory for a series derived from source_filename with the given parameters '''
+def get_cache_dir(name, source_filename, params=None):
+  key = json.dumps({"source": basename(source_filename), "params": params}, sort_keys=True)
+  return join(CACHE_DIR, name + "-" + hashlib.sha256(key.encode()).hexdigest()[:16])
+
+def _get_source_stat(source_filename):
+  if not exists(source_filename):
+    return None
+  return [getsize(source_filename), getmtime(source_filename)]
+
+'''
+whether the cache exists and is up to date with its source file
+a cache whose source file is gone is still valid, the raw dumps are not always kept around
+'''
+def has_columns(cache_dir, source_filename):
+  meta_filename = join(cache_dir, META_FILENAME)
+  if not exists(meta_filename):
+    return False
+
+  with open(meta_filename, "r") as inputFile:
+    meta = json.load(inputFile)
+  source_stat = _get_source_stat(source_filename)
+  return source_stat is None or source_stat == meta["source_stat"]
+
+def _write_meta(cache_dir, source_filename, column_names, length):
+  meta = {"length": length, "columns": column_names, "source_stat": _get_source_stat(source_filename)}
+  ''' meta.json is written last and atomically, it marks the cache as complete '''
+  with open(join(cache_dir, META_FILENAME + ".tmp"), "w") as outputFile:
+    json.dump(meta, outputFile)
+  os.replace(join(cache_dir, META_FILENAME + ".tmp"), join(cache_dir, META_FILENAME))
+
+'''
+write columns chunk by chunk, so a series can be derived from a dump that does not fit in memory
+the cache only becomes visible to has_columns once the writer is closed without error
+'''
+class ColumnWriter():
+  def __init__(self, cache_dir, source_filename, column_names: list[str]) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_filename = join(cache_dir, META_FILENAME)
+    if exists(meta_filename):
+      os.remove(meta_filename)
+
+    self.cache_dir = cache_dir
+    self.source_filename = source_filename
+    self.column_names = column_names
+    self.length = 0
+    self.files = {name: open(join(cache_dir, name + COLUMN_EXTENSION), "wb") for name in column_names}
+
+  ''' append one chunk, every column of the chunk must have the same length '''
+  def append(self, columns: dict):
+    length = None
+    for name in self.column_names:
+      values = np.ascontiguousarray(columns[name], dtype=np.float64)
+      assert(length is None or length == len(values))
+      length = len(values)
+      values.tofile(self.files[name])
+    self.length += length or 0
+
+  def close(self, complete=True):
+    for file in self.files.values():
+      file.close()
+    if complete:
+      _write_meta(self.cache_dir, self.source_filename, self.column_names, self.length)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close(complete=exc_type is None)
+
+''' write the columns (all of the same length) as float64 '''
+def save_columns(cache_dir, source_filename, columns: dict):
+  with ColumnWriter(cache_dir, source_filename, list(columns.keys())) as writer:
+    writer.append(columns)
+
+''' load the columns as read-only memory-mapped float64 arrays '''
+def load_columns(cache_dir) -> dict:
+  with open(join(cache_dir, META_FILENAME), "r") as inputFile:
+    meta = json.load(inputFile)
+
+  columns = {}
+  for name in meta["columns"]:
+    if meta["length"] == 0:
+      columns[name] = np.zeros(0, dtype=np.float64)
+    else:
+      columns[name] = np.memmap(join(cache_dir, name + COLUMN_EXTENSION), dtype=np.float64, mode="r", shape=(meta["length"],))
+  return columns
@@ -8,80 +8,332 @@
 
 from .price_data import Oracle
 from .prototypes import AMM, LPBot
-from .trading_bots import RetailAgent, ArbAgent
+from .trading_bots import RetailAgentPool, ArbAgent
+from .recorder import EventRecorder, ACTOR_RETAIL, ACTOR_ARB, ACTOR_LP
+from .fast_simulation import run_fast_swap_simulation
+from .kernels import HAS_NUMBA
+from .trade_tape import TradeTape, replay_trade_tape
+from .rng import RandomStreams, bernoulli_indices, sample_indices, get_rng_state, set_rng_state, copy_rng
+import copy
+import heapq
+import math
+import pickle
 import random
+import numpy as np
+
+''' every amm records its events under its index in amm_list '''
+def _attach_recorder(amm_list: list[AMM], recorder: EventRecorder):
+  if recorder is None:
+    return
+  for k in range(len(amm_list)):
+    amm_list[k].set_recorder(recorder, k)
+
+'''
+random number sources and agents of a run: the rng of the step schedule (trader shuffle and selection),
+then per amm the rng of its trade gates, its retail trader pool and its arbitraguer
+rng is the random module (default) or a random.Random, shared by everything as before, or a RandomStreams,
+in which case every amm gets its own substreams, keyed by its index in amm_list, so the draws of a pool do not
+depend on the other pools of amm_list, while the retail population is drawn once from the "retail_population"
+stream and shared, so every pool faces the same traders
+'''
+def _get_agents(rng, oracle: Oracle, num_amms, num_retail_traders, arb_mode):
+  if not isinstance(rng, RandomStreams):
+    retail_trader_pool = RetailAgentPool(oracle, num_retail_traders, rng)
+    arb_trader = ArbAgent(oracle, arb_mode, rng)
+    return rng, [rng] * num_amms, [retail_trader_pool] * num_amms, [arb_trader] * num_amms
+
+  trade_rngs = [rng.get("trade", k) for k in range(num_amms)]
+  retail_population = RetailAgentPool(oracle, num_retail_traders, rng.get("retail_population"))
+  retail_traders = [retail_population.with_rng(rng.get("retail", k)) for k in range(num_amms)]
+  arb_traders = [ArbAgent(oracle, arb_mode, rng.get("arb", k)) for k in range(num_amms)]
+  return rng.get("schedule"), trade_rngs, retail_traders, arb_traders
+
+''' rng of the lp bot of the amm at index k, see _get_agents '''
+def _get_lp_rng(rng, k):
+  if isinstance(rng, RandomStreams):
+    return rng.get("lp", k)
+  return rng
+
+'''
+everything a swap or lp run carries from one step to the next: the oracle step, the amms, the lp bots,
+the agents with their random number sources, the trader order and the step count (the cycle of the lp bots)
+run_swap_simulation and run_lp_simulation continue the state passed as state, so a run warmed up once to step k
+can be branched into many continuations instead of simulating the shared prefix again:
+
+  state = SimulationState(100, 10, oracle, amm_list, rng=RandomStreams(0))
+  run_swap_simulation(100, 10, 0.5, oracle, amm_list, max_steps=k, state=state)
+  snapshot = state.get_snapshot()
+  fork = state.fork()
+  fork.amm_list[0].fee_rate = 0.003
+  fork.invalidate_caches()
+  fork.apply_price_shock(0.7)
+  run_swap_simulation(100, 10, 0.5, fork.oracle, fork.amm_list, state=fork)
+  state.restore(snapshot)
+
+a snapshot is the mutable state only (balances, reserves, share supplies, arb pool balances, deposit books,
+oracle index, rng states), the parameters, the agents and the price data stay with the state it is restored on
+a fork is an independent copy sharing the price data of the oracle, which a shock copies first (see Oracle.apply_price_shock)
+the amms cache quantities per oracle step (see AMM.get_step_cache and the rebalance cache of InternalArbAMM), so a
+parameter changed in place (fee_rate, arb_rebalance_ratio, ...) needs invalidate_caches(), apply_price_shock does it
+'''
+class SimulationState():
+  def __init__(self, num_retail_traders, num_arb_traders, oracle: Oracle, amm_list: list[AMM], arb_mode="search", rng=random) -> None:
+    self.num_retail_traders = num_retail_traders
+    self.num_arb_traders = num_arb_traders
+    self.oracle = oracle
+    self.amm_list = amm_list
+    self.arb_mode = arb_mode
+    self.rng = rng
+    self.schedule_rng, self.trade_rngs, self.retail_traders, self.arb_traders = _get_agents(
+      rng, oracle, len(amm_list), num_retail_traders, arb_mode)
+    ''' built by the first run_lp_simulation of the state '''
+    self.lp_bots: list[LPBot] = None
+    ''' trader ids below num_retail_traders are retail traders of the pool, the others are arbitraguers '''
+    self.traders = list(range(num_retail_traders + num_arb_traders))
+    self.cycle = 0
+
+  ''' distinct random number sources of the agents and lp bots, in a fixed order '''
+  def _get_rngs(self):
+    rngs = [self.schedule_rng] + self.trade_rngs + [agent.rng for agent in self.retail_traders + self.arb_traders]
+    if self.lp_bots is not None:
+      rngs += [lp_bot.rng for lp_bot in self.lp_bots]
+    return list({id(rng): rng for rng in rngs}.values())
+
+  def get_snapshot(self) -> bytes:
+    lp_bot_states = None if self.lp_bots is None else [lp_bot.get_state() for lp_bot in self.lp_bots]
+    return pickle.dumps((
+      self.oracle.index, self.cycle, self.traders, [amm.get_state() for amm in self.amm_list], lp_bot_states,
+      [get_rng_state(rng) for rng in self._get_rngs()],
+    ), protocol=pickle.HIGHEST_PROTOCOL)
+
+  ''' back to snapshot, taken on this state or on the state it was forked from (or a fork of it) '''
+  def restore(self, snapshot: bytes):
+    index, self.cycle, traders, amm_states, lp_bot_states, rng_states = pickle.loads(snapshot)
+    self.oracle.set_index(index)
+    self.traders = list(traders)
+    assert(len(amm_states) == len(self.amm_list))
+    for amm, amm_state in zip(self.amm_list, amm_states):
+      amm.set_state(amm_state)
+
+    if lp_bot_states is None:
+      self.lp_bots = None
+    else:
+      assert(self.lp_bots is not None and len(lp_bot_states) == len(self.lp_bots))
+      for lp_bot, lp_bot_state in zip(self.lp_bots, lp_bot_states):
+        lp_bot.set_state(lp_bot_state)
+
+    rngs = self._get_rngs()
+    assert(len(rng_states) == len(rngs))
+    for rng, rng_state in zip(rngs, rng_states):
+      set_rng_state(rng, rng_state)
+
+  '''
+  independent copy at the same step: the amms, lp bots, agents and rngs are copied, the oracle is forked (see Oracle.fork)
+  the copy of the random module is a random.Random, the event recorder is not carried over
+  '''
+  def fork(self) -> "SimulationState":
+    memo = {id(self.oracle): self.oracle.fork()}
+    for amm in self.amm_list:
+      memo[id(amm.recorder)] = None
+    if any(rng is random for rng in self._get_rngs() + [self.rng]):
+      memo[id(random)] = copy_rng(random)
+    state = copy.deepcopy(self, memo)
+    state.invalidate_caches()
+    return state
+
+  ''' drop the caches of the amms, after a parameter of an amm changes in place '''
+  def invalidate_caches(self):
+    for amm in self.amm_list:
+      amm.invalidate_caches()
+
+  ''' Oracle.apply_price_shock on the oracle of the state, the amms then quote off the shocked prices '''
+  def apply_price_shock(self, factor, start=None):
+    self.oracle.apply_price_shock(factor, start)
+    self.invalidate_caches()
+
+''' the state of a run: a new one, or the state to continue, which must be the state of these arguments '''
+def _get_state(state: SimulationState, num_retail_traders, num_arb_traders, oracle: Oracle, amm_list: list[AMM], arb_mode, rng):
+  if state is None:
+    return SimulationState(num_retail_traders, num_arb_traders, oracle, amm_list, arb_mode, rng)
+  assert(state.oracle is oracle and state.amm_list is amm_list and state.arb_mode == arb_mode)
+  assert(state.num_retail_traders == num_retail_traders and state.num_arb_traders == num_arb_traders)
+  return state
 
 def run_lp_simulation(
   num_retail_traders, num_arb_traders, trade_prob, 
   oracle: Oracle, amm_list: list[AMM], 
-  plt=None, max_steps=None, title=""):
+  plt=None, max_steps=None, title="", arb_mode="search", recorder: EventRecorder=None, rng=random,
+  state: SimulationState=None):
   
-  lp_bots: list[LPBot] = [
-    amm.get_lp_bot() for amm in amm_list
-  ]
+  state = _get_state(state, num_retail_traders, num_arb_traders, oracle, amm_list, arb_mode, rng)
+  if state.lp_bots is None:
+    state.lp_bots = [
+      amm_list[k].get_lp_bot(rng=_get_lp_rng(state.rng, k)) for k in range(len(amm_list))
+    ]
+  lp_bots = state.lp_bots
+  _attach_recorder(amm_list, recorder)
 
   if max_steps is None:
     max_steps = oracle.max_index
-  retail_traders = [RetailAgent(oracle) for _ in range(num_retail_traders)]
-  arb_traders = [ArbAgent(oracle) for _ in range(num_arb_traders)]
-  traders = retail_traders + arb_traders
+  schedule_rng, trade_rngs, retail_traders, arb_traders = state.schedule_rng, state.trade_rngs, state.retail_traders, state.arb_traders
+  traders = state.traders
   steps = 0
   tvl_ratio_change_list = [[] for _ in range(len(amm_list))]
 
-  for cycle in range(max_steps):
-    random.shuffle(traders)
-    selected_len = int(random.random() * len(traders))
+  for _ in range(max_steps):
+    cycle = state.cycle
+    if recorder is not None:
+      recorder.step = oracle.index
+    schedule_rng.shuffle(traders)
+    selected_len = int(schedule_rng.random() * len(traders))
     for k in range(len(amm_list)):
+      trade_rng = trade_rngs[k]
       ''' do random swaps first '''
       for j in range(selected_len):
-        if random.random() < trade_prob:
-          traders[j].maybe_execute_trade(amm_list[k])
+        if trade_rng.random() < trade_prob:
+          if traders[j] < num_retail_traders:
+            if recorder is not None:
+              recorder.actor = ACTOR_RETAIL
+            retail_traders[k].maybe_execute_trade(traders[j], amm_list[k])
+          else:
+            if recorder is not None:
+              recorder.actor = ACTOR_ARB
+            arb_traders[k].maybe_execute_trade(amm_list[k])
 
       tvl_ratio_change_list[k].append(amm_list[k].get_tvl_ratio_to_initial_state())
       ''' do random lp deposit/withdraw'''
+      if recorder is not None:
+        recorder.actor = ACTOR_LP
       lp_bots[k].update_record(cycle)
 
     steps += 1
+    state.cycle += 1
 
     if oracle.step_foward() is False:
       break
 
   steps = [i for i in range(steps)]
+  if recorder is not None:
+    recorder.flush()
   print(lp_bots[0].get_result())
 
 
-def run_swap_simulation(
-  num_retail_traders, num_arb_traders, trade_prob, 
-  oracle: Oracle, amm_list: list[AMM], 
-  plt=None, max_steps=None, title=""):
-  
-  if max_steps is None:
-    max_steps = oracle.max_index
-  retail_traders = [RetailAgent(oracle) for _ in range(num_retail_traders)]
-  arb_traders = [ArbAgent(oracle) for _ in range(num_arb_traders)]
-  traders = retail_traders + arb_traders
-  steps = 0
+SAMPLING_MODES = ("shuffle", "binomial")
+
+'''
+traders of every amm that trade this step, sampled at the cost of the active trades (sampling="binomial")
+same law as the shuffle loop: the first selected_len traders of a shuffle are the selected slots, the slots
+that pass the trade gate of amm k are a bernoulli(trade_prob) subset of them (bernoulli_indices with its trade rng),
+and only the slots active on some amm get a trader, distinct and uniform like the shuffle would give them
+'''
+def _get_active_traders(schedule_rng, trade_rngs, num_traders, trade_prob) -> list[list[int]]:
+  selected_len = int(schedule_rng.random() * num_traders)
+  active_slots = [bernoulli_indices(trade_rngs[k], selected_len, trade_prob) for k in range(len(trade_rngs))]
+  if len(active_slots) == 1:
+    return [sample_indices(schedule_rng, num_traders, len(active_slots[0]))]
+
+  slots = sorted(set().union(*active_slots))
+  slot_traders = dict(zip(slots, sample_indices(schedule_rng, num_traders, len(slots))))
+  return [[slot_traders[slot] for slot in amm_slots] for amm_slots in active_slots]
+
+''' the object based step loop of run_swap_simulation, the reference for the fast mode '''
+def _run_swap_steps(
+  num_retail_traders, num_arb_traders, trade_prob,
+  oracle: Oracle, amm_list: list[AMM], max_steps, arb_mode, recorder: EventRecorder, rng=random, sampling="shuffle",
+  state: SimulationState=None):
+
+  _attach_recorder(amm_list, recorder)
+  state = _get_state(state, num_retail_traders, num_arb_traders, oracle, amm_list, arb_mode, rng)
+  schedule_rng, trade_rngs, retail_traders, arb_traders = state.schedule_rng, state.trade_rngs, state.retail_traders, state.arb_traders
+  traders = state.traders
   tvl_ratio_change_list = [[] for _ in range(len(amm_list))]
 
-  max_y_plot = 0
-  min_y_plot = 1000000
   for _ in range(max_steps):
-    random.shuffle(traders)
-    selected_len = int(random.random() * len(traders))
-    for k in range(len(amm_list)):
-      for j in range(selected_len):
-        if random.random() < trade_prob:
-          traders[j].maybe_execute_trade(amm_list[k])
+    if recorder is not None:
+      recorder.step = oracle.index
+    if sampling == "binomial":
+      ''' the gates are drawn up front, the shuffle loop below interleaves them with the trades '''
+      active_traders = _get_active_traders(schedule_rng, trade_rngs, len(traders), trade_prob)
+      for k in range(len(amm_list)):
+        for trader in active_traders[k]:
+          if trader < num_retail_traders:
+            if recorder is not None:
+              recorder.actor = ACTOR_RETAIL
+            retail_traders[k].maybe_execute_trade(trader, amm_list[k])
+          else:
+            if recorder is not None:
+              recorder.actor = ACTOR_ARB
+            arb_traders[k].maybe_execute_trade(amm_list[k])
 
-      tvl_ratio_change_list[k].append(amm_list[k].get_tvl_ratio_to_initial_state())
-    
-    steps += 1
+        tvl_ratio_change_list[k].append(amm_list[k].get_tvl_ratio_to_initial_state())
+    else:
+      schedule_rng.shuffle(traders)
+      selected_len = int(schedule_rng.random() * len(traders))
+      for k in range(len(amm_list)):
+        trade_rng = trade_rngs[k]
+        for j in range(selected_len):
+          if trade_rng.random() < trade_prob:
+            if traders[j] < num_retail_traders:
+              if recorder is not None:
+                recorder.actor = ACTOR_RETAIL
+              retail_traders[k].maybe_execute_trade(traders[j], amm_list[k])
+            else:
+              if recorder is not None:
+                recorder.actor = ACTOR_ARB
+              arb_traders[k].maybe_execute_trade(amm_list[k])
 
+        tvl_ratio_change_list[k].append(amm_list[k].get_tvl_ratio_to_initial_state())
+
+    state.cycle += 1
     if oracle.step_foward() is False:
       break
 
-  steps = [i for i in range(steps)]
+  if recorder is not None:
+    recorder.flush()
+  return tvl_ratio_change_list
+
+'''
+fast=True runs the whole step loop as one compiled routine (see fast_simulation.py),
+it matches the object based loop in distribution but does not support the event recorder
+without numba the routine would run as plain python, slower than the object based loop, so fast=True
+then runs the object based loop
+rng is the random module (default), a random.Random or a RandomStreams (see _get_agents),
+with a RandomStreams the run only depends on its seed
+tape replays a pre-generated order flow (see trade_tape.py) against every amm instead of drawing the trades,
+its trader counts must be num_retail_traders and num_arb_traders, rng is then not used
+sampling="binomial" only draws the traders that trade (see _get_active_traders), same statistics as the default
+"shuffle" but a step costs O(active trades) instead of O(population)
+state continues a SimulationState (see above) with the object based loop, rng is then the one of the state
+'''
+def run_swap_simulation(
+  num_retail_traders, num_arb_traders, trade_prob, 
+  oracle: Oracle, amm_list: list[AMM], 
+  plt=None, max_steps=None, title="", arb_mode="search", recorder: EventRecorder=None, fast=False, rng=random,
+  tape: TradeTape=None, sampling="shuffle", state: SimulationState=None):
+  
+  assert(sampling in SAMPLING_MODES)
+  assert(sampling == "shuffle" or (tape is None and fast is False))
+  assert(state is None or (tape is None and fast is False))
+  if max_steps is None:
+    max_steps = oracle.max_index
 
+  if tape is not None:
+    assert(fast is False)
+    assert(tape.num_retail_traders == num_retail_traders and tape.num_arb_traders == num_arb_traders)
+    tvl_ratio_change_list = replay_trade_tape(tape, trade_prob, oracle, amm_list, max_steps=max_steps, arb_mode=arb_mode, recorder=recorder)
+  elif fast is True and HAS_NUMBA:
+    assert(recorder is None)
+    tvl_ratio_change_list = run_fast_swap_simulation(
+      num_retail_traders, num_arb_traders, trade_prob, oracle, amm_list, max_steps=max_steps, arb_mode=arb_mode, rng=rng)
+  else:
+    assert(fast is False or recorder is None)
+    tvl_ratio_change_list = _run_swap_steps(
+      num_retail_traders, num_arb_traders, trade_prob, oracle, amm_list, max_steps, arb_mode, recorder, rng, sampling, state)
+
+  steps = [i for i in range(len(tvl_ratio_change_list[0]) if len(amm_list) > 0 else 0)]
+
+  max_y_plot = 0
+  min_y_plot = 1000000
   if not plt is None:
     plt.figure(figsize = (24,12))
 
@@ -100,3 +352,145 @@ def run_swap_simulation(
     # plt.gca().set_ylim()
     plt.grid()
     plt.show()
+
+
+  return tvl_ratio_change_list
+
+
+# kinds of the events of run_event_simulation, events at the same time run in this order
+EVENT_ARRIVAL = 0
+EVENT_LP_WITHDRAW = 1
+EVENT_LP_DEPOSIT = 2
+EVENT_RECORD = 3
+
+'''
+index of the oracle at time, the last update at or before time
+oracle_times are the (sorted) times of the oracle updates, None for one update per unit of time
+'''
+def _get_oracle_index(oracle: Oracle, oracle_times, time):
+  if oracle_times is None:
+    return min(max(int(math.floor(time)), 0), oracle.max_index)
+  return min(max(int(np.searchsorted(oracle_times, time, side="right")) - 1, 0), oracle.max_index)
+
+'''
+event driven run_swap_simulation: trades happen at trader arrival times instead of every cycle
+the events sit in a priority queue: trader arrivals, lp events (lp_bots[k] of amm_list[k]) and tvl records
+(every record_interval, or after every arrival when None)
+an lp cycle lasts lp_interval, cycle c ends at start time + (c + 1) * lp_interval, where run_lp_simulation would call
+update_record(c): a deposit event per cycle while the bot has room (none while it is full, the next one comes with the
+withdrawal that frees a slot) and a withdrawal event per cycle at which records are due, so a quiet horizon costs
+one lp event per deposit and per due cycle, not one update of every bot per lp_interval
+the oracle is not stepped update by update, it is moved to the last update before an event when the event runs,
+so a quiet period costs one binary search in oracle_times (e.g. the pyth slots) whatever its length
+
+arrivals are either a poisson process of arrival_rate arrivals per unit of time (arrival_rate=num_traders*trade_prob/2
+per oracle step gives the mean trade count of run_swap_simulation) or the sorted arrival_times, e.g. the binance
+trade timestamps (get_binance_trade_columns), on the clock of oracle_times
+an arrival picks a uniform trader of the population, which trades on every amm of amm_list
+rng as in run_swap_simulation, returns (record_times, tvl_ratio_change_list)
+'''
+def run_event_simulation(
+  num_retail_traders, num_arb_traders, oracle: Oracle, amm_list: list[AMM],
+  arrival_rate=None, arrival_times=None, oracle_times=None, end_time=None, record_interval=None,
+  lp_bots: list[LPBot]=None, lp_interval=None, arb_mode="search", recorder: EventRecorder=None, rng=random):
+
+  assert((arrival_rate is None) != (arrival_times is None))
+  assert((lp_bots is None) == (lp_interval is None))
+  if end_time is None:
+    end_time = oracle.max_index if oracle_times is None else oracle_times[oracle.max_index]
+  _attach_recorder(amm_list, recorder)
+  schedule_rng, _, retail_traders, arb_traders = _get_agents(rng, oracle, len(amm_list), num_retail_traders, arb_mode)
+  num_traders = num_retail_traders + num_arb_traders
+
+  start_time = oracle.index if oracle_times is None else oracle_times[oracle.index]
+  events = []
+  seq = 0
+  if arrival_rate is not None:
+    heapq.heappush(events, (start_time - math.log(1 - schedule_rng.random()) / arrival_rate, EVENT_ARRIVAL, seq))
+  else:
+    arrival_times = np.asarray(arrival_times)
+    next_arrival = int(np.searchsorted(arrival_times, start_time, side="left"))
+    if next_arrival < len(arrival_times):
+      heapq.heappush(events, (arrival_times[next_arrival], EVENT_ARRIVAL, seq))
+  if record_interval is not None:
+    heapq.heappush(events, (start_time + record_interval, EVENT_RECORD, seq))
+
+  ''' lp events carry (bot, cycle), scheduled_withdrawals avoids a second event for a due cycle already in the queue '''
+  scheduled_withdrawals = set()
+  def schedule_withdrawal(k, cycle):
+    if (k, cycle) not in scheduled_withdrawals:
+      scheduled_withdrawals.add((k, cycle))
+      heapq.heappush(events, (start_time + (cycle + 1) * lp_interval, EVENT_LP_WITHDRAW, seq, k, cycle))
+
+  deposit_paused = [False] * (0 if lp_bots is None else len(lp_bots))
+  for k in range(len(deposit_paused)):
+    for cycle in lp_bots[k].get_due_cycles(0):
+      schedule_withdrawal(k, cycle)
+    deposit_paused[k] = lp_bots[k].is_full()
+    if not deposit_paused[k]:
+      heapq.heappush(events, (start_time + lp_interval, EVENT_LP_DEPOSIT, seq, k, 0))
+  record_times = []
+  tvl_ratio_change_list = [[] for _ in range(len(amm_list))]
+
+  while len(events) > 0 and events[0][0] <= end_time:
+    event = heapq.heappop(events)
+    time, kind = event[0], event[1]
+    index = _get_oracle_index(oracle, oracle_times, time)
+    if index != oracle.index:
+      oracle.set_index(index)
+    if recorder is not None:
+      recorder.step = oracle.index
+    seq += 1
+
+    if kind == EVENT_ARRIVAL:
+      trader = int(schedule_rng.random() * num_traders)
+      for k in range(len(amm_list)):
+        if trader < num_retail_traders:
+          if recorder is not None:
+            recorder.actor = ACTOR_RETAIL
+          retail_traders[k].maybe_execute_trade(trader, amm_list[k])
+        else:
+          if recorder is not None:
+            recorder.actor = ACTOR_ARB
+          arb_traders[k].maybe_execute_trade(amm_list[k])
+
+      if arrival_rate is not None:
+        heapq.heappush(events, (time - math.log(1 - schedule_rng.random()) / arrival_rate, EVENT_ARRIVAL, seq))
+      else:
+        next_arrival += 1
+        if next_arrival < len(arrival_times):
+          heapq.heappush(events, (arrival_times[next_arrival], EVENT_ARRIVAL, seq))
+
+    elif kind == EVENT_LP_WITHDRAW:
+      k, cycle = event[3], event[4]
+      scheduled_withdrawals.discard((k, cycle))
+      if recorder is not None:
+        recorder.actor = ACTOR_LP
+      num_withdrawn, num_still_due = lp_bots[k].withdraw_due(cycle)
+      if num_still_due > 0:
+        schedule_withdrawal(k, cycle + lp_bots[k].min_holding_cycles)
+      if num_withdrawn > 0 and deposit_paused[k]:
+        deposit_paused[k] = False
+        heapq.heappush(events, (time, EVENT_LP_DEPOSIT, seq, k, cycle))
+
+    elif kind == EVENT_LP_DEPOSIT:
+      k, cycle = event[3], event[4]
+      if recorder is not None:
+        recorder.actor = ACTOR_LP
+      if lp_bots[k].maybe_deposit(cycle):
+        schedule_withdrawal(k, cycle + lp_bots[k].min_holding_cycles)
+      deposit_paused[k] = lp_bots[k].is_full()
+      if not deposit_paused[k]:
+        heapq.heappush(events, (start_time + (cycle + 2) * lp_interval, EVENT_LP_DEPOSIT, seq, k, cycle + 1))
+
+    elif kind == EVENT_RECORD:
+      heapq.heappush(events, (time + record_interval, EVENT_RECORD, seq))
+
+    if kind == EVENT_RECORD or (kind == EVENT_ARRIVAL and record_interval is None):
+      record_times.append(time)
+      for k in range(len(amm_list)):
+        tvl_ratio_change_list[k].append(amm_list[k].get_tvl_ratio_to_initial_state())
+
+  if recorder is not None:
+    recorder.flush()
+  return record_times, tvl_ratio_change_list
@@ -0,0 +1,209 @@
+import csv
+import hashlib
+import itertools
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import exists
+
+import numpy as np
+import pandas as pd
+
+from .price_data import Oracle, get_binance_price_data_history, generate_conf_interval
+from .prototypes import AMM
+from .deltafi_amm import DeltafiAMM
+from .uniswap_amm import UniswapAMM
+from .internal_arb_amm import DeltafiInternalArbAMM, UniswapInternalArbAMM
+from .simulation import run_swap_simulation
+from .rng import RandomStreams
+from .trade_tape import load_trade_tape
+
+'''
+parameter sweep over amm and trader settings, run on a process pool
+
+a config is a flat dict, missing keys are taken from DEFAULT_CONFIG
+to run several seeds of the same setting, add a "repeat" key to the grid: it only changes the seed
+a "tape" key (filename of a saved TradeTape) replays that order flow instead of drawing the trades,
+so every config of the sweep sees the same trades
+'''
+
+DEFAULT_CONFIG = {
+  "amm": "deltafi",
+  "fee_rate": 0,
+  "enable_price_adjustment": False,
+  "enable_conf_interval": False,
+  "arb_pool_ratio": 0.1,
+  "arb_rebalance_ratio": 1,
+  "initial_reserve_B": 1000,
+  "num_retail_traders": 100,
+  "num_arb_traders": 10,
+  "trade_prob": 0.1,
+  "arb_mode": "search",
+  "max_steps": None,
+  "repeat": 0,
+}
+
+RESULT_FIELDS = [
+  "config_id", "seed", "steps", "final_tvl_ratio", "min_tvl_ratio", "max_tvl_ratio", "mean_tvl_ratio",
+]
+
+''' all the combinations of the values in param_grid, e.g. {"fee_rate": [0, 0.001], "trade_prob": [0.1, 0.5]} '''
+def grid_configs(param_grid: dict) -> list[dict]:
+  keys = sorted(param_grid.keys())
+  return [dict(zip(keys, values)) for values in itertools.product(*[param_grid[key] for key in keys])]
+
+'''
+num_configs random configs drawn from param_space
+a list value is sampled as a choice, a (low, high) tuple is sampled uniformly (as int if both bounds are int)
+'''
+def random_configs(param_space: dict, num_configs, seed=0) -> list[dict]:
+  rng = random.Random(seed)
+  configs = []
+  for _ in range(num_configs):
+    config = {}
+    for key in sorted(param_space.keys()):
+      value = param_space[key]
+      if isinstance(value, tuple):
+        low, high = value
+        if isinstance(low, int) and isinstance(high, int):
+          config[key] = rng.randint(low, high)
+        else:
+          config[key] = rng.uniform(low, high)
+      else:
+        config[key] = rng.choice(value)
+    configs.append(config)
+  return configs
+
+def _complete_config(config: dict) -> dict:
+  completed = dict(DEFAULT_CONFIG)
+  completed.update(config)
+  return completed
+
+''' stable id of a config, used for resuming a sweep and for deriving its seed '''
+def get_config_id(config: dict) -> str:
+  encoded = json.dumps(_complete_config(config), sort_keys=True, default=str)
+  return hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+def get_config_seed(config: dict, base_seed=0) -> int:
+  return int(get_config_id(config), 16) % (2**31) + base_seed
+
+''' build the amm described by config on top of the given oracle '''
+def build_amm(config: dict, oracle: Oracle) -> AMM:
+  config = _complete_config(config)
+  initial_reserve_B = config["initial_reserve_B"]
+  initial_reserve_A = config.get("initial_reserve_A", initial_reserve_B * oracle.get_price())
+
+  if config["amm"] == "deltafi":
+    ''' the price mode keys are optional, so that adding them does not change the id of the existing configs '''
+    return DeltafiAMM(
+      initial_reserve_A, initial_reserve_B, oracle, fee_rate=config["fee_rate"],
+      enable_price_adjustment=config["enable_price_adjustment"], enable_conf_interval=config["enable_conf_interval"],
+      price_mode=config.get("price_mode", "spot"), price_window=config.get("price_window"), price_blend=config.get("price_blend", 1))
+  if config["amm"] == "uniswap":
+    return UniswapAMM(initial_reserve_A, initial_reserve_B, oracle, fee_rate=config["fee_rate"])
+  if config["amm"] == "deltafi_internal_arb":
+    return DeltafiInternalArbAMM(
+      initial_reserve_A, initial_reserve_B, oracle, arb_pool_ratio=config["arb_pool_ratio"],
+      arb_rebalance_ratio=config["arb_rebalance_ratio"], fee_rate=config["fee_rate"])
+  if config["amm"] == "uniswap_internal_arb":
+    return UniswapInternalArbAMM(
+      initial_reserve_A, initial_reserve_B, oracle, arb_pool_ratio=config["arb_pool_ratio"],
+      arb_rebalance_ratio=config["arb_rebalance_ratio"], fee_rate=config["fee_rate"])
+  raise ValueError("unknown amm type: " + str(config["amm"]))
+
+''' default oracle factory: binance price history with conf intervals sampled from pyth '''
+def build_binance_oracle(step_len=60) -> Oracle:
+  price_history = get_binance_price_data_history(step_len)
+  return Oracle(price_history, generate_conf_interval(price_history))
+
+'''
+run one config in a worker process
+the oracle and the amm are built inside the worker, after seeding the rng from the config id,
+the agents draw from RandomStreams of the same seed, so a row does not depend on the worker that ran it
+'''
+def run_config(config: dict, oracle_factory=build_binance_oracle, base_seed=0) -> dict:
+  seed = get_config_seed(config, base_seed)
+  random.seed(seed)
+  np.random.seed(seed)
+
+  completed = _complete_config(config)
+  oracle = oracle_factory()
+  amm = build_amm(completed, oracle)
+  tape = load_trade_tape(completed["tape"]) if completed.get("tape") is not None else None
+  tvl_ratio_change_list = run_swap_simulation(
+    completed["num_retail_traders"], completed["num_arb_traders"], completed["trade_prob"],
+    oracle, [amm], max_steps=completed["max_steps"], arb_mode=completed["arb_mode"], rng=RandomStreams(seed), tape=tape)[0]
+
+  row = dict(completed)
+  row.update({
+    "config_id": get_config_id(config),
+    "seed": seed,
+    "steps": len(tvl_ratio_change_list),
+    "final_tvl_ratio": tvl_ratio_change_list[-1],
+    "min_tvl_ratio": min(tvl_ratio_change_list),
+    "max_tvl_ratio": max(tvl_ratio_change_list),
+    "mean_tvl_ratio": sum(tvl_ratio_change_list) / len(tvl_ratio_change_list),
+  })
+  return row
+
+'''
+the header of output_filename extended with the columns of fieldnames it lacks, the existing rows are rewritten
+under the new header (empty in the added columns), so a resumed sweep keeps the config keys its new configs add
+'''
+def _extend_header(output_filename, fieldnames) -> list:
+  with open(output_filename, "r", newline="") as inputFile:
+    reader = csv.DictReader(inputFile)
+    header = list(reader.fieldnames)
+    missing = [name for name in fieldnames if name not in header]
+    if len(missing) == 0:
+      return header
+    rows = list(reader)
+
+  header += missing
+  temp_filename = output_filename + ".tmp"
+  with open(temp_filename, "w", newline="") as outputFile:
+    writer = csv.DictWriter(outputFile, fieldnames=header)
+    writer.writeheader()
+    writer.writerows(rows)
+  os.replace(temp_filename, output_filename)
+  return header
+
+def _read_finished_config_ids(output_filename) -> set:
+  if not exists(output_filename):
+    return set()
+  with open(output_filename, "r", newline="") as inputFile:
+    return set(row["config_id"] for row in csv.DictReader(inputFile) if row.get("config_id"))
+
+'''
+run every config on a process pool and append one row per finished run to output_filename (csv)
+configs already present in output_filename are skipped, so an interrupted sweep can simply be restarted,
+and the columns of the new configs missing from an existing output_filename are added to it (see _extend_header)
+oracle_factory must be picklable (a module level function or a functools.partial of one)
+returns the whole result table
+'''
+def run_sweep(configs: list[dict], output_filename, oracle_factory=build_binance_oracle, max_workers=None, base_seed=0) -> pd.DataFrame:
+  finished_config_ids = _read_finished_config_ids(output_filename)
+  pending_configs = []
+  for config in configs:
+    config_id = get_config_id(config)
+    if config_id not in finished_config_ids:
+      finished_config_ids.add(config_id)
+      pending_configs.append(config)
+
+  fieldnames = RESULT_FIELDS + sorted(set(DEFAULT_CONFIG.keys()).union(*[config.keys() for config in configs]))
+  write_header = not exists(output_filename) or os.path.getsize(output_filename) == 0
+  if not write_header:
+    fieldnames = _extend_header(output_filename, fieldnames)
+
+  with open(output_filename, "a", newline="") as outputFile, ProcessPoolExecutor(max_workers=max_workers) as executor:
+    writer = csv.DictWriter(outputFile, fieldnames=fieldnames)
+    if write_header:
+      writer.writeheader()
+
+    futures = [executor.submit(run_config, config, oracle_factory, base_seed) for config in pending_configs]
+    for future in as_completed(futures):
+      writer.writerow(future.result())
+      outputFile.flush()
+
+  return pd.read_csv(output_filename)
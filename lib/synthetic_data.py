@@ -0,0 +1,148 @@
+import numpy as np
+from .price_data import Oracle, BatchOracle, PYTH_DATA_FILE
+from .series_cache import get_cache_dir, has_columns, load_columns
+from .rng import RandomStreams
+
+'''
+synthetic price paths generated in bulk with numpy, for simulations that do not need the raw data dumps
+
+a path is a price series, its conf interval series and its rolling twap, all num_steps + 1 long (step 0 is initial_price)
+price models:
+  - "gbm": geometric brownian motion, log returns mu - sigma^2/2 + sigma * N(0, 1) per step
+  - "jump_diffusion": gbm plus poisson(jump_intensity) jumps per step, each of log size N(jump_mean, jump_std^2)
+  - "bootstrap": block bootstrap of historical log returns, blocks of block_len consecutive returns
+the conf interval of a path is the price times a conf interval ratio, block bootstrapped from the historical ratios,
+with the bootstrap model the ratio drawn at a step is the one observed with the drawn return
+gbm and jump_diffusion without historical samples use a fixed ratio (conf_interval_ratio), so only the bootstrap
+model needs the pyth series cache
+
+path i of a seed is drawn from its own stream of RandomStreams(seed), so it does not depend on the other paths
+and a large set of paths can be generated chunk by chunk (see iter_synthetic_paths)
+'''
+
+MODELS = ("gbm", "jump_diffusion", "bootstrap")
+DEFAULT_TWAP_WINDOW = 60
+DEFAULT_BLOCK_LEN = 1000
+''' conf interval ratio of the parametric models when no historical ratios are given, ~0.05% of the price '''
+DEFAULT_CONF_INTERVAL_RATIO = 0.0005
+
+''' pyth log returns and conf interval ratios, read from the series cache only (the raw dump is never parsed) '''
+def get_pyth_samples() -> dict:
+  cache_dir = get_cache_dir("pyth", PYTH_DATA_FILE)
+  if not has_columns(cache_dir, PYTH_DATA_FILE):
+    raise FileNotFoundError("no pyth series cache in " + cache_dir + ", build it once with price_data.get_pyth_columns()")
+  columns = load_columns(cache_dir)
+  return {
+    "log_returns": np.diff(np.log(columns["price"])),
+    "conf_interval_ratio": np.asarray(columns["conf_interval_ratio"]),
+  }
+
+''' length sample indices of a moving block bootstrap over num_samples samples: random blocks of block_len consecutive indices '''
+def get_block_bootstrap_indices(num_samples, length, block_len, rng: np.random.Generator):
+  block_len = min(block_len, num_samples)
+  num_blocks = -(-length // block_len)
+  starts = rng.integers(0, num_samples - block_len + 1, num_blocks)
+  return (starts[:, None] + np.arange(block_len)).ravel()[:length]
+
+''' mean of the last window values at every index (fewer at the start), along the first axis '''
+def get_rolling_mean(values, window):
+  cumsum = np.cumsum(values, axis=0)
+  result = cumsum.copy()
+  result[window:] -= cumsum[:-window]
+  counts = np.minimum(np.arange(1, len(values) + 1), window)
+  return result / counts.reshape((-1,) + (1,) * (values.ndim - 1))
+
+'''
+prices, conf intervals and twaps of num_paths paths, each a (num_steps + 1, num_paths) array
+the rows are steps so that a row is the state of every path at one step, as read by BatchOracle
+'''
+class SyntheticPaths():
+  def __init__(self, prices, conf_intervals, twaps) -> None:
+    assert(prices.shape == conf_intervals.shape == twaps.shape)
+    self.prices = prices
+    self.conf_intervals = conf_intervals
+    self.twaps = twaps
+
+  def get_num_paths(self):
+    return self.prices.shape[1]
+
+  ''' scalar oracle on path, for run_swap_simulation '''
+  def get_oracle(self, path) -> Oracle:
+    return Oracle(self.prices[:, path], self.conf_intervals[:, path], self.twaps[:, path])
+
+  ''' oracle on all the paths, for run_batch_swap_simulation with num_paths=get_num_paths() '''
+  def get_batch_oracle(self) -> BatchOracle:
+    return BatchOracle(self.prices, self.conf_intervals, self.twaps)
+
+def _get_log_returns(model, num_steps, rng: np.random.Generator, samples, params: dict):
+  if model == "gbm" or model == "jump_diffusion":
+    sigma = params["sigma"]
+    log_returns = (params["mu"] - sigma**2 / 2) + sigma * rng.standard_normal(num_steps)
+    if model == "jump_diffusion":
+      num_jumps = rng.poisson(params["jump_intensity"], num_steps)
+      log_returns += num_jumps * params["jump_mean"] + np.sqrt(num_jumps) * params["jump_std"] * rng.standard_normal(num_steps)
+    return log_returns, None
+
+  if model == "bootstrap":
+    historical_log_returns = samples["log_returns"]
+    indices = get_block_bootstrap_indices(len(historical_log_returns), num_steps, params["block_len"], rng)
+    return np.asarray(historical_log_returns[indices], dtype=np.float64), indices
+
+  raise ValueError("unknown price model: " + str(model))
+
+'''
+num_paths paths of model, the paths first_path to first_path + num_paths - 1 of seed (an int or a RandomStreams)
+samples holds the historical "log_returns" (bootstrap model) and "conf_interval_ratio" arrays, default get_pyth_samples()
+for the bootstrap model and none for gbm and jump_diffusion, which then use conf_interval_ratio at every step
+(default DEFAULT_CONF_INTERVAL_RATIO), a conf_interval_ratio passed with samples replaces the historical ratios
+mu and sigma (gbm part) and the jump parameters are per step
+'''
+def generate_synthetic_paths(
+  num_paths, num_steps, initial_price, model="gbm", seed=0, first_path=0,
+  mu=0, sigma=0.001, jump_intensity=0.001, jump_mean=0, jump_std=0.01,
+  samples: dict=None, block_len=DEFAULT_BLOCK_LEN, twap_window=DEFAULT_TWAP_WINDOW, conf_interval_ratio=None) -> SyntheticPaths:
+
+  assert(model in MODELS)
+  streams = seed if isinstance(seed, RandomStreams) else RandomStreams(seed)
+  if samples is None and model == "bootstrap":
+    samples = get_pyth_samples()
+  if conf_interval_ratio is None and samples is None:
+    conf_interval_ratio = DEFAULT_CONF_INTERVAL_RATIO
+  params = {"mu": mu, "sigma": sigma, "jump_intensity": jump_intensity, "jump_mean": jump_mean, "jump_std": jump_std, "block_len": block_len}
+
+  prices = np.empty((num_steps + 1, num_paths))
+  conf_intervals = np.empty((num_steps + 1, num_paths))
+  log_prices = np.empty(num_steps + 1)
+  for i in range(num_paths):
+    rng = streams.get_generator("synthetic_path", first_path + i)
+    log_returns, return_indices = _get_log_returns(model, num_steps, rng, samples, params)
+
+    log_prices[0] = np.log(initial_price)
+    np.cumsum(log_returns, out=log_prices[1:])
+    log_prices[1:] += log_prices[0]
+    prices[:, i] = np.exp(log_prices)
+
+    ''' a return i is observed between the ratios i and i + 1, the ratio of a step follows its return '''
+    if conf_interval_ratio is not None:
+      conf_intervals[:, i] = prices[:, i] * conf_interval_ratio
+      continue
+    historical_conf_interval_ratio = samples["conf_interval_ratio"]
+    if return_indices is not None and len(return_indices) > 0:
+      conf_indices = np.concatenate([return_indices[:1], return_indices + 1])
+    else:
+      conf_indices = get_block_bootstrap_indices(len(historical_conf_interval_ratio), num_steps + 1, block_len, rng)
+    conf_intervals[:, i] = prices[:, i] * historical_conf_interval_ratio[conf_indices]
+
+  return SyntheticPaths(prices, conf_intervals, get_rolling_mean(prices, twap_window))
+
+''' generate_synthetic_paths in chunks of chunk_num_paths paths, the same paths as in one call whatever the chunk size '''
+def iter_synthetic_paths(num_paths, num_steps, initial_price, chunk_num_paths, **kwargs):
+  if kwargs.get("samples") is None and kwargs.get("model", "gbm") == "bootstrap":
+    kwargs["samples"] = get_pyth_samples()
+  for first_path in range(0, num_paths, chunk_num_paths):
+    yield generate_synthetic_paths(
+      min(chunk_num_paths, num_paths - first_path), num_steps, initial_price, first_path=first_path, **kwargs)
+
+''' oracle factory on one synthetic path, picklable through functools.partial, e.g. as oracle_factory of a sweep '''
+def build_synthetic_oracle(num_steps, initial_price, path=0, **kwargs) -> Oracle:
+  return generate_synthetic_paths(1, num_steps, initial_price, first_path=path, **kwargs).get_oracle(0)
@@ -0,0 +1,160 @@
+import numpy as np
+from .price_data import Oracle
+from .prototypes import AMM
+from .trading_bots import ArbAgent
+from .recorder import EventRecorder, ACTOR_RETAIL, ACTOR_ARB
+from .rng import RandomStreams
+from .batch_simulation import RETAIL_MAX_SELL_A_AMOUNT, RETAIL_MAX_PRICE_RANGE
+
+'''
+pre-generated order flow: the trade intents of every step drawn once into columns, then replayed against every amm,
+so all the pools of a run (or of a sweep) see exactly the same traders, sides, sizes and tolerances
+
+a step selects some traders (the trader slots of the step), every slot holds the uniform draws of one trade attempt,
+with the layout of the batch engine (see batch_simulation.py):
+  - trade_gate: the attempt trades when trade_gate < trade_prob, so one tape serves any trade_prob
+  - side: a retail trader sells A when side < 0.5
+  - price_jitter_A, price_jitter_B: the conf interval jitter of the retail price and of the arb target prices
+  - size: the retail size, a sell of A is RETAIL_MAX_SELL_A_AMOUNT * price_jitter_B * size
+  - price_tolerance: the part of the accepted price range of the retail trader used by the attempt
+the slots of step i are the rows step_offsets[i] to step_offsets[i + 1] of the slot columns
+'''
+
+SLOT_COLUMNS = ("trade_gate", "side", "price_jitter_A", "price_jitter_B", "size", "price_tolerance")
+# steps drawn at once, fixed so that a seed always gives the same tape
+CHUNK_STEPS = 10000
+
+class TradeTape():
+  def __init__(self, num_retail_traders, num_arb_traders, accepted_price_range, step_offsets, trader, columns: dict) -> None:
+    assert(len(accepted_price_range) == num_retail_traders)
+    assert(step_offsets[0] == 0 and step_offsets[-1] == len(trader))
+    assert(all(len(columns[name]) == len(trader) for name in SLOT_COLUMNS))
+    self.num_retail_traders = num_retail_traders
+    self.num_arb_traders = num_arb_traders
+    self.accepted_price_range = accepted_price_range
+    self.step_offsets = step_offsets
+    ''' trader ids below num_retail_traders are retail traders, the others are arbitraguers '''
+    self.trader = trader
+    self.columns = columns
+
+  def get_num_steps(self):
+    return len(self.step_offsets) - 1
+
+  def get_num_slots(self):
+    return len(self.trader)
+
+  ''' the tape as one .npz file '''
+  def save(self, filename):
+    np.savez(
+      filename, num_traders=np.array([self.num_retail_traders, self.num_arb_traders]),
+      accepted_price_range=self.accepted_price_range, step_offsets=self.step_offsets, trader=self.trader, **self.columns)
+
+def load_trade_tape(filename) -> TradeTape:
+  with np.load(filename) as data:
+    num_retail_traders, num_arb_traders = data["num_traders"].tolist()
+    return TradeTape(
+      num_retail_traders, num_arb_traders, data["accepted_price_range"], data["step_offsets"], data["trader"],
+      {name: data[name] for name in SLOT_COLUMNS})
+
+'''
+tape of num_steps steps, seed is an int or a RandomStreams (the "trade_tape" stream is used)
+like run_swap_simulation, a step selects int(u * num_traders) distinct traders in random order
+the steps are drawn CHUNK_STEPS at a time with numpy
+'''
+def generate_trade_tape(num_steps, num_retail_traders, num_arb_traders, seed=None) -> TradeTape:
+  streams = seed if isinstance(seed, RandomStreams) else RandomStreams(seed)
+  rng = streams.get_generator("trade_tape")
+  num_traders = num_retail_traders + num_arb_traders
+  accepted_price_range = RETAIL_MAX_PRICE_RANGE * rng.random(num_retail_traders)
+
+  selected_lens = []
+  traders = []
+  for first_step in range(0, num_steps, CHUNK_STEPS):
+    chunk_len = min(CHUNK_STEPS, num_steps - first_step)
+    selected_len = (rng.random(chunk_len) * num_traders).astype(np.int64)
+    trader_order = rng.permuted(np.tile(np.arange(num_traders, dtype=np.int32), (chunk_len, 1)), axis=1)
+    selected_lens.append(selected_len)
+    traders.append(trader_order[np.arange(num_traders) < selected_len[:, None]])
+
+  selected_len = np.concatenate(selected_lens) if num_steps > 0 else np.zeros(0, dtype=np.int64)
+  step_offsets = np.concatenate([[0], np.cumsum(selected_len)]).astype(np.int64)
+  trader = np.concatenate(traders) if num_steps > 0 else np.zeros(0, dtype=np.int32)
+  draws = rng.random((len(SLOT_COLUMNS), len(trader)))
+  columns = {SLOT_COLUMNS[i]: draws[i] for i in range(len(SLOT_COLUMNS))}
+  return TradeTape(num_retail_traders, num_arb_traders, accepted_price_range, step_offsets, trader, columns)
+
+''' RetailAgentPool.maybe_execute_trade with the draws of a tape slot '''
+def _replay_retail_trade(amm: AMM, price, conf_interval, accepted_price_range, side, price_jitter_A, price_jitter_B, size, price_tolerance):
+  if side < 0.5:
+    price_A_selling_A = 1 / (price + (1 - 2*price_jitter_A)*conf_interval)
+    sell_A_amount = RETAIL_MAX_SELL_A_AMOUNT * price_jitter_B * size
+    accepted_min_B_amount = sell_A_amount * price_A_selling_A * (1 - accepted_price_range * price_tolerance)
+    if amm.get_swap_out_B(sell_A_amount) > accepted_min_B_amount:
+      amm.swap_A_for_B(sell_A_amount)
+  else:
+    price_B_selling_B = price + (1 - 2*price_jitter_A)*conf_interval
+    sell_B_amount = (RETAIL_MAX_SELL_A_AMOUNT / price) * price_jitter_B
+    accept_min_A_amount = sell_B_amount * price_B_selling_B * (1 - accepted_price_range * price_tolerance)
+    if amm.get_swap_out_A(sell_B_amount) > accept_min_A_amount:
+      amm.swap_B_for_A(sell_B_amount)
+
+''' ArbAgent.maybe_execute_trade with the draws of a tape slot '''
+def _replay_arb_trade(arb_trader: ArbAgent, amm: AMM, price, conf_interval, price_jitter_A, price_jitter_B):
+  target_price_A_sell_A = 1 / (price + (2*price_jitter_A - 1)*conf_interval)
+  target_price_B_sell_B = price + (2*price_jitter_B - 1)*conf_interval
+  arb_trader.execute_trade(target_price_A_sell_A, target_price_B_sell_B, amm)
+
+'''
+the step loop of run_swap_simulation driven by tape: every amm of amm_list replays the same slots of every step
+returns the tvl_ratio_change_list of run_swap_simulation
+'''
+def replay_trade_tape(
+  tape: TradeTape, trade_prob, oracle: Oracle, amm_list: list[AMM],
+  max_steps=None, arb_mode="search", recorder: EventRecorder=None) -> list[list[float]]:
+
+  if max_steps is None:
+    max_steps = oracle.max_index
+  max_steps = min(max_steps, tape.get_num_steps())
+  if recorder is not None:
+    for k in range(len(amm_list)):
+      amm_list[k].set_recorder(recorder, k)
+
+  arb_trader = ArbAgent(oracle, arb_mode)
+  num_retail_traders = tape.num_retail_traders
+  accepted_price_range = tape.accepted_price_range.tolist()
+  step_offsets = tape.step_offsets.tolist()
+  tvl_ratio_change_list = [[] for _ in range(len(amm_list))]
+
+  for step in range(max_steps):
+    if recorder is not None:
+      recorder.step = oracle.index
+    start, end = step_offsets[step], step_offsets[step + 1]
+    ''' the slots that trade are the same for every amm, their columns are read once per step '''
+    active = np.flatnonzero(tape.columns["trade_gate"][start:end] < trade_prob) + start
+    traders = tape.trader[active].tolist()
+    side, price_jitter_A, price_jitter_B, size, price_tolerance = [tape.columns[name][active].tolist() for name in SLOT_COLUMNS[1:]]
+    price = oracle.get_price()
+    conf_interval = oracle.get_conf_interval()
+
+    for k in range(len(amm_list)):
+      amm = amm_list[k]
+      for j in range(len(traders)):
+        trader = traders[j]
+        if trader < num_retail_traders:
+          if recorder is not None:
+            recorder.actor = ACTOR_RETAIL
+          _replay_retail_trade(
+            amm, price, conf_interval, accepted_price_range[trader], side[j], price_jitter_A[j], price_jitter_B[j], size[j], price_tolerance[j])
+        else:
+          if recorder is not None:
+            recorder.actor = ACTOR_ARB
+          _replay_arb_trade(arb_trader, amm, price, conf_interval, price_jitter_A[j], price_jitter_B[j])
+
+      tvl_ratio_change_list[k].append(amm.get_tvl_ratio_to_initial_state())
+
+    if oracle.step_foward() is False:
+      break
+
+  if recorder is not None:
+    recorder.flush()
+  return tvl_ratio_change_list
@@ -1,28 +1,35 @@
 from .prototypes import TradingBot, AMM
 from .price_data import Oracle
+from .rng import random_array
+from array import array
+import copy
 import random
 
 # class that simulates regular traders (robinhood traders)
 class RetailAgent(TradingBot):
-    def __init__(self, oracle: Oracle) -> None:
+    __slots__ = ("oracle", "max_sell_A_amount", "max_sell_B_amount", "accepted_price_range", "rng")
+
+    # rng is the random module (default), a random.Random or a BufferedRandom stream of rng.py
+    def __init__(self, oracle: Oracle, rng=random) -> None:
         self.oracle = oracle
+        self.rng = rng
         self.max_sell_A_amount = 2000
         self.max_sell_B_amount = self.max_sell_A_amount / oracle.get_price()
-        self.accepted_price_range = 0.05 * random.random()
+        self.accepted_price_range = 0.05 * rng.random()
 
     def maybe_sell_A_for_B(self, amm: AMM):
-        price_A_selling_A = 1 / (self.oracle.get_price() + (1 - 2*random.random())*self.oracle.get_conf_interval())
-        sell_A_amount = self.max_sell_A_amount * random.random() * random.random()
-        accepted_min_B_amount = sell_A_amount * price_A_selling_A * (1 - self.accepted_price_range * random.random())
+        price_A_selling_A = 1 / (self.oracle.get_price() + (1 - 2*self.rng.random())*self.oracle.get_conf_interval())
+        sell_A_amount = self.max_sell_A_amount * self.rng.random() * self.rng.random()
+        accepted_min_B_amount = sell_A_amount * price_A_selling_A * (1 - self.accepted_price_range * self.rng.random())
         amm_buy_B_amount = amm.get_swap_out_B(sell_A_amount)
 
         if amm_buy_B_amount > accepted_min_B_amount:
             amm.swap_A_for_B(sell_A_amount)
     
     def maybe_sell_B_for_A(self, amm: AMM):
-        price_B_selling_B = self.oracle.get_price() + (1 - 2*random.random())*self.oracle.get_conf_interval()
-        sell_B_amount = self.max_sell_B_amount * random.random()
-        accept_min_A_amount = sell_B_amount * price_B_selling_B * (1 - self.accepted_price_range * random.random())
+        price_B_selling_B = self.oracle.get_price() + (1 - 2*self.rng.random())*self.oracle.get_conf_interval()
+        sell_B_amount = self.max_sell_B_amount * self.rng.random()
+        accept_min_A_amount = sell_B_amount * price_B_selling_B * (1 - self.accepted_price_range * self.rng.random())
         amm_buy_A_amount = amm.get_swap_out_A(sell_B_amount)
 
         if amm_buy_A_amount > accept_min_A_amount:
@@ -30,22 +37,81 @@ class RetailAgent(TradingBot):
     
     def maybe_execute_trade(self, amm: AMM):
         self.max_sell_B_amount = self.max_sell_A_amount / self.oracle.get_price()
-        if random.random() < 0.5:
+        if self.rng.random() < 0.5:
             self.maybe_sell_A_for_B(amm)
         else:
             self.maybe_sell_B_for_A(amm)
 
 
+# population of retail traders with the per trader parameters stored in an array
+# instead of one RetailAgent object per trader, trader i behaves like a RetailAgent
+# whose accepted_price_range is accepted_price_range[i]
+class RetailAgentPool():
+    __slots__ = ("oracle", "max_sell_A_amount", "accepted_price_range", "rng")
+
+    def __init__(self, oracle: Oracle, num_traders, rng=random) -> None:
+        self.oracle = oracle
+        self.rng = rng
+        self.max_sell_A_amount = 2000
+        self.accepted_price_range = array("d", (0.05 * random_array(rng, num_traders)).tolist())
+
+    def __len__(self):
+        return len(self.accepted_price_range)
+
+    # the same traders (accepted price ranges) drawing their trades from rng
+    def with_rng(self, rng):
+        retail_traders = copy.copy(self)
+        retail_traders.rng = rng
+        return retail_traders
+
+    def maybe_sell_A_for_B(self, trader, amm: AMM):
+        price_A_selling_A = 1 / (self.oracle.get_price() + (1 - 2*self.rng.random())*self.oracle.get_conf_interval())
+        sell_A_amount = self.max_sell_A_amount * self.rng.random() * self.rng.random()
+        accepted_min_B_amount = sell_A_amount * price_A_selling_A * (1 - self.accepted_price_range[trader] * self.rng.random())
+        amm_buy_B_amount = amm.get_swap_out_B(sell_A_amount)
+
+        if amm_buy_B_amount > accepted_min_B_amount:
+            amm.swap_A_for_B(sell_A_amount)
+
+    def maybe_sell_B_for_A(self, trader, amm: AMM):
+        price_B_selling_B = self.oracle.get_price() + (1 - 2*self.rng.random())*self.oracle.get_conf_interval()
+        sell_B_amount = (self.max_sell_A_amount / self.oracle.get_price()) * self.rng.random()
+        accept_min_A_amount = sell_B_amount * price_B_selling_B * (1 - self.accepted_price_range[trader] * self.rng.random())
+        amm_buy_A_amount = amm.get_swap_out_A(sell_B_amount)
+
+        if amm_buy_A_amount > accept_min_A_amount:
+            amm.swap_B_for_A(sell_B_amount)
+
+    def maybe_execute_trade(self, trader, amm: AMM):
+        if self.rng.random() < 0.5:
+            self.maybe_sell_A_for_B(trader, amm)
+        else:
+            self.maybe_sell_B_for_A(trader, amm)
+
+
 # Trading bot class that simulates the behavior of arbitraguer
 # An arbitraguer buy at our amm with low price and sell at other exchange with high price
 # to get net gain on one token (we only simulate the behavior the arbitraguers swap at our amm)
+# arb_mode "search" halves the trade size from 10% of the pool balance until it is profitable,
+# arb_mode "optimal" trades the profit maximising size given by the amm
 class ArbAgent(TradingBot):
-    def __init__(self, oracle: Oracle) -> None:
+    __slots__ = ("oracle", "arb_mode", "rng")
+
+    def __init__(self, oracle: Oracle, arb_mode="search", rng=random) -> None:
+        assert(arb_mode in ("search", "optimal"))
         self.oracle = oracle
+        self.rng = rng
+        self.arb_mode = arb_mode
 
     # buy B for less A at our AMM, then sell B for more A in other places
     # the arbitraguer gets net gain on A
     def arbitrage_A(self, target_price_B_sell_B, amm: AMM):
+        if self.arb_mode == "optimal":
+            sell_A_amount = amm.get_optimal_arb_sell_A(target_price_B_sell_B)
+            if sell_A_amount > 0 and amm.get_swap_out_B(sell_A_amount) * target_price_B_sell_B > sell_A_amount:
+                amm.swap_A_for_B(sell_A_amount)
+            return
+
         sell_A_amount = amm.get_balance_A() * 0.1
         buy_B_amount = amm.get_swap_out_B(sell_A_amount)
 
@@ -59,6 +125,12 @@ class ArbAgent(TradingBot):
     # buy A for less B at our AMM, then sell A for more B in other places
     # the arbitraguer gets net gain on B
     def arbitrage_B(self, target_price_A_sell_A, amm: AMM):
+        if self.arb_mode == "optimal":
+            sell_B_amount = amm.get_optimal_arb_sell_B(target_price_A_sell_A)
+            if sell_B_amount > 0 and amm.get_swap_out_A(sell_B_amount) * target_price_A_sell_A > sell_B_amount:
+                amm.swap_B_for_A(sell_B_amount)
+            return
+
         sell_B_amount = amm.get_balance_B() * 0.1
         buy_A_amount = amm.get_swap_out_A(sell_B_amount)
 
@@ -70,9 +142,12 @@ class ArbAgent(TradingBot):
             amm.swap_B_for_A(sell_B_amount)
 
     def maybe_execute_trade(self, amm: AMM):
-        target_price_A_sell_A = 1 / (self.oracle.get_price() + (2*random.random() - 1)*self.oracle.get_conf_interval())
-        target_price_B_sell_B = self.oracle.get_price() + (2*random.random() - 1)*self.oracle.get_conf_interval()
+        target_price_A_sell_A = 1 / (self.oracle.get_price() + (2*self.rng.random() - 1)*self.oracle.get_conf_interval())
+        target_price_B_sell_B = self.oracle.get_price() + (2*self.rng.random() - 1)*self.oracle.get_conf_interval()
+        self.execute_trade(target_price_A_sell_A, target_price_B_sell_B, amm)
 
+    # the arbitrage at the given target prices, both implied prices are read before either trade
+    def execute_trade(self, target_price_A_sell_A, target_price_B_sell_B, amm: AMM):
         implied_price_B_sell_B = amm.get_implied_price_B_for_A()
         implied_price_A_sell_A = amm.get_implied_price_A_for_B()
 
@@ -1,10 +1,18 @@
+import math
+import random
+import numpy as np
 from .prototypes import AMM
+from .recorder import EVENT_SWAP_A_FOR_B, EVENT_SWAP_B_FOR_A
 from .lp_bots import UniswapLPBot
+from .batch_simulation import BatchUniswapAMM
+from .kernels import BACKENDS, uniswap_swap_out
 
 # class that implement uniswap for comparison
 # TODO: add deposit and withdraw after discussion
 class UniswapAMM(AMM):
-  def __init__(self, initial_reserve_A, initial_reserve_B, oracle, fee_rate=0):
+  __slots__ = ("initial_reserve_A", "initial_reserve_B", "share_supply", "oracle", "balance_A", "balance_B", "K", "fee_rate", "backend")
+
+  def __init__(self, initial_reserve_A, initial_reserve_B, oracle, fee_rate=0, backend="python"):
     self.initial_reserve_A = initial_reserve_A
     self.initial_reserve_B = initial_reserve_B
     self.share_supply = initial_reserve_A
@@ -17,6 +25,12 @@ class UniswapAMM(AMM):
     self.balance_B = initial_reserve_B
     self.K = initial_reserve_A * initial_reserve_B
     self.fee_rate = fee_rate
+    # "python" quotes with the methods below, "numba" with the compiled kernels of kernels.py
+    assert(backend in BACKENDS)
+    self.backend = backend
+
+    self.invalidate_step_cache()
+    self.set_recorder(None)
 
   def get_name(self):
     name = "Uniswap"
@@ -37,15 +51,56 @@ class UniswapAMM(AMM):
     return (self.balance_B / self.balance_A) * (1 - self.fee_rate)
 
   def get_swap_out_A(self, token_B_input):
+    if self.backend == "numba":
+      return uniswap_swap_out(self.balance_B, self.balance_A, self.fee_rate, token_B_input)
     k = self.balance_A * self.balance_B
     token_A_output = self.balance_A - k / (self.balance_B + token_B_input)
     return token_A_output*(1 - self.fee_rate)
 
   def get_swap_out_B(self, token_A_input):
+    if self.backend == "numba":
+      return uniswap_swap_out(self.balance_A, self.balance_B, self.fee_rate, token_A_input)
     k = self.balance_A * self.balance_B
     token_B_output = self.balance_B - k / (self.balance_A + token_A_input)
     return token_B_output*(1 - self.fee_rate)
 
+  # marginal output (1 - fee) * k / (balance + input)^2 equals 1 / target price at the optimum
+  def get_optimal_arb_sell_A(self, target_price_B_sell_B):
+    k = self.balance_A * self.balance_B
+    return max(0, math.sqrt((1 - self.fee_rate) * k * target_price_B_sell_B) - self.balance_A)
+
+  def get_optimal_arb_sell_B(self, target_price_A_sell_A):
+    k = self.balance_A * self.balance_B
+    return max(0, math.sqrt((1 - self.fee_rate) * k * target_price_A_sell_A) - self.balance_B)
+
+  # quote ladders over arrays of sizes and their closed form inverses, with numpy whatever the backend
+  def get_swap_out_A_ladder(self, token_B_inputs):
+    return uniswap_swap_out(self.balance_B, self.balance_A, self.fee_rate, np.asarray(token_B_inputs, dtype=float))
+
+  def get_swap_out_B_ladder(self, token_A_inputs):
+    return uniswap_swap_out(self.balance_A, self.balance_B, self.fee_rate, np.asarray(token_A_inputs, dtype=float))
+
+  # (balance_in + input) * (balance_out - output / (1 - fee)) = k, inf once the output reaches the balance
+  def _get_swap_in(self, balance_in, balance_out, token_outputs):
+    remaining_out = np.maximum(balance_out - np.asarray(token_outputs, dtype=float) / (1 - self.fee_rate), 0)
+    with np.errstate(divide="ignore"):
+      return balance_in * balance_out / remaining_out - balance_in
+
+  def get_swap_in_B(self, token_A_outputs):
+    return self._get_swap_in(self.balance_B, self.balance_A, token_A_outputs)
+
+  def get_swap_in_A(self, token_B_outputs):
+    return self._get_swap_in(self.balance_A, self.balance_B, token_B_outputs)
+
+  # marginal price (1 - fee) * k / (balance_in + input)^2, see get_optimal_arb_sell_A
+  def get_swap_in_A_for_price(self, implied_prices_A_for_B):
+    k = self.balance_A * self.balance_B
+    return np.maximum(0, np.sqrt((1 - self.fee_rate) * k / np.asarray(implied_prices_A_for_B, dtype=float)) - self.balance_A)
+
+  def get_swap_in_B_for_price(self, implied_prices_B_for_A):
+    k = self.balance_A * self.balance_B
+    return np.maximum(0, np.sqrt((1 - self.fee_rate) * k / np.asarray(implied_prices_B_for_A, dtype=float)) - self.balance_B)
+
   def swap_A_for_B(self, token_A_input):
     implied_price = self.get_implied_price_A_for_B()
 
@@ -54,6 +109,8 @@ class UniswapAMM(AMM):
     self.balance_B -= token_B_output
 
     actual_price = token_B_output / token_A_input
+    if self.recorder is not None:
+      self._record_swap(EVENT_SWAP_A_FOR_B, token_A_input, token_B_output, implied_price, actual_price)
     return token_A_input, abs(implied_price - actual_price) / implied_price
 
   def swap_B_for_A(self, token_B_input):
@@ -64,11 +121,18 @@ class UniswapAMM(AMM):
     self.balance_B += token_B_input
 
     actual_price = token_A_output / token_B_input
+    if self.recorder is not None:
+      self._record_swap(EVENT_SWAP_B_FOR_A, token_B_input, token_A_output, implied_price, actual_price)
     return token_A_output, abs(implied_price - actual_price) / implied_price
   
+  # (oracle price, initial tvl at the oracle price)
+  def _compute_step_cache(self):
+    price = self.oracle.get_price()
+    return price, self.initial_reserve_A + self.initial_reserve_B * price
+
   def get_tvl_ratio_to_initial_state(self):
-    current_tvl = self.balance_A + self.balance_B * self.oracle.get_price()
-    initial_tvl = self.initial_reserve_A + self.initial_reserve_B * self.oracle.get_price()
+    price, initial_tvl = self.get_step_cache()
+    current_tvl = self.balance_A + self.balance_B * price
 
     return current_tvl / initial_tvl
   
@@ -92,5 +156,23 @@ class UniswapAMM(AMM):
     self.share_supply -= share
     return token_A_output, token_B_output
 
-  def get_lp_bot(self):
-    return UniswapLPBot(self, self.oracle)
\ No newline at end of file
+  # withdraw of several lp positions at once, the withdraw is pro-rata so it is
+  # the withdraw of the total share split by share, arrays of the amounts are returned
+  def lp_withdraw_batch(self, shares):
+    total_share = shares.sum()
+    token_A_output, token_B_output = self.lp_withdraw(total_share)
+    return token_A_output * (shares / total_share), token_B_output * (shares / total_share)
+
+  def get_lp_bot(self, max_deposit_record=1, min_holding_cycles=10000, deposit_prob=1, withdraw_prob=0.05, rng=random):
+    return UniswapLPBot(
+      self, self.oracle, max_deposit_record=max_deposit_record, min_holding_cycles=min_holding_cycles,
+      deposit_prob=deposit_prob, withdraw_prob=withdraw_prob, rng=rng)
+
+  def get_batch_amm(self, num_paths):
+    return BatchUniswapAMM(self, num_paths)
+
+  def get_state(self):
+    return self.balance_A, self.balance_B, self.K, self.share_supply
+
+  def set_state(self, state):
+    self.balance_A, self.balance_B, self.K, self.share_supply = state